@@ -0,0 +1,131 @@
+import re
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+# Chuỗi số có thể là số tiền (chữ số, dấu phân cách, khoảng trắng); không vượt qua ký tự xuống dòng
+_NUMBER_RE = re.compile(r'[\d\., ]+')
+
+# Chuỗi chỉ gồm chữ số và dấu phân cách
+_AMOUNT_CHARS_RE = re.compile(r'[\d\.,]*')
+
+# Số có dấu phân cách hàng nghìn ("12.500", "1,380,000"): clean_amount giữ nguyên dạng "12.500"
+_THOUSANDS_RE = re.compile(r'\d{1,3}(?:\.\d{3})+|\d{1,3}(?:,\d{3})+')
+
+# Một chuỗi số trong văn bản:
+# - line: chỉ số dòng, offset: vị trí trong dòng, raw: chuỗi gốc
+# - cleaned: kết quả clean_amount, value: giá trị nguyên (bỏ dấu phân cách) hoặc None, valid: is_valid_amount
+NumericToken = namedtuple('NumericToken', ['line', 'offset', 'raw', 'cleaned', 'value', 'valid'])
+
+
+class AmountIndex:
+    """
+    Chỉ mục các chuỗi số của một hóa đơn, xây dựng một lần cho mỗi văn bản.
+
+    Mỗi dòng chỉ được tách số một lần và mỗi chuỗi số chỉ được làm sạch, kiểm tra một lần;
+    các heuristic tìm tổng tiền truy vấn chỉ mục thay vì tách số và làm sạch lại trên từng dòng.
+    Dòng chỉ được tách số khi có heuristic cần đến.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._line_tokens = [None] * len(lines)
+        self._parsed = {}
+
+    def parse(self, raw):
+        """Làm sạch một chuỗi số (có ghi nhớ): trả về (cleaned, value, valid)"""
+        parsed = self._parsed.get(raw)
+        if parsed is None:
+            cleaned = clean_amount(raw)
+            digits = cleaned.replace('.', '').replace(',', '')
+            value = int(digits) if digits.isdigit() else None
+            valid = value is not None and 2 <= len(digits) <= 10
+            parsed = self._parsed[raw] = (cleaned, value, valid)
+        return parsed
+
+    def tokens_on_line(self, line):
+        """Các chuỗi số trên một dòng, theo thứ tự xuất hiện"""
+        tokens = self._line_tokens[line]
+        if tokens is None:
+            tokens = self._line_tokens[line] = [
+                NumericToken(line, match.start(), match.group(), *self.parse(match.group()))
+                for match in _NUMBER_RE.finditer(self.lines[line])
+            ]
+        return tokens
+
+    def tokens_from_line(self, line=0):
+        """Các chuỗi số từ dòng `line` đến hết văn bản"""
+        for i in range(max(line, 0), len(self.lines)):
+            yield from self.tokens_on_line(i)
+
+    def largest_on_line(self, line):
+        """Chuỗi số có giá trị lớn nhất trên dòng (chuỗi đầu tiên nếu bằng nhau), None nếu dòng không có số"""
+        tokens = self.tokens_on_line(line)
+        if not tokens:
+            return None
+        return max(tokens, key=lambda token: token.value or 0)
+
+
+def clean_amount(amount_str):
+    """Làm sạch và định dạng số tiền"""
+    # Loại bỏ khoảng trắng
+    amount_str = amount_str.strip().replace(" ", "")
+    
+    # Chỉ giữ lại số và dấu phân cách (bỏ qua nếu chuỗi đã chỉ gồm các ký tự này)
+    if not _AMOUNT_CHARS_RE.fullmatch(amount_str):
+        amount_str = ''.join(c for c in amount_str if c.isdigit() or c in '.,')
+    
+    # Đảm bảo định dạng nhất quán
+    # Nếu có dấu '.' và ',' trong chuỗi
+    if '.' in amount_str and ',' in amount_str:
+        # Kiểm tra vị trí của dấu '.' và ','
+        dot_pos = amount_str.rfind('.')
+        comma_pos = amount_str.rfind(',')
+        
+        if dot_pos > comma_pos:
+            # Định dạng 1,234.56 - dấu '.' là phân cách thập phân
+            amount_str = amount_str.replace(',', '')
+        else:
+            # Định dạng 1.234,56 - dấu ',' là phân cách thập phân
+            amount_str = amount_str.replace('.', '').replace(',', '.')
+    
+    # Nếu chỉ có dấu ','
+    elif ',' in amount_str:
+        if amount_str.count(',') == 1 and len(amount_str.split(',')[1]) <= 2:
+            # Có thể là dấu thập phân, ví dụ: 123,45
+            amount_str = amount_str.replace(',', '.')
+        else:
+            # Dấu phân cách hàng nghìn, ví dụ: 1,234,567
+            amount_str = amount_str.replace(',', '')
+    
+    return amount_str
+
+def is_valid_amount(amount_str):
+    """Kiểm tra xem chuỗi có phải là số tiền hợp lệ không"""
+    # Loại bỏ dấu '.' và ',' để kiểm tra
+    clean_str = amount_str.replace('.', '').replace(',', '')
+    
+    # Kiểm tra xem có phải là số nguyên không
+    if not clean_str.isdigit():
+        return False
+    
+    # Kiểm tra độ dài - số tiền thường > 2 chữ số và < 10 chữ số
+    if len(clean_str) < 2 or len(clean_str) > 10:
+        return False
+    
+    return True
+
+def amount_to_vnd(amount_str):
+    """
+    Số tiền đã trích xuất (ví dụ "1380000", "50.000", "1000000.50") thành số nguyên đồng (làm tròn phần lẻ),
+    None nếu không phải số tiền hợp lệ theo `is_valid_amount` (ví dụ "Không tìm thấy tổng tiền", hoặc chuỗi số
+    quá dài do ghép nhiều số điện thoại), nên giá trị luôn vừa cột int64 khi xuất dữ liệu.
+    """
+    amount_str = amount_str.strip().replace(" ", "")
+    if not is_valid_amount(clean_amount(amount_str)):
+        return None
+    if _THOUSANDS_RE.fullmatch(amount_str):
+        return int(amount_str.replace('.', '').replace(',', ''))
+    try:
+        return int(Decimal(clean_amount(amount_str)).to_integral_value(ROUND_HALF_UP))
+    except InvalidOperation:
+        return None
@@ -1,54 +1,207 @@
-import streamlit as st
-from process_invoice import extract_invoice_data
-import os
-import tempfile
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Các hàm phụ trợ
-def generate_csv(result):
-    """Tạo file CSV từ kết quả"""
-    import csv
-    import io
+import streamlit as st
+from ocr_backend import content_digest
+from metrics import start_metrics_server
+from history_store import DEFAULT_PAGE_SIZE, get_history_store
+from document_pages import DOCUMENT_EXTENSIONS
+
+# Streamlit chạy lại toàn bộ script mỗi lần người dùng tương tác: các thư viện nặng
+# (google-cloud-vision, pandas) chỉ được import khi cần và giữ trong cache của Streamlit
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "style.css")
+
+# Số file tải lên được xử lý đồng thời (mỗi file chủ yếu chờ OCR qua mạng)
+DEFAULT_UPLOAD_WORKERS = int(os.environ.get("APP_UPLOAD_WORKERS", "8"))
+
+# Cột của bảng kết quả khi tải lên nhiều file (cùng tên hiển thị với bảng lịch sử)
+RESULT_COLUMNS = {
+    "file_name": "File",
+    "invoice_number": "Số hóa đơn",
+    "total_amount": "Tổng tiền",
+    "date_info": "Ngày hóa đơn",
+    "status": "Trạng thái",
+}
+
+class ExtractionFailed(Exception):
+    """Trích xuất lỗi (ví dụ lỗi mạng khi gọi OCR): báo lỗi để st.cache_data không lưu kết quả"""
+
+    def __init__(self, result):
+        super().__init__(result['full_text'])
+        self.result = result
+
+@st.cache_resource(show_spinner=False)
+def load_css():
+    """Đọc CSS tùy chỉnh một lần cho mọi phiên"""
+    with open(CSS_PATH, encoding="utf-8") as f:
+        return f"<style>\n{f.read()}</style>"
+
+@st.cache_resource(show_spinner="⏳ Đang khởi tạo kết nối OCR...")
+def load_extractor():
+    """
+    Nạp module trích xuất (các mẫu regex đã biên dịch) và backend OCR dùng chung một lần cho
+    mọi phiên; chỉ chạy khi xử lý hóa đơn đầu tiên nên không làm chậm lần mở trang.
+    """
+    import process_invoice
+    from ocr_backend import get_backend
+
+    get_backend()
+    return process_invoice
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def extract_cached(digest, _uploaded_file):
+    """Kết quả trích xuất theo mã băm nội dung file: tải lại cùng file hoặc chạy lại script không gọi OCR lần nữa"""
+    result = load_extractor().extract_invoice_data(_uploaded_file)
+    if result['invoice_number'].startswith("Không thể trích xuất"):
+        raise ExtractionFailed(result)
+    return result
+
+def extract_upload(uploaded_file):
+    """Trích xuất một file tải lên (chạy trong thread pool); kết quả lỗi trích xuất được trả về như kết quả thường"""
+    try:
+        return extract_cached(content_digest(uploaded_file.getbuffer()), uploaded_file)
+    except ExtractionFailed as e:
+        return e.result
+
+def result_row(file_name, result=None, error=None):
+    """Một dòng của bảng kết quả: đang xử lý (chưa có `result` và `error`), lỗi, hoặc kết quả trích xuất"""
+    row = dict.fromkeys(RESULT_COLUMNS, "")
+    row["file_name"] = file_name
+    if error is None and result is not None and result['invoice_number'].startswith("Không thể trích xuất"):
+        error = result['full_text']
+    if error is not None:
+        row["status"] = f"❌ {error}"
+    elif result is None:
+        row["status"] = "⏳ Đang xử lý"
+    else:
+        row.update((field, result[field]) for field in ("invoice_number", "total_amount", "date_info"))
+        found = [not result[field].startswith("Không tìm thấy") for field in ("invoice_number", "total_amount")]
+        row["status"] = "✅ Thành công" if all(found) else "⚠️ Một phần" if any(found) else "❌ Thất bại"
+        if result.get('duplicate'):
+            row["status"] += " ♻️ trùng"
+    return row
+
+def process_uploads(uploaded_files, table, progress):
+    """
+    Xử lý các file tải lên đồng thời bằng thread pool: bảng kết quả và thanh tiến trình được cập nhật
+    ngay khi từng file xong, nên cả lô chỉ mất khoảng thời gian của hóa đơn chậm nhất. Lịch sử được ghi
+    một lần cho cả lô.
+
+    Returns:
+        tuple: (các dòng của bảng kết quả theo thứ tự tải lên, các kết quả trích xuất theo thứ tự tải lên;
+        None với file bị lỗi ngoài dự kiến).
+    """
+    # Nạp module trích xuất và backend OCR trong luồng chính (có spinner) trước khi chia việc cho các thread
+    load_extractor()
+
+    rows = [result_row(uploaded_file.name) for uploaded_file in uploaded_files]
+    results = [None] * len(uploaded_files)
+    table.dataframe(rows, column_config=RESULT_COLUMNS, hide_index=True, use_container_width=True)
+
+    workers = max(1, min(DEFAULT_UPLOAD_WORKERS, len(uploaded_files)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as executor:
+        futures = {executor.submit(extract_upload, uploaded_file): i for i, uploaded_file in enumerate(uploaded_files)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                rows[i] = result_row(uploaded_files[i].name, results[i])
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý {uploaded_files[i].name}: {str(e)}")
+                rows[i] = result_row(uploaded_files[i].name, error=str(e))
+            table.dataframe(rows, column_config=RESULT_COLUMNS, hide_index=True, use_container_width=True)
+            progress.progress(done / len(uploaded_files), text=f"Đã xử lý {done}/{len(uploaded_files)} hóa đơn")
+
+    # Lưu kết quả vào lịch sử (SQLite) trong một giao dịch để hiển thị trong tab lịch sử
+    get_history_store().add_many([
+        (result, uploaded_file.name) for uploaded_file, result in zip(uploaded_files, results) if result is not None
+    ])
+    return rows, results
+
+def show_result(result):
+    """Hiển thị chi tiết kết quả của một hóa đơn"""
+    # Kiểm tra kết quả trích xuất
+    extraction_success = (result['invoice_number'] != "Không tìm thấy số hóa đơn" and 
+                         result['total_amount'] != "Không tìm thấy tổng tiền")
     
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Trường', 'Giá trị'])
-    writer.writerow(['Số hóa đơn', result['invoice_number']])
-    writer.writerow(['Tổng tiền', result['total_amount']])
+    if extraction_success:
+        st.markdown('<div class="success-message">✅ Xử lý hoàn tất!</div>', unsafe_allow_html=True)
+    else:
+        st.markdown('<div class="error-message">⚠️ Không tìm thấy đầy đủ thông tin.</div>', unsafe_allow_html=True)
     
-    return output.getvalue()
-
-def create_history_dataframe():
-    """Tạo DataFrame từ lịch sử"""
-    import pandas as pd
+    # Cảnh báo hóa đơn đã được xử lý trước đó (ảnh chụp lại hoặc trùng số hóa đơn và tổng tiền)
+    if result.get('duplicate') == 'image':
+        st.warning("♻️ Ảnh gần giống một hóa đơn đã xử lý, kết quả được lấy lại mà không gọi OCR.")
+    elif result.get('duplicate') == 'invoice':
+        st.warning("♻️ Hóa đơn trùng số hóa đơn và tổng tiền với một hóa đơn đã xử lý.")
     
-    # Tạo DataFrame từ lịch sử
-    df = pd.DataFrame(st.session_state.history)
+    # Hiển thị kết quả
+    st.markdown('<div class="result-box">', unsafe_allow_html=True)
+    st.subheader("Kết quả trích xuất")
     
-    # Thêm cột trạng thái
-    df['status'] = df.apply(
-        lambda row: 
-            "✅ Thành công" if "không tìm thấy" not in row['invoice_number'].lower() and "không tìm thấy" not in row['total_amount'].lower()
-            else "⚠️ Một phần" if not ("không tìm thấy" in row['invoice_number'].lower() and "không tìm thấy" in row['total_amount'].lower())
-            else "❌ Thất bại",
-        axis=1
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f'<div class="data-item"><span class="data-label">Số hóa đơn:</span><br/><span class="data-value">{result["invoice_number"]}</span></div>', unsafe_allow_html=True)
+    with col2:
+        st.markdown(f'<div class="data-item"><span class="data-label">Tổng tiền:</span><br/><span class="data-value">{result["total_amount"]}</span></div>', unsafe_allow_html=True)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Phần xem toàn bộ văn bản đã trích xuất
+    with st.expander("📜 Xem toàn bộ văn bản trích xuất", expanded=False):
+        st.text_area("Văn bản đầy đủ", result['full_text'], height=200, disabled=True)
+    
+    # Nút tải xuống
+    st.download_button(
+        label="💾 Tải xuống kết quả (CSV)",
+        data=generate_csv([result]),
+        file_name=f"invoice_{result['invoice_number']}.csv",
+        mime="text/csv"
     )
+
+# Các hàm phụ trợ
+def generate_csv(records):
+    """Tạo file CSV (các cột của export.EXPORT_COLUMNS: tổng tiền dạng số nguyên đồng, ngày hóa đơn dạng ngày)"""
+    from export import export_to_file
+
+    return export_to_file([records], "csv").read()
+
+def create_history_dataframe(page, page_size=DEFAULT_PAGE_SIZE):
+    """Tạo DataFrame từ một trang lịch sử (trạng thái đã được tính trong SQL)"""
+    import pandas as pd
     
-    return df
+    return pd.DataFrame.from_records(get_history_store().page(page, page_size))
+
+def export_records(rows, results):
+    """Các bản ghi xuất của bảng kết quả nhiều file (file lỗi ngoài dự kiến chỉ có tên file và lỗi)"""
+    return [
+        {"file_name": row["file_name"], **result, "status": row["status"]} if result is not None
+        else {"file_name": row["file_name"], "error": row["status"].removeprefix("❌ ")}
+        for row, result in zip(rows, results)
+    ]
+
+def export_history(fmt):
+    """Toàn bộ lịch sử dưới dạng file (đọc và ghi theo từng phần), chỉ tạo khi người dùng bấm tải xuống"""
+    def generate():
+        from export import export_to_file
 
-def convert_df_to_csv(df):
-    """Chuyển đổi DataFrame thành CSV"""
-    return df.to_csv(index=False).encode('utf-8')
+        return export_to_file(get_history_store().iter_chunks(), fmt)
+
+    return generate
 
 def clear_history():
     """Xóa lịch sử"""
-    st.session_state.history = []
+    get_history_store().clear()
     st.experimental_rerun()
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Mở endpoint /metrics nếu đặt METRICS_PORT (chỉ mở một lần dù Streamlit chạy lại script)
+start_metrics_server()
+
 # Thiết lập cấu hình trang
 st.set_page_config(
     page_title="Trích Xuất Hóa Đơn Thông Minh",
@@ -57,84 +210,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# CSS tùy chỉnh
-st.markdown("""
-    <style>
-    .main {
-        background-color: #1e293b;
-        padding: 20px;
-        border-radius: 10px;
-        color: #f1f5f9;
-    }
-    .stButton>button {
-        background-color: #10b981;
-        color: #ffffff;
-        border-radius: 8px;
-        padding: 10px 20px;
-        font-weight: bold;
-    }
-    .stFileUploader {
-        border: 2px dashed #64748b;
-        border-radius: 10px;
-        padding: 20px;
-        background-color: #334155;
-        color: #f1f5f9;
-    }
-    .stSpinner {
-        color: #10b981;
-    }
-    .result-box {
-        background-color: #334155;
-        padding: 15px;
-        border-radius: 8px;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.2);
-        margin-top: 20px;
-        color: #f1f5f9;
-    }
-    .title {
-        color: #ffffff;
-        font-size: 2.5em;
-        font-weight: bold;
-        text-align: center;
-        margin-bottom: 10px;
-    }
-    .subtitle {
-        color: #cbd5e1;
-        font-size: 1.2em;
-        text-align: center;
-        margin-bottom: 30px;
-    }
-    .success-message {
-        background-color: #064e3b;
-        color: #6ee7b7;
-        padding: 10px;
-        border-radius: 5px;
-        margin-top: 10px;
-    }
-    .error-message {
-        background-color: #7f1d1d;
-        color: #f87171;
-        padding: 10px;
-        border-radius: 5px;
-        margin-top: 10px;
-    }
-    .data-item {
-        background-color: #283548;
-        padding: 12px;
-        border-radius: 8px;
-        margin-bottom: 10px;
-        border-left: 4px solid #10b981;
-    }
-    .data-label {
-        font-weight: bold;
-        color: #cbd5e1;
-    }
-    .data-value {
-        font-size: 1.1em;
-        color: #ffffff;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# CSS tùy chỉnh (đọc file một lần; Streamlit vẫn cần phát lại thẻ <style> mỗi lần chạy lại script)
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # Thiết lập tiêu đề
 st.markdown('<div class="title">Trích Xuất Thông Tin Hóa Đơn</div>', unsafe_allow_html=True)
@@ -144,15 +221,15 @@ st.markdown('<div class="subtitle">Tải lên ảnh hóa đơn để trích xu
 with st.sidebar:
     st.header("ℹ️ Thông Tin")
     st.markdown("""
-    - **Định dạng hỗ trợ**: PNG, JPG, JPEG
+    - **Định dạng hỗ trợ**: PNG, JPG, JPEG, TIFF, PDF (nhiều trang)
     - **Kích thước tối đa**: 10MB
-    - **Thời gian xử lý**: ~5-10 giây
+    - **Thời gian xử lý**: ~5-10 giây (nhiều file được xử lý đồng thời)
     """, unsafe_allow_html=True)
     
     st.markdown("---")
     st.markdown("**Hướng dẫn sử dụng**")
     st.markdown("""
-    1. Tải lên ảnh hóa đơn rõ nét.
+    1. Tải lên một hoặc nhiều ảnh hóa đơn rõ nét.
     2. Chờ hệ thống xử lý và trích xuất thông tin.
     3. Xem kết quả bao gồm số hóa đơn và tổng tiền.
     """, unsafe_allow_html=True)
@@ -161,78 +238,53 @@ with st.sidebar:
 tab1, tab2 = st.tabs(["📤 Tải lên hóa đơn", "📊 Lịch sử"])
 
 with tab1:
-    # Widget tải file
-    uploaded_file = st.file_uploader("📤 Chọn ảnh hóa đơn", type=["png", "jpg", "jpeg"])
+    # Widget tải file (có thể chọn nhiều file cùng lúc)
+    uploaded_files = st.file_uploader("📤 Chọn ảnh hóa đơn", type=["png", "jpg", "jpeg", "tif", "tiff", "pdf"],
+                                      accept_multiple_files=True)
 
     # Kiểm soát xử lý
-    process_btn = st.button("🔍 Xử lý hóa đơn", type="primary", disabled=uploaded_file is None)
+    process_btn = st.button("🔍 Xử lý hóa đơn", type="primary", disabled=not uploaded_files)
 
-    if uploaded_file is not None:
-        # Hiển thị ảnh đã tải lên
-        st.image(uploaded_file, caption="Ảnh hóa đơn đã tải lên", use_container_width=True)
-        
+    if uploaded_files:
+        # Hiển thị ảnh đã tải lên (chỉ khi tải một file, tránh hiển thị hàng chục ảnh)
+        if len(uploaded_files) > 1:
+            st.caption(f"📚 Đã chọn {len(uploaded_files)} file")
+        elif uploaded_files[0].name.lower().endswith(DOCUMENT_EXTENSIONS):
+            st.caption(f"📑 Tài liệu nhiều trang: {uploaded_files[0].name}")
+        else:
+            st.image(uploaded_files[0], caption="Ảnh hóa đơn đã tải lên", use_container_width=True)
+
+        # Kết quả được giữ trong phiên để không mất khi Streamlit chạy lại script (ví dụ khi bấm tải xuống)
+        upload_key = tuple(uploaded_file.file_id for uploaded_file in uploaded_files)
         if process_btn:
-            # Lưu file tạm thời
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file_path = temp_file.name
-                temp_file.write(uploaded_file.getbuffer())
-            
-            # Xử lý ảnh và trích xuất thông tin
-            with st.spinner("⏳ Đang xử lý hóa đơn..."):
-                try:
-                    result = extract_invoice_data(temp_file_path)
-                    
-                    # Kiểm tra kết quả trích xuất
-                    extraction_success = (result['invoice_number'] != "Không tìm thấy số hóa đơn" and 
-                                         result['total_amount'] != "Không tìm thấy tổng tiền")
-                    
-                    if extraction_success:
-                        st.markdown('<div class="success-message">✅ Xử lý hoàn tất!</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown('<div class="error-message">⚠️ Không tìm thấy đầy đủ thông tin.</div>', unsafe_allow_html=True)
-                    
-                    # Hiển thị kết quả
-                    st.markdown('<div class="result-box">', unsafe_allow_html=True)
-                    st.subheader("Kết quả trích xuất")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.markdown(f'<div class="data-item"><span class="data-label">Số hóa đơn:</span><br/><span class="data-value">{result["invoice_number"]}</span></div>', unsafe_allow_html=True)
-                    with col2:
-                        st.markdown(f'<div class="data-item"><span class="data-label">Tổng tiền:</span><br/><span class="data-value">{result["total_amount"]}</span></div>', unsafe_allow_html=True)
-                    
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Phần xem toàn bộ văn bản đã trích xuất
-                    with st.expander("📜 Xem toàn bộ văn bản trích xuất", expanded=False):
-                        st.text_area("Văn bản đầy đủ", result['full_text'], height=200, disabled=True)
-                    
-                    # Lưu kết quả vào session state để hiển thị trong tab lịch sử
-                    if 'history' not in st.session_state:
-                        st.session_state.history = []
-                    
-                    st.session_state.history.append({
-                        'invoice_number': result['invoice_number'],
-                        'total_amount': result['total_amount'],
-                        'timestamp': "Hôm nay"
-                    })
-                    
-                    # Nút tải xuống
-                    st.download_button(
-                        label="💾 Tải xuống kết quả (CSV)",
-                        data=generate_csv(result),
-                        file_name=f"invoice_{result['invoice_number']}.csv",
-                        mime="text/csv"
-                    )
-
-                except Exception as e:
-                    logger.error(f"Lỗi khi xử lý: {str(e)}")
-                    st.markdown(f'<div class="error-message">❌ Lỗi khi xử lý: {str(e)}</div>', unsafe_allow_html=True)
-
-                finally:
-                    # Xóa file tạm
-                    if os.path.exists(temp_file_path):
-                        os.remove(temp_file_path)
+            # Buffer của file tải lên được dùng trực tiếp, không ghi file tạm
+            progress = st.progress(0.0, text=f"Đã xử lý 0/{len(uploaded_files)} hóa đơn")
+            table = st.empty()
+            try:
+                rows, results = process_uploads(uploaded_files, table, progress)
+                st.session_state["upload_results"] = (upload_key, rows, results)
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý: {str(e)}")
+                st.markdown(f'<div class="error-message">❌ Lỗi khi xử lý: {str(e)}</div>', unsafe_allow_html=True)
+
+        saved = st.session_state.get("upload_results")
+        if saved is not None and saved[0] == upload_key:
+            _, rows, results = saved
+            if not process_btn:
+                st.dataframe(rows, column_config=RESULT_COLUMNS, hide_index=True, use_container_width=True)
+            if len(results) == 1 and results[0] is not None:
+                show_result(results[0])
+            else:
+                failed = sum(row["status"].startswith("❌") for row in rows)
+                st.markdown(f'<div class="{"error" if failed else "success"}-message">'
+                            f'✅ Đã xử lý {len(rows)} hóa đơn, {failed} lỗi hoặc không trích xuất được.</div>',
+                            unsafe_allow_html=True)
+                st.download_button(
+                    label="💾 Tải xuống kết quả (CSV)",
+                    data=generate_csv(export_records(rows, results)),
+                    file_name="invoices.csv",
+                    mime="text/csv"
+                )
     else:
         st.info("📌 Vui lòng tải lên ảnh hóa đơn để bắt đầu.", icon="ℹ️")
 
@@ -240,16 +292,23 @@ with tab2:
     st.header("📊 Lịch sử trích xuất")
     
     # Hiển thị lịch sử nếu có
-    if 'history' in st.session_state and st.session_state.history:
-        # Tạo DataFrame từ lịch sử
-        history_df = create_history_dataframe()
+    history_count = get_history_store().count()
+    if history_count:
+        # Chỉ đọc một trang lịch sử mỗi lần hiển thị
+        page_count = (history_count + DEFAULT_PAGE_SIZE - 1) // DEFAULT_PAGE_SIZE
+        page = st.number_input(f"Trang (tổng {page_count} trang, {history_count} hóa đơn)",
+                               min_value=1, max_value=page_count, value=1, step=1)
+        history_df = create_history_dataframe(int(page))
         
         # Hiển thị bảng lịch sử
         st.dataframe(
             history_df,
             column_config={
+                "id": None,
+                "file_name": "File",
                 "invoice_number": "Số hóa đơn",
                 "total_amount": "Tổng tiền",
+                "date_info": "Ngày hóa đơn",
                 "timestamp": "Thời gian",
                 "status": "Trạng thái"
             },
@@ -257,8 +316,18 @@ with tab2:
             use_container_width=True
         )
         
-        # Nút xóa lịch sử
-        st.button("🗑️ Xóa lịch sử", on_click=clear_history)
+        # Tải xuống toàn bộ lịch sử: CSV hoặc Parquet (các cột có kiểu, đọc được từng cột bằng pandas/pyarrow)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.download_button("💾 Tải xuống CSV", data=export_history("csv"), file_name="invoice_history.csv",
+                               mime="text/csv", on_click="ignore")
+        with col2:
+            st.download_button("💾 Tải xuống Parquet", data=export_history("parquet"),
+                               file_name="invoice_history.parquet", mime="application/vnd.apache.parquet",
+                               on_click="ignore")
+        with col3:
+            # Nút xóa lịch sử
+            st.button("🗑️ Xóa lịch sử", on_click=clear_history)
     else:
         st.info("📌 Chưa có dữ liệu lịch sử.", icon="ℹ️")
 
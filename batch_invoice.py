@@ -0,0 +1,276 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from export import EXPORT_FORMATS, export_format, open_exporter
+from ocr_backend import MAX_BATCH_SIZE
+from history_store import get_history_store
+from document_pages import DOCUMENT_EXTENSIONS
+from process_invoice import accept_roi, annotate_images, extract_document_data, extract_fields
+from tiered_ocr import DEFAULT_ENABLED as TIERED_ENABLED, build_roi, record_outcome, tiered_summary
+
+logger = logging.getLogger(__name__)
+
+# Các định dạng ảnh được xử lý khi quét thư mục (tài liệu nhiều trang được OCR từng trang)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg") + DOCUMENT_EXTENSIONS
+
+
+def collect_image_paths(inputs, recursive=False):
+    """
+    Liệt kê các file ảnh từ danh sách thư mục, mẫu glob hoặc đường dẫn file.
+
+    Args:
+        inputs (list[str]): Thư mục (ví dụ `assets/images/`), mẫu glob hoặc file.
+        recursive (bool): Quét cả thư mục con.
+    Returns:
+        list[str]: Đường dẫn các file ảnh, đã sắp xếp và loại trùng.
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        elif glob.has_magic(item):
+            candidates = glob.glob(item, recursive=True)
+        else:
+            candidates = [item]
+
+        paths.extend(
+            path for path in candidates
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+    return sorted(set(paths))
+
+
+def process_roi_batch(contents):
+    """
+    Bước đầu của chế độ theo vùng: OCR phần đầu/cuối thu nhỏ của cả nhóm ảnh trong một yêu cầu batch.
+
+    Returns:
+        dict: {chỉ số ảnh: kết quả} của các ảnh đủ tin cậy, không cần OCR toàn trang.
+    """
+    rois = [build_roi(content) for content in contents]
+    usable = [i for i, roi in enumerate(rois) if roi is not None]
+    for i, roi in enumerate(rois):
+        if roi is None:
+            record_outcome(None, escalated=True)
+    if not usable:
+        return {}
+
+    accepted = {}
+    for i, response in zip(usable, annotate_images([rois[i].content for i in usable])):
+        result = accept_roi(rois[i], response)
+        if result is not None:
+            accepted[i] = result
+    return accepted
+
+
+def make_record(path, fields, include_text=False, saved=None, response=None):
+    """
+    Bản ghi kết quả của một file. Nếu có `saved`, kết quả kèm văn bản và kết quả OCR gốc
+    được thêm vào đó để lưu lịch sử (dùng cho việc trích xuất lại mà không gọi OCR).
+    """
+    if saved is not None:
+        saved.append((fields, path, response))
+    if not include_text:
+        fields = {key: value for key, value in fields.items() if key != "full_text"}
+    return {"file": path, **fields}
+
+
+def process_batch(paths, include_text=False, tiered=False, history=False):
+    """
+    OCR một nhóm ảnh bằng một yêu cầu batch rồi trích xuất thông tin từng ảnh.
+    Ở chế độ theo vùng (`tiered`), chỉ các ảnh chưa đủ tin cậy sau bước đầu mới được OCR toàn trang.
+    Nếu `history`, kết quả được lưu vào lịch sử kèm văn bản và kết quả OCR gốc.
+
+    Returns:
+        list[dict]: Mỗi phần tử là một bản ghi kết quả cho một file.
+    """
+    saved = [] if history else None
+    records = _process_batch(paths, include_text, tiered, saved)
+    if saved:
+        get_history_store().add_many(saved)
+    return records
+
+
+def _process_batch(paths, include_text, tiered, saved):
+    records = []
+    contents = []
+    readable = []
+    for path in paths:
+        if path.lower().endswith(DOCUMENT_EXTENSIONS):
+            records.append(process_document(path, include_text, saved))
+            continue
+        try:
+            with open(path, "rb") as image_file:
+                contents.append(image_file.read())
+            readable.append(path)
+        except OSError as e:
+            records.append({"file": path, "error": f"Lỗi đọc file: {e}"})
+            metrics.REQUEST_ERRORS.inc("read")
+
+    if not readable:
+        return records
+
+    try:
+        if tiered:
+            with metrics.span("ocr_roi"):
+                accepted = process_roi_batch(contents)
+            for i, fields in sorted(accepted.items()):
+                records.append(make_record(readable[i], fields, include_text, saved))
+            contents = [content for i, content in enumerate(contents) if i not in accepted]
+            readable = [path for i, path in enumerate(readable) if i not in accepted]
+            if not readable:
+                return records
+
+        with metrics.span("ocr_batch"):
+            responses = annotate_images(contents)
+    except Exception as e:
+        logger.error(f"Lỗi khi gọi OCR cho nhóm {len(readable)} ảnh: {e}")
+        metrics.REQUEST_ERRORS.inc("ocr", amount=len(readable))
+        records.extend({"file": path, "error": str(e)} for path in readable)
+        return records
+
+    for path, response in zip(readable, responses):
+        if response.error.message:
+            records.append({"file": path, "error": f"Lỗi từ Google Cloud Vision: {response.error.message}"})
+            metrics.REQUEST_ERRORS.inc("ocr")
+            continue
+
+        fields = extract_fields(response.full_text_annotation.text, response.full_text_annotation)
+        records.append(make_record(path, fields, include_text, saved, response))
+
+    return records
+
+
+def process_document(path, include_text=False, saved=None):
+    """OCR song song các trang của một tài liệu nhiều trang (TIFF, PDF) rồi trích xuất thông tin"""
+    try:
+        fields = extract_document_data(path)
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý tài liệu {path}: {e}")
+        metrics.REQUEST_ERRORS.inc("ocr")
+        return {"file": path, "error": str(e)}
+
+    return make_record(path, fields, include_text, saved)
+
+
+def run_batch(paths, output, batch_size=MAX_BATCH_SIZE, concurrency=4, include_text=False, tiered=False,
+              history=False, fmt="jsonl"):
+    """
+    Xử lý danh sách ảnh theo nhóm với số yêu cầu đồng thời giới hạn,
+    ghi kết quả ra `output` (JSONL, CSV hoặc Parquet/Arrow, xem `export.open_exporter`) ngay khi từng nhóm hoàn tất.
+
+    Returns:
+        dict: Thống kê số file đã xử lý, số lỗi và thời gian chạy.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    stats = {"files": 0, "errors": 0}
+    start_time = time.perf_counter()
+    exporter = open_exporter(output, fmt)
+
+    # Luôn đóng bộ ghi (kể cả khi bị ngắt giữa chừng) để file Parquet/Arrow có phần kết thúc hợp lệ
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+            batch_iter = iter(batches)
+
+            # Chỉ giữ tối đa 2 * concurrency nhóm đang chờ để giới hạn bộ nhớ khi có hàng nghìn ảnh
+            def fill():
+                for batch in batch_iter:
+                    pending[executor.submit(process_batch, batch, include_text, tiered, history)] = batch
+                    if len(pending) >= 2 * concurrency:
+                        break
+
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    try:
+                        records = future.result()
+                    except Exception as e:
+                        # Lỗi ngoài dự kiến (ví dụ khi ghi lịch sử) chỉ làm hỏng nhóm này, không dừng cả lần chạy
+                        logger.error(f"Lỗi khi xử lý nhóm {len(batch)} ảnh: {e}")
+                        metrics.REQUEST_ERRORS.inc("batch", amount=len(batch))
+                        records = [{"file": path, "error": str(e)} for path in batch]
+                    exporter.write(records)
+                    stats["files"] += len(records)
+                    stats["errors"] += sum(1 for record in records if "error" in record)
+                exporter.flush()
+                fill()
+    finally:
+        exporter.close()
+
+    stats["elapsed"] = time.perf_counter() - start_time
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trích xuất thông tin hàng loạt hóa đơn và ghi kết quả ra JSONL")
+    parser.add_argument("inputs", nargs="+", help="Thư mục, mẫu glob hoặc file ảnh (ví dụ assets/images/ hoặc 'scans/*.jpg')")
+    parser.add_argument("-o", "--output", default="-", help="File kết quả đầu ra (mặc định: JSONL ra stdout)")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS,
+                        help="Định dạng kết quả (mặc định theo đuôi file: .csv, .parquet, .arrow, còn lại là JSONL)")
+    parser.add_argument("-b", "--batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help=f"Số ảnh trong một yêu cầu batch (tối đa {MAX_BATCH_SIZE})")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Số yêu cầu OCR chạy đồng thời")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Quét cả thư mục con")
+    parser.add_argument("--full-text", action="store_true", help="Ghi kèm toàn bộ văn bản OCR")
+    parser.add_argument("--tiered", action=argparse.BooleanOptionalAction, default=TIERED_ENABLED,
+                        help="OCR phần đầu/cuối thu nhỏ trước, chỉ OCR toàn trang khi chưa đủ tin cậy"
+                             " (mặc định theo OCR_TIERED; --no-tiered để tắt)")
+    parser.add_argument("--history", action="store_true",
+                        help="Lưu kết quả vào lịch sử kèm văn bản và kết quả OCR gốc (để trích xuất lại bằng reextract.py)")
+    parser.add_argument("--metrics-port", type=int, default=metrics.DEFAULT_METRICS_PORT,
+                        help="Mở endpoint /metrics (Prometheus) tại port này trong khi chạy")
+    args = parser.parse_args(argv)
+
+    metrics.start_metrics_server(args.metrics_port)
+
+    paths = collect_image_paths(args.inputs, recursive=args.recursive)
+    if not paths:
+        logger.error("Không tìm thấy file ảnh nào")
+        return 1
+
+    fmt = args.format or ("jsonl" if args.output == "-" else export_format(args.output))
+    if args.output == "-" and fmt not in ("jsonl", "csv"):
+        logger.error(f"Không thể ghi định dạng {fmt} ra stdout")
+        return 1
+
+    logger.info(f"Bắt đầu xử lý {len(paths)} ảnh")
+    try:
+        if args.output == "-":
+            stats = run_batch(paths, sys.stdout, args.batch_size, args.concurrency, args.full_text, args.tiered,
+                              args.history, fmt)
+        elif fmt in ("jsonl", "csv"):
+            with open(args.output, "w", encoding="utf-8", newline="") as output:
+                stats = run_batch(paths, output, args.batch_size, args.concurrency, args.full_text, args.tiered,
+                                  args.history, fmt)
+        else:
+            stats = run_batch(paths, args.output, args.batch_size, args.concurrency, args.full_text, args.tiered,
+                              args.history, fmt)
+    except ImportError as e:
+        logger.error(f"Cần cài pyarrow để ghi kết quả dạng {fmt}: {e}")
+        return 1
+
+    logger.info(f"Hoàn tất {stats['files']} ảnh ({stats['errors']} lỗi) trong {stats['elapsed']:.1f} giây")
+    if args.tiered:
+        summary = tiered_summary()
+        logger.info(
+            f"OCR theo vùng: {summary['roi_accepted']}/{summary['documents']} ảnh không cần OCR toàn trang"
+            f" (tránh {summary['full_calls_avoided']} lời gọi toàn trang, thêm {summary['extra_calls']} lời gọi"
+            f" do OCR lại), tiết kiệm {summary['pixels_saved']:,} điểm ảnh"
+        )
+    return 0 if stats["errors"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
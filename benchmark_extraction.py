@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from amount_index import clean_amount
+from batch_invoice import collect_image_paths
+from field_scanner import ANCHOR_KEYWORDS, TOTAL_KEYWORD_PATTERN, scan_fields
+from ocr_backend import FakeBackend, content_digest, get_backend
+from process_invoice import (
+    extract_date_info,
+    extract_fields,
+    extract_invoice_number,
+    extract_total_amount,
+)
+
+logger = logging.getLogger(__name__)
+
+# Vị trí mặc định của dữ liệu ghi sẵn (cùng định dạng `<sha256>.pb` với OCR_FAKE_RESPONSES_DIR): bộ hóa đơn
+# tổng hợp trong tests/fixtures (tạo bằng tests/fixtures/build_fixtures.py), chạy được offline
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures")
+DEFAULT_IMAGES = [os.path.join(FIXTURES_DIR, "images")]
+DEFAULT_RESPONSES_DIR = os.path.join(FIXTURES_DIR, "responses")
+DEFAULT_GOLDEN_PATH = os.path.join(FIXTURES_DIR, "golden.json")
+DEFAULT_BASELINE_PATH = os.path.join(FIXTURES_DIR, "benchmark_baseline.json")
+
+# Các trường được so với kết quả chuẩn
+GOLDEN_FIELDS = ("invoice_number", "total_amount", "date_info")
+
+# Khóa của thời gian vòng hiệu chuẩn trong file mốc cơ sở
+CALIBRATION_KEY = "_calibration"
+
+_AMOUNT_TOKEN_RE = re.compile(r'\d[\d\., ]*')
+
+# Đầu vào của vòng hiệu chuẩn: chỉ dùng thư viện chuẩn (regex, tách dòng) để không đổi theo mã trích xuất
+_CALIBRATION_TEXT = "Sữa tươi 2 x 25.000 50.000\nTổng cộng: 1.250.000 đ\n" * 20
+_CALIBRATION_RE = re.compile(r'(?:tổng|total)\s*\w*\s*[:=]?\s*([\d\., ]+)', re.IGNORECASE)
+
+
+def record_responses(paths, responses_dir):
+    """Gọi OCR thật một lần cho mỗi ảnh và lưu kết quả đã serialize để phát lại offline"""
+    os.makedirs(responses_dir, exist_ok=True)
+    backend = get_backend()
+    for path in paths:
+        with open(path, "rb") as image_file:
+            content = image_file.read()
+
+        response = backend.document_text_detection(content)
+        if response.error.message:
+            raise Exception(f"Lỗi từ Google Cloud Vision ({path}): {response.error.message}")
+
+        target = os.path.join(responses_dir, f"{content_digest(content)}.pb")
+        with open(target, "wb") as f:
+            f.write(type(response).serialize(response))
+        logger.info(f"Đã ghi kết quả OCR của {path} vào {target}")
+
+
+def load_documents(paths, responses_dir):
+    """
+    Đọc kết quả OCR đã ghi sẵn của các ảnh.
+
+    Returns:
+        list[tuple]: (tên file, full_text, full_text_annotation) của các ảnh có dữ liệu ghi sẵn.
+    """
+    replay = FakeBackend(responses_dir=responses_dir)
+    documents = []
+    for path in paths:
+        with open(path, "rb") as image_file:
+            response = replay.load_response(content_digest(image_file.read()))
+        if response is None:
+            logger.warning(f"Chưa có kết quả OCR ghi sẵn cho {path}, bỏ qua")
+            continue
+        annotation = response.full_text_annotation
+        documents.append((os.path.basename(path), annotation.text, annotation))
+    return documents
+
+
+def body_range(full_text):
+    """
+    Khoảng dòng [start, end) là phần thân (danh sách món) của một hóa đơn: đoạn liên tiếp cuối cùng, trước dòng
+    tổng tiền cuối cùng, của các dòng có số nhưng không có từ khóa neo (số hóa đơn, tổng tiền...) hay ngày tháng.
+    Nếu không có dòng nào như vậy thì lấy cả văn bản.
+    """
+    lines = full_text.split('\n')
+    scan = scan_fields(full_text)
+    totals = list(scan.matching_lines(*TOTAL_KEYWORD_PATTERN))
+    anchored = {scan.line_of(pos) for pos in scan.positions(ANCHOR_KEYWORDS)}
+    items = [
+        i for i in range(totals[-1] if totals else len(lines))
+        if i not in anchored and _AMOUNT_TOKEN_RE.search(lines[i]) and scan_fields(lines[i]).first_date is None
+    ]
+    if not items:
+        return 0, len(lines)
+    start = end = items[-1] + 1
+    while start - 1 in items:
+        start -= 1
+    return start, end
+
+
+def enlarge_text(full_text, factor):
+    """Tạo văn bản dài gấp khoảng `factor` lần bằng cách nhân bản phần thân (`body_range`), giữ nguyên đầu và cuối"""
+    if factor <= 1:
+        return full_text
+    lines = full_text.split('\n')
+    start, end = body_range(full_text)
+    return '\n'.join(lines[:start] + lines[start:end] * factor + lines[end:])
+
+
+def _stage_extract_invoice_number(full_text):
+    extract_invoice_number(full_text, full_text.split('\n'))
+
+
+def _stage_extract_total_amount(full_text):
+    extract_total_amount(full_text, full_text.split('\n'))
+
+
+def _stage_extract_date_info(full_text):
+    extract_date_info(full_text, full_text.split('\n'))
+
+
+def _stage_extract_fields(full_text):
+    extract_fields(full_text)
+
+
+# Các bước được đo riêng; mỗi bước tự quét văn bản nên thời gian đo không phụ thuộc thứ tự chạy
+STAGES = {
+    "extract_invoice_number": _stage_extract_invoice_number,
+    "extract_total_amount": _stage_extract_total_amount,
+    "extract_date_info": _stage_extract_date_info,
+    "extract_fields": _stage_extract_fields,
+}
+
+
+def _time_calls(func, args_list, iterations, repeat):
+    """Thời gian trung bình (micro giây) của một lời gọi, lấy lần đo nhanh nhất trong `repeat` lần"""
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            for args in args_list:
+                func(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best / (iterations * max(len(args_list), 1)) * 1e6
+
+
+def _calibration_work():
+    for line in _CALIBRATION_TEXT.split('\n'):
+        _CALIBRATION_RE.search(line)
+    _AMOUNT_TOKEN_RE.findall(_CALIBRATION_TEXT.lower())
+
+
+def calibrate(iterations=200, repeat=5):
+    """Thời gian (micro giây) của một vòng hiệu chuẩn cố định, đo trong cùng tiến trình với các bước trích xuất"""
+    return _time_calls(_calibration_work, [()], iterations, repeat)
+
+
+def run_timings(documents, scales, iterations, repeat):
+    """
+    Đo thời gian từng bước trích xuất trên các văn bản gốc và văn bản phóng to.
+
+    Returns:
+        dict: {"<bước>@x<hệ số>": micro giây mỗi văn bản}.
+    """
+    timings = {}
+    for factor in scales:
+        texts = [enlarge_text(full_text, factor) for _, full_text, _ in documents]
+        # Văn bản lớn chạy ít vòng hơn để tổng thời gian đo không tăng theo hệ số phóng to
+        rounds = max(1, iterations // factor)
+
+        for name, stage in STAGES.items():
+            timings[f"{name}@x{factor}"] = _time_calls(stage, [(text,) for text in texts], rounds, repeat)
+
+        # Đầu vào thực tế của `clean_amount`: các chuỗi số (có dấu phân cách) trong văn bản
+        raw_amounts = [(token,) for text in texts for token in _AMOUNT_TOKEN_RE.findall(text)]
+        timings[f"clean_amount@x{factor}"] = _time_calls(clean_amount, raw_amounts, rounds, repeat)
+    return timings
+
+
+def check_golden(documents, golden):
+    """So kết quả trích xuất với kết quả chuẩn, trả về danh sách sai khác"""
+    failures = []
+    for name, full_text, annotation in documents:
+        expected = golden.get(name)
+        if expected is None:
+            failures.append(f"{name}: chưa có kết quả chuẩn")
+            continue
+        result = extract_fields(full_text, annotation)
+        for field in GOLDEN_FIELDS:
+            if result[field] != expected.get(field):
+                failures.append(f"{name}: {field} = {result[field]!r}, mong đợi {expected.get(field)!r}")
+    return failures
+
+
+def check_timings(timings, baseline, threshold, calibration=None):
+    """
+    Các bước chậm hơn mốc cơ sở quá `threshold` (tỉ lệ, ví dụ 0.25 = 25%).
+
+    Nếu có thời gian vòng hiệu chuẩn của lần chạy này (`calibration`) và của mốc cơ sở (`CALIBRATION_KEY`),
+    mốc cơ sở được quy đổi theo tỉ lệ giữa hai lần, để so được kết quả đo trên máy khác hoặc máy đang bận.
+    """
+    scale = 1.0
+    if calibration and baseline.get(CALIBRATION_KEY):
+        scale = calibration / baseline[CALIBRATION_KEY]
+    regressions = []
+    for key, value in timings.items():
+        reference = baseline.get(key)
+        if key == CALIBRATION_KEY or not reference:
+            continue
+        reference *= scale
+        if value > reference * (1 + threshold):
+            regressions.append(f"{key}: {value:.1f} µs, mốc cơ sở {reference:.1f} µs (+{value / reference - 1:.0%})")
+    return regressions
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Đo thời gian và kiểm tra hồi quy bước trích xuất bằng kết quả OCR ghi sẵn (không gọi mạng)"
+    )
+    parser.add_argument("inputs", nargs="*", default=DEFAULT_IMAGES, help="Thư mục, mẫu glob hoặc file ảnh")
+    parser.add_argument("--responses-dir", default=DEFAULT_RESPONSES_DIR, help="Thư mục kết quả OCR ghi sẵn")
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN_PATH, help="File JSON kết quả chuẩn")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="File JSON mốc thời gian cơ sở")
+    parser.add_argument("--record", action="store_true", help="Gọi OCR thật và ghi lại kết quả (cần credentials)")
+    parser.add_argument("--update-golden", action="store_true", help="Ghi kết quả hiện tại làm kết quả chuẩn")
+    parser.add_argument("--update-baseline", action="store_true", help="Ghi thời gian hiện tại làm mốc cơ sở")
+    parser.add_argument("-n", "--iterations", type=int, default=200, help="Số vòng đo trên văn bản gốc")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần đo, lấy lần nhanh nhất")
+    parser.add_argument("--scales", default="1,10,50", help="Các hệ số phóng to văn bản, ví dụ 1,10,50")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Tỉ lệ chậm hơn mốc cơ sở được chấp nhận (mặc định 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    paths = collect_image_paths(args.inputs)
+    if not paths:
+        logger.error("Không tìm thấy file ảnh nào")
+        return 1
+
+    if args.record:
+        record_responses(paths, args.responses_dir)
+
+    documents = load_documents(paths, args.responses_dir)
+    if not documents:
+        logger.error(f"Chưa có kết quả OCR ghi sẵn trong {args.responses_dir}, chạy lại với --record")
+        return 1
+
+    failed = False
+
+    if args.update_golden:
+        golden = {}
+        for name, full_text, annotation in documents:
+            result = extract_fields(full_text, annotation)
+            golden[name] = {field: result[field] for field in GOLDEN_FIELDS}
+        _save_json(args.golden, golden)
+        print(f"Đã ghi kết quả chuẩn của {len(golden)} ảnh vào {args.golden}")
+    else:
+        failures = check_golden(documents, _load_json(args.golden))
+        for failure in failures:
+            print(f"SAI: {failure}")
+        failed = failed or bool(failures)
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    calibration = calibrate(args.iterations, args.repeat)
+    timings = run_timings(documents, scales, args.iterations, args.repeat)
+    baseline = _load_json(args.baseline)
+
+    print(f"\n{'bước':<36} {'µs/văn bản':>12} {'mốc cơ sở':>12}")
+    for key, value in {CALIBRATION_KEY: calibration, **timings}.items():
+        reference = baseline.get(key)
+        print(f"{key:<36} {value:>12.1f} {reference if reference is not None else '-':>12}")
+
+    if args.update_baseline:
+        _save_json(args.baseline, {key: round(value, 2) for key, value in {CALIBRATION_KEY: calibration,
+                                                                           **timings}.items()})
+        print(f"\nĐã ghi mốc thời gian cơ sở vào {args.baseline}")
+    else:
+        regressions = check_timings(timings, baseline, args.threshold, calibration)
+        for regression in regressions:
+            print(f"CHẬM: {regression}")
+        failed = failed or bool(regressions)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import sys
+
+from batch_invoice import collect_image_paths
+from image_preprocess import DEFAULT_JPEG_QUALITY, DEFAULT_MAX_DIMENSION, preprocess_image
+
+logger = logging.getLogger(__name__)
+
+# Các trường so sánh giữa kết quả OCR của ảnh gốc và ảnh đã tiền xử lý
+COMPARED_FIELDS = ("invoice_number", "total_amount", "date_info")
+
+
+def extract_from_content(content):
+    """OCR trực tiếp (không qua cache) rồi trích xuất các trường"""
+    from ocr_backend import get_backend
+    from process_invoice import extract_fields
+
+    response = get_backend().document_text_detection(content)
+    if response.error.message:
+        raise Exception(f"Lỗi từ Google Cloud Vision: {response.error.message}")
+    return extract_fields(response.full_text_annotation.text, response.full_text_annotation)
+
+
+def run_benchmark(paths, max_dimension, grayscale, quality, compare_ocr=False):
+    """
+    Tiền xử lý từng ảnh, in kích thước trước/sau và thời gian; nếu `compare_ocr`
+    thì OCR cả hai phiên bản và kiểm tra các trường trích xuất không đổi.
+
+    Returns:
+        dict: Tổng số bytes trước/sau, tổng thời gian và số ảnh có trường bị thay đổi.
+    """
+    totals = {"bytes_before": 0, "bytes_after": 0, "elapsed": 0.0, "changed": 0}
+
+    print(f"{'file':<40} {'before':>10} {'after':>10} {'ratio':>7} {'ms':>8}  size")
+    for path in paths:
+        with open(path, "rb") as image_file:
+            content = image_file.read()
+
+        processed, stats = preprocess_image(content, max_dimension, grayscale, quality)
+        totals["bytes_before"] += stats.bytes_before
+        totals["bytes_after"] += stats.bytes_after
+        totals["elapsed"] += stats.elapsed
+
+        ratio = stats.bytes_after / stats.bytes_before if stats.bytes_before else 1.0
+        print(f"{path:<40} {stats.bytes_before:>10} {stats.bytes_after:>10} {ratio:>7.1%} "
+              f"{stats.elapsed * 1000:>8.1f}  {stats.size_before} -> {stats.size_after}")
+
+        if compare_ocr:
+            original = extract_from_content(content)
+            reduced = extract_from_content(processed)
+            changed = [field for field in COMPARED_FIELDS if original[field] != reduced[field]]
+            if changed:
+                totals["changed"] += 1
+                for field in changed:
+                    print(f"    ! {field}: {original[field]!r} -> {reduced[field]!r}")
+
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo hiệu quả tiền xử lý ảnh trước khi gửi OCR")
+    parser.add_argument("inputs", nargs="*", default=["assets/images/"], help="Thư mục, mẫu glob hoặc file ảnh")
+    parser.add_argument("--max-dimension", type=int, default=DEFAULT_MAX_DIMENSION, help="Cạnh dài tối đa (pixel)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="Chất lượng JPEG khi nén lại")
+    parser.add_argument("--color", action="store_true", help="Giữ ảnh màu (không chuyển ảnh xám)")
+    parser.add_argument("--compare-ocr", action="store_true",
+                        help="OCR cả ảnh gốc và ảnh đã tiền xử lý, báo các trường bị thay đổi")
+    args = parser.parse_args(argv)
+
+    paths = collect_image_paths(args.inputs)
+    if not paths:
+        logger.error("Không tìm thấy file ảnh nào")
+        return 1
+
+    totals = run_benchmark(paths, args.max_dimension, not args.color, args.quality, args.compare_ocr)
+
+    saved = totals["bytes_before"] - totals["bytes_after"]
+    print(f"\nTổng: {totals['bytes_before']} -> {totals['bytes_after']} bytes "
+          f"(giảm {saved / max(totals['bytes_before'], 1):.1%}), {totals['elapsed'] * 1000:.1f} ms")
+    if args.compare_ocr:
+        print(f"Số ảnh có trường trích xuất bị thay đổi: {totals['changed']}/{len(paths)}")
+        return 0 if totals["changed"] == 0 else 2
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
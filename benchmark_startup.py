@@ -0,0 +1,107 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Ngân sách thời gian (ms) của giao diện Streamlit, có thể ghi đè bằng biến môi trường
+DEFAULT_COLD_BUDGET_MS = float(os.environ.get("STARTUP_COLD_BUDGET_MS", "1500"))
+DEFAULT_RERUN_BUDGET_MS = float(os.environ.get("STARTUP_RERUN_BUDGET_MS", "100"))
+DEFAULT_APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Các thư viện nặng không được nạp khi mở trang (chỉ nạp khi xử lý hóa đơn đầu tiên)
+LAZY_MODULES = ("google.cloud.vision", "process_invoice")
+
+
+def measure(app_path, reruns):
+    """
+    Chạy script Streamlit bằng AppTest trong tiến trình hiện tại (tiến trình mới, chưa nạp gì).
+
+    Returns:
+        dict: Thời gian nạp streamlit, lần chạy đầu, các lần chạy lại (ms) và các module nặng đã bị nạp.
+    """
+    start_time = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_ms = (time.perf_counter() - start_time) * 1000
+
+    app = AppTest.from_file(app_path, default_timeout=60)
+    start_time = time.perf_counter()
+    app.run()
+    first_run_ms = (time.perf_counter() - start_time) * 1000
+    if app.exception:
+        raise RuntimeError(f"Lỗi khi chạy {app_path}: {app.exception[0].message}")
+
+    rerun_ms = []
+    for _ in range(reruns):
+        start_time = time.perf_counter()
+        app.run()
+        rerun_ms.append((time.perf_counter() - start_time) * 1000)
+
+    return {
+        "import_ms": import_ms,
+        "first_run_ms": first_run_ms,
+        "rerun_ms": rerun_ms,
+        "loaded_heavy_modules": [name for name in LAZY_MODULES if name in sys.modules],
+    }
+
+
+def measure_in_subprocess(app_path, reruns):
+    """Đo trong tiến trình Python mới để thời gian lần chạy đầu là thời gian khởi động lạnh thật"""
+    env = dict(os.environ, HISTORY_DB=":memory:", METRICS_PORT="0")
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", "--app", app_path, "--reruns", str(reruns)],
+        env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Không đo được thời gian khởi động:\n{process.stderr}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Đo thời gian khởi động lạnh và chạy lại script của giao diện Streamlit, so với ngân sách"
+    )
+    parser.add_argument("--app", default=DEFAULT_APP_PATH, help="Script Streamlit cần đo")
+    parser.add_argument("--cold-runs", type=int, default=3, help="Số lần khởi động lạnh, lấy lần nhanh nhất")
+    parser.add_argument("--reruns", type=int, default=20, help="Số lần chạy lại script trong mỗi tiến trình")
+    parser.add_argument("--cold-budget-ms", type=float, default=DEFAULT_COLD_BUDGET_MS,
+                        help="Ngân sách khởi động lạnh (nạp streamlit + lần chạy đầu)")
+    parser.add_argument("--rerun-budget-ms", type=float, default=DEFAULT_RERUN_BUDGET_MS,
+                        help="Ngân sách trung vị một lần chạy lại script")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(args.app, args.reruns)))
+        return 0
+
+    samples = [measure_in_subprocess(args.app, args.reruns) for _ in range(max(1, args.cold_runs))]
+    cold_ms = min(sample["import_ms"] + sample["first_run_ms"] for sample in samples)
+    rerun_ms = statistics.median(value for sample in samples for value in sample["rerun_ms"])
+    heavy_modules = sorted({name for sample in samples for name in sample["loaded_heavy_modules"]})
+
+    print(f"{'chỉ số':<24} {'ms':>10} {'ngân sách':>10}")
+    print(f"{'khởi động lạnh':<24} {cold_ms:>10.1f} {args.cold_budget_ms:>10.1f}")
+    print(f"{'chạy lại (trung vị)':<24} {rerun_ms:>10.1f} {args.rerun_budget_ms:>10.1f}")
+
+    failed = False
+    if cold_ms > args.cold_budget_ms:
+        print(f"CHẬM: khởi động lạnh {cold_ms:.1f} ms, vượt ngân sách {args.cold_budget_ms:.1f} ms")
+        failed = True
+    if rerun_ms > args.rerun_budget_ms:
+        print(f"CHẬM: chạy lại {rerun_ms:.1f} ms, vượt ngân sách {args.rerun_budget_ms:.1f} ms")
+        failed = True
+    if heavy_modules:
+        print(f"SAI: mở trang đã nạp {', '.join(heavy_modules)} (cần nạp lười khi xử lý hóa đơn)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import io
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_ENABLED = os.environ.get("OCR_DEDUP", "0") == "1"
+DEFAULT_HASH_SIZE = int(os.environ.get("OCR_DEDUP_HASH_SIZE", "16"))
+DEFAULT_MAX_DISTANCE = int(os.environ.get("OCR_DEDUP_MAX_DISTANCE", "12"))
+
+# Giá trị trả về khi không tìm thấy trường (không dùng làm khóa trùng lặp)
+_NOT_FOUND_PREFIXES = ("Không tìm thấy", "Không thể trích xuất")
+
+
+def image_hash(content, hash_size=DEFAULT_HASH_SIZE):
+    """
+    Mã băm cảm nhận (dHash) của ảnh: thu nhỏ thành ảnh xám (hash_size + 1) x hash_size và
+    so sánh độ sáng các điểm ảnh liền kề. Hai ảnh chụp cùng một hóa đơn có mã băm chênh lệch ít bit.
+
+    Returns:
+        int: Mã băm `hash_size * hash_size` bit, None nếu không có Pillow hoặc không đọc được ảnh.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Chưa cài Pillow, bỏ qua bước phát hiện ảnh trùng")
+        return None
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            # Với JPEG, giải mã luôn ở độ phân giải thấp
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            small = ImageOps.exif_transpose(image).convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    except Exception as e:
+        logger.warning(f"Không thể tính mã băm ảnh: {e}")
+        return None
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Cây BK theo khoảng cách Hamming: tìm mọi mã băm trong bán kính cho trước mà không duyệt toàn bộ.
+    Mỗi nút: [mã băm, giá trị, {khoảng cách: nút con}].
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, key, value):
+        self.size += 1
+        if self._root is None:
+            self._root = [key, value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """Các cặp (khoảng cách, giá trị) có khoảng cách tới `key` không quá `max_distance`, gần nhất trước"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[1]))
+            # Bất đẳng thức tam giác: chỉ các nhánh trong khoảng [d - r, d + r] có thể chứa kết quả
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class DuplicateIndex:
+    """
+    Chỉ mục hóa đơn đã xử lý để nhận ra ảnh chụp lại cùng một hóa đơn:
+    - theo mã băm cảm nhận (trước khi OCR): ảnh gần giống được trả lời bằng kết quả đã lưu, không gọi OCR;
+    - theo cặp (số hóa đơn, tổng tiền) sau khi trích xuất: ảnh khác nhưng cùng hóa đơn được đánh dấu.
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._tree = BKTree()
+        self._by_fields = {}
+        self._lock = threading.Lock()
+
+    def find(self, phash):
+        """Kết quả đã lưu của ảnh gần giống nhất (đã đánh dấu trùng), None nếu không có"""
+        if phash is None:
+            return None
+        with self._lock:
+            matches = self._tree.search(phash, self.max_distance)
+        if not matches:
+            return None
+        distance, (key, result) = matches[0]
+        return dict(result, duplicate="image", duplicate_of=key, duplicate_distance=distance)
+
+    def add(self, phash, key, result):
+        """
+        Lưu kết quả vừa trích xuất. Nếu đã có hóa đơn cùng số hóa đơn và tổng tiền,
+        trả về kết quả được đánh dấu trùng; ngược lại trả về nguyên kết quả.
+        """
+        fields = (result['invoice_number'], result['total_amount'])
+        usable = not any(value.startswith(_NOT_FOUND_PREFIXES) for value in fields)
+
+        with self._lock:
+            if phash is not None:
+                self._tree.add(phash, (key, result))
+            original = self._by_fields.get(fields) if usable else None
+            if usable and original is None:
+                self._by_fields[fields] = key
+
+        if original is not None and original != key:
+            return dict(result, duplicate="invoice", duplicate_of=original)
+        return result
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index():
+    """Lấy chỉ mục ảnh trùng dùng chung cho toàn tiến trình"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DuplicateIndex()
+    return _index
+
+
+def set_duplicate_index(index):
+    """Thay chỉ mục ảnh trùng dùng chung, trả về chỉ mục cũ"""
+    global _index
+    with _index_lock:
+        previous, _index = _index, index
+    return previous
@@ -0,0 +1,86 @@
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_PAGE_WORKERS = int(os.environ.get("OCR_PAGE_WORKERS", "4"))
+DEFAULT_PDF_DPI = int(os.environ.get("OCR_PDF_DPI", "200"))
+
+# Chữ ký đầu file của các định dạng nhiều trang
+_TIFF_SIGNATURES = (b"II*\x00", b"MM\x00*")
+_PDF_SIGNATURE = b"%PDF"
+
+# Phần mở rộng của các file tài liệu nhiều trang
+DOCUMENT_EXTENSIONS = (".tif", ".tiff", ".pdf")
+
+
+def document_type(content):
+    """Loại tài liệu theo chữ ký đầu file: "tiff", "pdf" hoặc None (ảnh một trang)"""
+    head = bytes(content[:4])
+    if head in _TIFF_SIGNATURES:
+        return "tiff"
+    if head == _PDF_SIGNATURE:
+        return "pdf"
+    return None
+
+
+def _encode_page(image):
+    """Mã hóa một trang để gửi OCR: ảnh đen trắng giữ PNG (nhỏ, không mất nét), còn lại nén JPEG"""
+    output = io.BytesIO()
+    if image.mode == "1":
+        image.save(output, format="PNG", optimize=True)
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def _iter_tiff_pages(content):
+    from PIL import Image, ImageSequence
+
+    with Image.open(io.BytesIO(content)) as image:
+        # Mỗi lần chỉ giải mã một trang
+        for frame in ImageSequence.Iterator(image):
+            yield _encode_page(frame)
+
+
+def _iter_pdf_pages(content, dpi):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise ImportError("Cần cài pypdfium2 để xử lý hóa đơn PDF (pip install pypdfium2)") from None
+
+    pdf = pdfium.PdfDocument(bytes(content))
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                bitmap = page.render(scale=dpi / 72, grayscale=True)
+                yield _encode_page(bitmap.to_pil())
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+
+def iter_pages(content, dpi=DEFAULT_PDF_DPI):
+    """
+    Duyệt lười các trang của tài liệu: mỗi trang được giải mã và mã hóa lại thành ảnh
+    chỉ khi cần, nên toàn bộ tài liệu không bao giờ nằm trong bộ nhớ ở dạng đã giải mã.
+
+    Args:
+        content (bytes-like): Nội dung file TIFF nhiều trang, PDF hoặc ảnh một trang.
+        dpi (int): Độ phân giải khi dựng trang PDF thành ảnh.
+    Yields:
+        bytes: Ảnh của từng trang, theo thứ tự.
+    """
+    kind = document_type(content)
+    if kind == "tiff":
+        yield from _iter_tiff_pages(content)
+    elif kind == "pdf":
+        yield from _iter_pdf_pages(content, dpi)
+    else:
+        yield content
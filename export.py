@@ -0,0 +1,265 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+
+from amount_index import amount_to_vnd
+from field_scanner import parse_date
+from history_store import DEFAULT_DB_PATH, HistoryStore
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "10000"))
+
+# Định dạng xuất: jsonl giữ nguyên bản ghi, csv và parquet/arrow (dạng cột) dùng các cột có kiểu bên dưới
+EXPORT_FORMATS = ("jsonl", "csv", "parquet", "arrow")
+
+# Các cột xuất ra và kiểu dữ liệu (tên kiểu Arrow):
+# - amount_vnd: tổng tiền là số nguyên đồng, invoice_date: ngày đọc từ `date_info` (None nếu không đọc được)
+# - id, processed_at, status chỉ có khi xuất lịch sử; error chỉ có khi xử lý file bị lỗi (batch_invoice)
+EXPORT_COLUMNS = {
+    "id": "int64",
+    "file_name": "string",
+    "invoice_number": "string",
+    "total_amount": "string",
+    "amount_vnd": "int64",
+    "date_info": "string",
+    "invoice_date": "date32",
+    "vendor": "string",
+    "status": "string",
+    "processed_at": "timestamp",
+    "error": "string",
+}
+
+# Tiền tố giá trị khi không tìm thấy hoặc không trích xuất được trường
+_MISSING_PREFIXES = ("Không tìm thấy", "Không thể trích xuất")
+
+
+def export_format(path):
+    """Định dạng xuất theo đuôi file (mặc định jsonl)"""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("feather", "ipc"):
+        return "arrow"
+    return extension if extension in EXPORT_FORMATS else "jsonl"
+
+
+def export_row(record):
+    """
+    Một dòng xuất với các cột `EXPORT_COLUMNS` từ một bản ghi kết quả: dòng lịch sử (`HistoryStore`),
+    bản ghi của batch_invoice (`file`, các trường, có thể có `error`) hoặc kết quả `extract_invoice_data`.
+    """
+    invoice_number = record.get("invoice_number")
+    total_amount = record.get("total_amount")
+    date_info = record.get("date_info")
+    processed_at = record.get("timestamp")
+    return {
+        "id": record.get("id"),
+        "file_name": record.get("file_name", record.get("file")),
+        "invoice_number": invoice_number,
+        "total_amount": total_amount,
+        "amount_vnd": amount_to_vnd(total_amount) if total_amount and not total_amount.startswith(
+            _MISSING_PREFIXES) else None,
+        "date_info": date_info,
+        "invoice_date": parse_date(date_info) if date_info and not date_info.startswith(_MISSING_PREFIXES) else None,
+        "vendor": record.get("vendor"),
+        "status": record.get("status"),
+        "processed_at": datetime.datetime.fromisoformat(processed_at) if processed_at else None,
+        "error": record.get("error"),
+    }
+
+
+class JsonlExporter:
+    """Ghi nguyên các bản ghi ra JSONL (mỗi dòng một bản ghi)"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, records):
+        for record in records:
+            self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        self.flush()
+
+
+class CsvExporter:
+    """Ghi các dòng xuất ra CSV ngay khi nhận (không giữ lại trong bộ nhớ)"""
+
+    def __init__(self, output):
+        self.output = output
+        self._writer = csv.DictWriter(output, fieldnames=list(EXPORT_COLUMNS))
+        self._writer.writeheader()
+
+    def write(self, records):
+        self._writer.writerows(export_row(record) for record in records)
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        self.flush()
+
+
+class ArrowExporter:
+    """
+    Ghi các dòng xuất ra Parquet hoặc file Arrow IPC (cần pyarrow) với các cột có kiểu, để chương trình đọc
+    chỉ cần đọc những cột cần thiết. Các dòng được gom tối đa `chunk_size` rồi ghi thành một row group
+    (Parquet) hoặc record batch (Arrow), nên bộ nhớ không phụ thuộc tổng số dòng.
+    """
+
+    def __init__(self, output, fmt="parquet", chunk_size=DEFAULT_CHUNK_SIZE):
+        import pyarrow as pa
+
+        types = {"int64": pa.int64(), "string": pa.string(), "date32": pa.date32(), "timestamp": pa.timestamp("s")}
+        self._pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS.items()])
+        self.chunk_size = max(1, chunk_size)
+        self._rows = []
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(output, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(output, self.schema)
+
+    def write(self, records):
+        for record in records:
+            self._rows.append(export_row(record))
+            if len(self._rows) >= self.chunk_size:
+                self._write_rows()
+
+    def _write_rows(self):
+        if self._rows:
+            self._writer.write_batch(self._pa.RecordBatch.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def flush(self):
+        # Không ghi phần đang gom để tránh các row group quá nhỏ; file chỉ đọc được sau khi close()
+        pass
+
+    def close(self):
+        self._write_rows()
+        self._writer.close()
+
+
+def open_exporter(output, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Tạo bộ ghi theo định dạng. `output` là luồng văn bản với jsonl/csv, đường dẫn hoặc luồng nhị phân với
+    parquet/arrow.
+    """
+    if fmt == "jsonl":
+        return JsonlExporter(output)
+    if fmt == "csv":
+        return CsvExporter(output)
+    if fmt in ("parquet", "arrow"):
+        return ArrowExporter(output, fmt, chunk_size)
+    raise ValueError(f"Định dạng xuất không được hỗ trợ: {fmt}")
+
+
+def export_chunks(chunks, output, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Ghi lần lượt các phần bản ghi (ví dụ `HistoryStore.iter_chunks()`), trả về số bản ghi đã ghi.
+    Chỉ một phần được giữ trong bộ nhớ tại mỗi thời điểm.
+    """
+    exporter = open_exporter(output, fmt, chunk_size)
+    count = 0
+    try:
+        for records in chunks:
+            exporter.write(records)
+            count += len(records)
+    finally:
+        exporter.close()
+    return count
+
+
+def export_to_file(chunks, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Ghi các phần bản ghi vào file tạm (giữ trong bộ nhớ tới 8 MB rồi chuyển ra đĩa), trả về file nhị phân
+    đã quay về đầu, ví dụ để dùng làm dữ liệu cho nút tải xuống của Streamlit.
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    if fmt in ("jsonl", "csv"):
+        text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+        export_chunks(chunks, text, fmt, chunk_size)
+        text.detach()
+    else:
+        export_chunks(chunks, output, fmt, chunk_size)
+    output.seek(0)
+    return output
+
+
+def iter_jsonl_chunks(input_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Các bản ghi của file JSONL (ví dụ kết quả batch_invoice), mỗi lần một phần tối đa `chunk_size` bản ghi"""
+    chunk = []
+    for line in input_file:
+        if line.strip():
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Xuất lịch sử trích xuất hoặc kết quả batch_invoice (JSONL) ra CSV, Parquet hoặc Arrow theo từng phần"
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", default=DEFAULT_DB_PATH, help="File SQLite lịch sử trích xuất (mặc định)")
+    source.add_argument("--jsonl", help="File JSONL kết quả của batch_invoice.py ('-' để đọc stdin)")
+    parser.add_argument("-o", "--output", required=True, help="File đầu ra ('-' để ghi CSV ra stdout)")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS,
+                        help="Định dạng đầu ra (mặc định theo đuôi file: .csv, .parquet, .arrow)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Số bản ghi đọc và ghi mỗi lần (cũng là kích thước row group Parquet)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output == "-" else export_format(args.output))
+    chunk_size = max(1, args.chunk_size)
+    if args.output == "-" and fmt not in ("jsonl", "csv"):
+        logger.error(f"Không thể ghi định dạng {fmt} ra stdout")
+        return 1
+
+    store = None
+    input_file = None
+    if args.jsonl:
+        input_file = sys.stdin if args.jsonl == "-" else open(args.jsonl, encoding="utf-8")
+        chunks = iter_jsonl_chunks(input_file, chunk_size)
+    else:
+        store = HistoryStore(args.db)
+        chunks = store.iter_chunks(chunk_size)
+
+    try:
+        if args.output == "-":
+            count = export_chunks(chunks, sys.stdout, fmt, chunk_size)
+        elif fmt in ("jsonl", "csv"):
+            with open(args.output, "w", encoding="utf-8", newline="") as output:
+                count = export_chunks(chunks, output, fmt, chunk_size)
+        else:
+            count = export_chunks(chunks, args.output, fmt, chunk_size)
+    except ImportError as e:
+        logger.error(f"Cần cài pyarrow để xuất {fmt}: {e}")
+        return 1
+    finally:
+        if input_file is not None and input_file is not sys.stdin:
+            input_file.close()
+        if store is not None:
+            store.close()
+
+    logger.info(f"Đã xuất {count} bản ghi ra {args.output} ({fmt})")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
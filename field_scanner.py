@@ -0,0 +1,282 @@
+import datetime
+import re
+import unicodedata
+from bisect import bisect_left
+
+from text_normalize import NormalizedMatch, NormalizedText, fold
+
+# Mọi từ khóa và mẫu bên dưới được so trên bản bỏ dấu, chữ thường của văn bản (`text_normalize.fold`),
+# nên chỉ cần viết một dạng: "so hd" khớp "Số HĐ", "SỐ HD", "so hd"...
+
+# Các từ khóa neo: mỗi mẫu trích xuất chỉ có thể bắt đầu tại vị trí của một trong các từ khóa này.
+# Lưu ý: các từ khóa không được là tiền tố của nhau, để tại mỗi vị trí chỉ có đúng một nhóm khớp.
+ANCHOR_KEYWORDS = {
+    'so': ('so',),
+    'ma': ('ma',),
+    'hoa': ('hoa',),
+    'hd': ('hd', 'h.d'),
+    'invoice': ('invoice', 'bill'),
+    'tong': ('tong',),
+    't_dot': ('t.',),
+    'thanh': ('thanh',),
+    'tien': ('tien',),
+    'total': ('total', 'grand', 'amount', 'sum'),
+    'ngay': ('ngay',),
+}
+
+
+def _build_scanner():
+    """
+    Ghép mọi từ khóa neo và mẫu ngày tháng DD/MM/YYYY thành một regex duy nhất.
+
+    Regex bắt đầu bằng một tập ký tự (để `re` bỏ qua nhanh các vị trí không liên quan), chỉ tiêu thụ
+    một ký tự rồi kiểm tra phần còn lại bằng lookahead, nhờ vậy các vị trí chồng lấn vẫn được ghi nhận.
+    Trả về regex và bảng ánh xạ tên nhóm -> loại sự kiện.
+    """
+    by_first_char = {}
+    for kind, keywords in ANCHOR_KEYWORDS.items():
+        for keyword in keywords:
+            by_first_char.setdefault(keyword[0], {}).setdefault(kind, []).append(re.escape(keyword[1:]))
+
+    group_kinds = {'date': 'date'}
+    first_chars = []
+    branches = []
+    for first, kinds in by_first_char.items():
+        first = re.escape(first)
+        first_chars.append(first)
+        alternatives = []
+        for kind, rests in kinds.items():
+            group = f'{kind}_{len(group_kinds)}'
+            group_kinds[group] = kind
+            alternatives.append(f"(?=(?:{'|'.join(rests)}))(?P<{group}>)")
+        branches.append(f"(?<={first})(?:{'|'.join(alternatives)})")
+
+    branches.append(r'(?<=\d)(?=(?P<date>\d?[\/\-\.]\d{1,2}[\/\-\.]\d{2,4}))')
+
+    pattern = f"[{''.join(first_chars)}\\d](?:{'|'.join(branches)})"
+    return re.compile(pattern), group_kinds
+
+
+# Bộ quét tổng hợp: một lượt duyệt văn bản tìm mọi từ khóa neo và mọi chuỗi ngày tháng
+_SCANNER, _GROUP_KINDS = _build_scanner()
+
+# Mẫu số hóa đơn theo thứ tự ưu tiên, kèm các nhóm từ khóa neo nơi mẫu có thể bắt đầu
+INVOICE_NUMBER_PATTERNS = [
+    # Mẫu 1: Ưu tiên mã hóa đơn dài (6 chữ số trở lên) sau "Số:", "Số HĐ:", v.v.
+    (re.compile(r'(?:so|so\s*hd|so\s*hoa\s*don|ma\s*hd)\s*[:#=\.]?\s*(\d{6,})'),
+     ('so', 'ma')),
+
+    # Mẫu 2: Các kiểu định dạng chuẩn với "Số HĐ", "Số HD", etc.
+    (re.compile(r'(?:so\s*hd|so\s*hoa\s*don|ma\s*hd)\s*[:#=\.]?\s*([a-z0-9-\/]+)'),
+     ('so', 'ma')),
+
+    # Mẫu 3: "HÓA ĐƠN THANH TOÁN" và sau đó là số ("so", "no", "ma" phải là từ riêng, không khớp "Nội", "mặt")
+    (re.compile(r'hoa\s*don\s*thanh\s*toan\s*(?:.*\n){0,2}.*?\b(?:so|no|ma)\b\s*[:#=\.]?\s*([a-z0-9-\/]+)'),
+     ('hoa',)),
+
+    # Mẫu 4: "HD" hoặc "HĐ" và sau đó là số
+    (re.compile(r'(?:hd|h\.d)[:#=\.\s]*([a-z0-9-\/]+)'),
+     ('hd',)),
+
+    # Mẫu 5: Tiếng Anh - Invoice number
+    (re.compile(r'(?:invoice\s*(?:number|no\.?|id)|bill\s*no\.?)\s*[:#=]?\s*([a-z0-9-\/]+)'),
+     ('invoice',)),
+]
+
+# Dòng có nhãn số hóa đơn (\s không vượt qua ký tự xuống dòng để chỉ khớp trong một dòng)
+INVOICE_LINE_PATTERN = (
+    re.compile(r'so[^\S\n]*(?:hd|hoa[^\S\n]*don)'),
+    ('so',),
+)
+
+# Mẫu tổng tiền theo thứ tự ưu tiên; mẫu không có từ khóa neo (None) được quét trên toàn văn bản
+TOTAL_AMOUNT_PATTERNS = [
+    # Mẫu 1: Các biến thể của "Tổng cộng", "Tổng tiền" (cả "TONG TIEN"), "Thành tiền"
+    (re.compile(r'(?:tong\s*(?:cong|tien|thanh\s*toan)|t\.\s*cong|thanh\s*tien)\s*[:=]?\s*([\d\., ]+)'),
+     ('tong', 't_dot', 'thanh')),
+
+    # Mẫu 2: "TIỀN MẶT" hoặc các biến thể
+    (re.compile(r'tien\s*mat\s*[:=]?\s*([\d\., ]+)'),
+     ('tien',)),
+
+    # Mẫu 3: Tiếng Anh - Total, Grand Total, Amount
+    (re.compile(r'(?:total|grand\s*total|amount|sum|total\s*amount)\s*[:=]?\s*(?:vnd|₫|d\b)?\s*([\d\., ]+)'),
+     ('total',)),
+
+    # Mẫu 4: Số tiền lớn nhất với đơn vị tiền tệ ("đ", "đồng", "VNĐ"...; "d" phải đứng riêng để không khớp "Đường").
+    # Nhóm 2 là đơn vị: khi bỏ dấu "dong" trùng cả "dòng", "đông", nên đơn vị được kiểm tra lại trên văn bản gốc
+    # (`is_currency_unit`)
+    (re.compile(r'([\d\., ]+)\s*(vnd|₫|d(?:ong)?\b)'),
+     None),
+
+    # Mẫu 5: "SỐ TIỀN" hoặc "THANH TOÁN"
+    (re.compile(r'(?:so\s*tien|thanh\s*toan)\s*[:=]?\s*([\d\., ]+)'),
+     ('so', 'thanh')),
+]
+
+# Nhãn tổng tiền dùng cho tra cứu theo bố cục (giá trị nằm bên phải hoặc bên dưới nhãn), theo thứ tự ưu tiên.
+# Không dùng "Thành tiền" vì đó thường là tiêu đề cột, giá trị bên dưới là tiền của từng món.
+TOTAL_LABEL_PATTERNS = [
+    (re.compile(r'tong\s*(?:cong|tien|thanh\s*toan)|t\.\s*cong'), ('tong', 't_dot')),
+    (re.compile(r'tien\s*mat'), ('tien',)),
+    (re.compile(r'grand\s*total|total(?:\s*amount)?|amount'), ('total',)),
+]
+
+# "Tổng:" theo sau là số
+TOTAL_FALLBACK_PATTERN = (re.compile(r'tong:\s*([\d\.,]+)'), ('tong',))
+
+# Dòng có từ khóa tổng tiền (tìm tổng tiền theo dòng khi các mẫu trên không khớp)
+TOTAL_KEYWORD_PATTERN = (
+    re.compile(r'tong|tien mat|thanh toan|thanh tien|t\.cong|t\.tien|total'),
+    ('tong', 'tien', 'thanh', 't_dot', 'total'),
+)
+
+# Mẫu ngày tháng có từ khóa "Ngày" (mẫu DD/MM/YYYY được bộ quét tổng hợp tìm trực tiếp)
+DATE_KEYWORD_PATTERNS = [
+    # Mẫu "Ngày... tháng... năm..." trong tiếng Việt
+    (re.compile(r'ngay\s*(\d{1,2})\s*thang\s*(\d{1,2})\s*nam\s*(\d{2,4})'), ('ngay',)),
+
+    # Mẫu "Ngày" và sau đó là ngày
+    (re.compile(r'ngay\s*[:]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})'), ('ngay',)),
+]
+
+# Đơn vị tiền tệ hợp lệ của mẫu tổng tiền 4, so trên văn bản gốc (dạng NFC)
+_CURRENCY_UNIT_RE = re.compile(r'vn[dđ]|₫|đồng|đ', re.IGNORECASE)
+
+# Ngày dạng số (ngày trước tháng) trong kết quả trích xuất, cho phép khoảng trắng quanh dấu phân cách
+_NUMERIC_DATE_RE = re.compile(r'(\d{1,2})\s*[\/\-\.]\s*(\d{1,2})\s*[\/\-\.]\s*(\d{2,4})')
+
+# Ký tự xuống dòng (bảng vị trí dòng của `ScanResult.line_of`)
+_NEWLINE_RE = re.compile(r'\n')
+
+# Khoảng năm hợp lệ của ngày hóa đơn (loại các chuỗi số khác bị nhận nhầm là ngày)
+_MIN_YEAR, _MAX_YEAR = 1900, 2100
+
+
+class ScanResult:
+    """
+    Kết quả quét một văn bản: vị trí các từ khóa neo và các chuỗi ngày tháng.
+
+    Văn bản chỉ được quét một lần, từ trái sang phải và chỉ đến chỗ cần thiết:
+    nếu các trường đều tìm thấy ở phần đầu hóa đơn thì phần còn lại không bị quét.
+    Việc quét và so mẫu chạy trên bản đã chuẩn hóa (`normalized.folded`); vị trí từ khóa neo tính theo bản
+    này, còn các kết quả khớp trả về (`NormalizedMatch`) cho giá trị và vị trí theo văn bản gốc.
+    """
+
+    def __init__(self, text):
+        self.normalized = NormalizedText(text)
+        self.text = self.normalized.folded
+        # Các từ khóa neo đã quét được: (vị trí, nhóm) theo thứ tự tăng dần
+        self.anchors = []
+        self.dates = []
+        self._matches = _SCANNER.finditer(self.text)
+        self._exhausted = False
+        # Vị trí các ký tự xuống dòng, tính khi cần đến lần đầu (`line_of`)
+        self._newlines = None
+
+    def _advance(self):
+        """Quét đến sự kiện tiếp theo, trả về False nếu đã hết văn bản"""
+        match = next(self._matches, None)
+        if match is None:
+            self._exhausted = True
+            return False
+
+        kind = _GROUP_KINDS[match.lastgroup]
+        if kind == 'date':
+            self.dates.append(self.normalized.original_span(match.start(), match.end('date')))
+        else:
+            self.anchors.append((match.start(), kind))
+        return True
+
+    @property
+    def first_date(self):
+        """Chuỗi ngày tháng DD/MM/YYYY đầu tiên trong văn bản (None nếu không có)"""
+        while not self.dates and not self._exhausted:
+            self._advance()
+        return self.dates[0] if self.dates else None
+
+    def positions(self, kinds):
+        """Các vị trí (tăng dần) có thể bắt đầu mẫu với các nhóm từ khóa neo đã cho"""
+        anchors = self.anchors
+        i = 0
+        while True:
+            while i < len(anchors):
+                pos, kind = anchors[i]
+                i += 1
+                if kind in kinds:
+                    yield pos
+            if self._exhausted or not self._advance():
+                return
+
+    def search(self, pattern, kinds):
+        """Tương đương `pattern.search(text)` nhưng chỉ thử tại các vị trí từ khóa neo"""
+        if kinds is None:
+            match = pattern.search(self.text)
+            return NormalizedMatch(match, self.normalized) if match else None
+        for pos in self.positions(kinds):
+            match = pattern.match(self.text, pos)
+            if match:
+                return NormalizedMatch(match, self.normalized)
+        return None
+
+    def finditer(self, pattern, kinds):
+        """Tương đương `pattern.finditer(text)` nhưng chỉ thử tại các vị trí từ khóa neo"""
+        if kinds is None:
+            for match in pattern.finditer(self.text):
+                yield NormalizedMatch(match, self.normalized)
+            return
+        end = 0
+        for pos in self.positions(kinds):
+            if pos < end:
+                continue
+            match = pattern.match(self.text, pos)
+            if match:
+                yield NormalizedMatch(match, self.normalized)
+                end = match.end()
+
+    def line_of(self, pos):
+        """Chỉ số dòng chứa vị trí `pos`"""
+        if self._newlines is None:
+            self._newlines = [match.start() for match in _NEWLINE_RE.finditer(self.text)]
+        return bisect_left(self._newlines, pos)
+
+    def matching_lines(self, pattern, kinds):
+        """Chỉ số (tăng dần, không trùng) các dòng có chứa mẫu"""
+        last_line = -1
+        for pos in self.positions(kinds):
+            line_no = self.line_of(pos)
+            if line_no != last_line and pattern.match(self.text, pos):
+                last_line = line_no
+                yield line_no
+
+
+def scan_fields(full_text):
+    """Quét văn bản OCR một lần, trả về các ứng viên cho mọi trường cần trích xuất"""
+    return ScanResult(full_text)
+
+
+def is_currency_unit(unit):
+    """Đơn vị (văn bản gốc) có phải "đ", "đồng", "VND", "VNĐ" hoặc "₫" không (không nhận "dòng", "đông", "d")"""
+    return _CURRENCY_UNIT_RE.fullmatch(unicodedata.normalize('NFC', unit)) is not None
+
+
+def parse_date(date_info):
+    """
+    Ngày hóa đơn từ kết quả `extract_date_info` ("20/11/2024", "Ngày 12 tháng 03 năm 2024", dòng chứa ngày...).
+
+    Returns:
+        datetime.date: None nếu không đọc được ngày hợp lệ. Năm hai chữ số được hiểu là 20xx.
+    """
+    text = fold(date_info)
+    match = DATE_KEYWORD_PATTERNS[0][0].search(text) or _NUMERIC_DATE_RE.search(text)
+    if match is None:
+        return None
+    day, month, year = (int(value) for value in match.groups())
+    if year < 100:
+        year += 2000
+    if not _MIN_YEAR <= year <= _MAX_YEAR:
+        return None
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
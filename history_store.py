@@ -0,0 +1,224 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_DB_PATH = os.environ.get("HISTORY_DB", "invoice_history.db")
+DEFAULT_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+DEFAULT_CHUNK_SIZE = int(os.environ.get("HISTORY_CHUNK_SIZE", "10000"))
+
+# Trạng thái trích xuất, tính trực tiếp trong SQL (không cần duyệt từng dòng bằng Python):
+# thành công nếu tìm thấy cả số hóa đơn và tổng tiền, một phần nếu chỉ tìm thấy một trong hai
+_NOT_FOUND = "'không tìm thấy'"
+_STATUS_SQL = (
+    "CASE"
+    f" WHEN instr(lower(invoice_number), {_NOT_FOUND}) = 0 AND instr(lower(total_amount), {_NOT_FOUND}) = 0"
+    " THEN '✅ Thành công'"
+    f" WHEN instr(lower(invoice_number), {_NOT_FOUND}) = 0 OR instr(lower(total_amount), {_NOT_FOUND}) = 0"
+    " THEN '⚠️ Một phần'"
+    " ELSE '❌ Thất bại' END"
+)
+
+# Tiền tố số hóa đơn của kết quả khi xử lý ảnh bị lỗi
+_ERROR_PREFIX = "Không thể trích xuất"
+
+# Các cột trả về cho giao diện lịch sử
+HISTORY_COLUMNS = ("id", "file_name", "invoice_number", "total_amount", "date_info", "timestamp", "status")
+_SELECT_SQL = (
+    "SELECT id, file_name, invoice_number, total_amount, date_info,"
+    f" datetime(created_at, 'unixepoch', 'localtime'), {_STATUS_SQL}"
+    " FROM invoice_history"
+)
+_INSERT_SQL = (
+    "INSERT INTO invoice_history"
+    " (file_name, invoice_number, total_amount, date_info, created_at, full_text, response)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class HistoryStore:
+    """
+    Lịch sử trích xuất lưu trong SQLite, giữ lại giữa các phiên làm việc.
+
+    Có chỉ mục theo số hóa đơn, ngày trên hóa đơn và thời điểm xử lý; giao diện chỉ đọc
+    từng trang nên vẫn nhanh khi lịch sử có hàng trăm nghìn hóa đơn.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS invoice_history ("
+            " id INTEGER PRIMARY KEY,"
+            " file_name TEXT,"
+            " invoice_number TEXT NOT NULL,"
+            " total_amount TEXT NOT NULL,"
+            " date_info TEXT,"
+            " created_at REAL NOT NULL,"
+            " full_text TEXT,"
+            " response BLOB)"
+        )
+        # Văn bản OCR và kết quả OCR gốc (AnnotateImageResponse đã serialize) của từng hóa đơn dùng để
+        # trích xuất lại khi sửa các mẫu regex mà không phải gọi OCR; thêm cột cho CSDL tạo từ phiên bản cũ
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(invoice_history)")}
+        if "full_text" not in columns:
+            self._db.execute("ALTER TABLE invoice_history ADD COLUMN full_text TEXT")
+        if "response" not in columns:
+            self._db.execute("ALTER TABLE invoice_history ADD COLUMN response BLOB")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_history_invoice_number ON invoice_history(invoice_number)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_history_date_info ON invoice_history(date_info)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_history_created_at ON invoice_history(created_at)")
+        self._db.commit()
+
+    @staticmethod
+    def _row(result, file_name, created_at, response=None):
+        # Kết quả lỗi (không có văn bản OCR thật) và kết quả chỉ OCR vùng đầu/cuối (OCR theo vùng, `full_text`
+        # không phải văn bản của cả hóa đơn) không được dùng để trích xuất lại
+        full_text = result.get('full_text')
+        if result['invoice_number'].startswith(_ERROR_PREFIX) or result.get('ocr_region') == 'roi':
+            full_text = None
+        data = type(response).serialize(response) if response is not None else None
+        return (file_name, result['invoice_number'], result['total_amount'], result.get('date_info'), created_at,
+                full_text, data)
+
+    def add(self, result, file_name=None, response=None):
+        """
+        Lưu một kết quả trích xuất, trả về id của bản ghi.
+
+        Args:
+            result (dict): Kết quả trích xuất (kèm `full_text` nếu có).
+            file_name (str): Tên file ảnh.
+            response (vision.AnnotateImageResponse): Kết quả OCR gốc, nếu có.
+        """
+        with self._lock:
+            cursor = self._db.execute(_INSERT_SQL, self._row(result, file_name, time.time(), response))
+            self._db.commit()
+        return cursor.lastrowid
+
+    def add_many(self, items):
+        """Lưu nhiều kết quả trong một giao dịch: `items` là các bộ (kết quả, tên file) hoặc (kết quả, tên file, kết quả OCR)"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                _INSERT_SQL,
+                [self._row(result, file_name, now, *response) for result, file_name, *response in items],
+            )
+            self._db.commit()
+
+    def count(self):
+        """Tổng số bản ghi"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM invoice_history").fetchone()[0]
+
+    def page(self, page=1, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Một trang lịch sử, mới nhất trước.
+
+        Returns:
+            list[dict]: Các bản ghi với các cột `HISTORY_COLUMNS` (trạng thái được tính trong SQL).
+        """
+        offset = max(0, page - 1) * page_size
+        with self._lock:
+            rows = self._db.execute(
+                _SELECT_SQL + " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                (page_size, offset),
+            ).fetchall()
+        return [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+    def find_by_invoice_number(self, invoice_number):
+        """Các bản ghi có số hóa đơn đã cho (dùng chỉ mục), mới nhất trước"""
+        with self._lock:
+            rows = self._db.execute(
+                _SELECT_SQL + " WHERE invoice_number = ? ORDER BY created_at DESC, id DESC",
+                (invoice_number,),
+            ).fetchall()
+        return [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Toàn bộ lịch sử theo thứ tự id, mỗi lần một phần tối đa `chunk_size` bản ghi (dùng để xuất dữ liệu).
+        Mỗi phần được đọc bằng một truy vấn theo id (không dùng OFFSET) và khóa chỉ giữ trong lúc đọc phần đó.
+
+        Yields:
+            list[dict]: Các bản ghi với các cột `HISTORY_COLUMNS`.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    _SELECT_SQL + " WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [dict(zip(HISTORY_COLUMNS, row)) for row in rows]
+            last_id = rows[-1][0]
+
+    def id_range(self):
+        """Id nhỏ nhất và lớn nhất của các bản ghi có văn bản OCR, (None, None) nếu không có"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT MIN(id), MAX(id) FROM invoice_history WHERE full_text IS NOT NULL"
+            ).fetchone()
+
+    def documents(self, start_id, end_id):
+        """
+        Các bản ghi có văn bản OCR với id trong khoảng [start_id, end_id), theo thứ tự id.
+
+        Returns:
+            list[tuple]: (id, file_name, invoice_number, total_amount, date_info, full_text, response).
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, file_name, invoice_number, total_amount, date_info, full_text, response"
+                " FROM invoice_history WHERE id >= ? AND id < ? AND full_text IS NOT NULL ORDER BY id",
+                (start_id, end_id),
+            ).fetchall()
+
+    def update_fields(self, rows):
+        """
+        Ghi lại các trường đã trích xuất lại: `rows` là các bộ (invoice_number, total_amount, date_info, id),
+        giá trị None giữ nguyên trường đó.
+        """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE invoice_history SET invoice_number = COALESCE(?, invoice_number),"
+                " total_amount = COALESCE(?, total_amount), date_info = COALESCE(?, date_info) WHERE id = ?",
+                rows,
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM invoice_history")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Lấy kho lịch sử dùng chung cho toàn tiến trình"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore()
+    return _store
+
+
+def set_history_store(store):
+    """Thay kho lịch sử dùng chung (ví dụ dùng ":memory:" khi kiểm thử), trả về kho cũ"""
+    global _store
+    with _store_lock:
+        previous, _store = _store, store
+    return previous
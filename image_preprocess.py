@@ -0,0 +1,98 @@
+import io
+import logging
+import os
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_ENABLED = os.environ.get("OCR_PREPROCESS", "0") == "1"
+DEFAULT_MAX_DIMENSION = int(os.environ.get("OCR_MAX_DIMENSION", "2048"))
+DEFAULT_GRAYSCALE = os.environ.get("OCR_GRAYSCALE", "1") == "1"
+DEFAULT_JPEG_QUALITY = int(os.environ.get("OCR_JPEG_QUALITY", "85"))
+
+# Thống kê một lần tiền xử lý:
+# - bytes_before, bytes_after: kích thước dữ liệu gửi đi trước và sau tiền xử lý
+# - size_before, size_after: kích thước ảnh (rộng, cao), None nếu không đọc được ảnh
+# - elapsed: thời gian tiền xử lý (giây)
+PreprocessStats = namedtuple(
+    'PreprocessStats', ['bytes_before', 'bytes_after', 'size_before', 'size_after', 'elapsed']
+)
+
+# Thẻ EXIF "Orientation" (1 = ảnh đã đúng chiều)
+_EXIF_ORIENTATION = 0x0112
+
+
+def preprocess_image(content, max_dimension=DEFAULT_MAX_DIMENSION, grayscale=DEFAULT_GRAYSCALE,
+                     quality=DEFAULT_JPEG_QUALITY):
+    """
+    Thu nhỏ ảnh trước khi gửi OCR: xoay theo EXIF, giới hạn cạnh dài, chuyển ảnh xám và nén lại JPEG.
+
+    Nếu không có Pillow, ảnh không đọc được, hoặc ảnh nén lại không nhỏ hơn ảnh gốc (ảnh đã nhỏ và
+    không cần xoay) thì giữ nguyên nội dung gốc.
+
+    Args:
+        content (bytes): Nội dung file ảnh.
+        max_dimension (int): Cạnh dài tối đa (pixel), 0 để không thu nhỏ.
+        grayscale (bool): Chuyển sang ảnh xám.
+        quality (int): Chất lượng JPEG khi nén lại.
+    Returns:
+        tuple: (nội dung ảnh gửi OCR, PreprocessStats).
+    """
+    start_time = time.perf_counter()
+    bytes_before = len(content)
+
+    def unchanged(size=None):
+        return content, PreprocessStats(bytes_before, bytes_before, size, size,
+                                        time.perf_counter() - start_time)
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Chưa cài Pillow, bỏ qua bước tiền xử lý ảnh")
+        return unchanged()
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            size_before = image.size
+            rotated = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+
+            if max_dimension and max(size_before) > max_dimension:
+                # Với JPEG, draft() giảm độ phân giải ngay khi giải mã (theo bội số 1/2, 1/4, 1/8)
+                image.draft("L" if grayscale else "RGB", (max_dimension, max_dimension))
+
+            oriented = ImageOps.exif_transpose(image)
+            if max_dimension and max(oriented.size) > max_dimension:
+                oriented.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            if grayscale:
+                oriented = oriented.convert("L")
+            elif oriented.mode not in ("RGB", "L"):
+                oriented = oriented.convert("RGB")
+
+            output = io.BytesIO()
+            oriented.save(output, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Không thể tiền xử lý ảnh, gửi ảnh gốc: {e}")
+        return unchanged()
+
+    processed = output.getvalue()
+    if len(processed) >= bytes_before and not rotated:
+        return unchanged(size_before)
+
+    return processed, PreprocessStats(bytes_before, len(processed), size_before, oriented.size,
+                                      time.perf_counter() - start_time)
+
+
+def prepare_content(content, enabled=DEFAULT_ENABLED):
+    """Nội dung ảnh sẽ gửi OCR: đã tiền xử lý nếu bật `OCR_PREPROCESS`, ngược lại giữ nguyên"""
+    if not enabled:
+        return content
+
+    processed, stats = preprocess_image(content)
+    logger.info(
+        f"Tiền xử lý ảnh: {stats.bytes_before} -> {stats.bytes_after} bytes, "
+        f"{stats.size_before} -> {stats.size_after}, {stats.elapsed * 1000:.1f} ms"
+    )
+    return processed
@@ -0,0 +1,319 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from ocr_backend import MAX_BATCH_SIZE
+from document_pages import document_type
+from ocr_scheduler import CircuitOpenError
+from process_invoice import annotate_images, extract_document_data, extract_fields
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_HOST = os.environ.get("SERVICE_HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.environ.get("SERVICE_PORT", "8080"))
+DEFAULT_WORKERS = int(os.environ.get("SERVICE_WORKERS", "4"))
+DEFAULT_QUEUE_SIZE = int(os.environ.get("SERVICE_QUEUE_SIZE", "64"))
+DEFAULT_BATCH_WAIT_MS = int(os.environ.get("SERVICE_BATCH_WAIT_MS", "20"))
+DEFAULT_REQUEST_TIMEOUT = float(os.environ.get("SERVICE_REQUEST_TIMEOUT", "60"))
+DEFAULT_MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+
+BATCH_SIZE = metrics.Histogram(
+    "invoice_service_batch_size", "Số ảnh trong mỗi yêu cầu OCR batch của dịch vụ", buckets=(1, 2, 4, 8, 16)
+)
+REJECTED = metrics.Counter(
+    "invoice_service_rejected_total", "Số yêu cầu bị từ chối", labels=("reason",)
+)
+metrics.REGISTRY.extend([BATCH_SIZE, REJECTED])
+
+
+class QueueFull(Exception):
+    """Hàng đợi đã đầy, client cần thử lại sau"""
+
+
+class ServiceStopped(Exception):
+    """Dịch vụ đang dừng, không nhận yêu cầu mới"""
+
+
+class InvoiceService:
+    """
+    Hàng đợi có giới hạn và pool worker xử lý ảnh hóa đơn.
+
+    Mỗi worker lấy một ảnh rồi gom thêm các ảnh đang chờ (tối đa `max_batch`, chờ thêm tối đa
+    `batch_wait` giây) thành một yêu cầu `batch_annotate_images`, nên khi tải cao số lời gọi Vision giảm
+    tới `max_batch` lần. Khi hàng đợi đầy, `submit` báo lỗi ngay thay vì để yêu cầu chờ vô hạn.
+
+    Tài liệu nhiều trang (TIFF, PDF) không nằm trong yêu cầu batch: worker xử lý riêng từng tài liệu bằng
+    `extract_document_data` (OCR song song các trang).
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, max_batch=MAX_BATCH_SIZE,
+                 batch_wait=DEFAULT_BATCH_WAIT_MS / 1000):
+        self.worker_count = max(1, workers)
+        self.max_batch = max(1, min(max_batch, MAX_BATCH_SIZE))
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._running = False
+
+    @property
+    def queue_size(self):
+        return self._queue.qsize()
+
+    @property
+    def healthy(self):
+        return self._running and all(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        self._running = True
+        for i in range(self.worker_count):
+            thread = threading.Thread(target=self._worker, name=f"invoice-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Ngừng nhận yêu cầu, chờ các worker xử lý xong phần còn trong hàng đợi"""
+        self._running = False
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, content, include_text=False):
+        """
+        Đưa một ảnh vào hàng đợi.
+
+        Returns:
+            Future: Kết quả trích xuất (dict) khi worker xử lý xong.
+        Raises:
+            QueueFull: Hàng đợi đã đầy.
+            ServiceStopped: Dịch vụ đang dừng.
+        """
+        if not self._running:
+            raise ServiceStopped()
+        future = Future()
+        try:
+            self._queue.put_nowait((content, include_text, future))
+        except queue.Full:
+            raise QueueFull() from None
+        return future
+
+    def _collect_batch(self, first):
+        """Gom thêm các ảnh đang chờ vào nhóm của `first`, trong giới hạn số lượng và thời gian"""
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # Tín hiệu dừng: trả lại cho worker khác (hoặc chính worker này ở vòng sau)
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = self._collect_batch(job)
+            # Yêu cầu đã bị client bỏ (hết thời gian chờ) thì không cần OCR
+            batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+            images = []
+            for job in batch:
+                if document_type(job[0]) is not None:
+                    self._process_document(job)
+                else:
+                    images.append(job)
+            if images:
+                self._process(images)
+
+    def _process_document(self, job):
+        content, include_text, future = job
+        try:
+            with metrics.span("ocr_document"):
+                result = extract_document_data(content)
+        except Exception as e:
+            logger.error(f"Lỗi khi xử lý tài liệu nhiều trang: {e}")
+            metrics.REQUEST_ERRORS.inc("ocr")
+            future.set_exception(e)
+            return
+        if not include_text:
+            del result['full_text']
+        future.set_result(result)
+
+    def _process(self, batch):
+        BATCH_SIZE.observe(len(batch))
+        try:
+            with metrics.span("ocr_batch"):
+                responses = annotate_images([content for content, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Lỗi khi gọi OCR cho nhóm {len(batch)} ảnh: {e}")
+            metrics.REQUEST_ERRORS.inc("ocr", amount=len(batch))
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, include_text, future), response in zip(batch, responses):
+            try:
+                if response.error.message:
+                    raise Exception(f"Lỗi từ Google Cloud Vision: {response.error.message}")
+                result = extract_fields(response.full_text_annotation.text, response.full_text_annotation)
+                if not include_text:
+                    del result['full_text']
+                future.set_result(result)
+            except Exception as e:
+                metrics.REQUEST_ERRORS.inc("extract")
+                future.set_exception(e)
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == "/healthz":
+            status = 200 if service.healthy else 503
+            self._send_json(status, {
+                "status": "ok" if status == 200 else "unavailable",
+                "workers": service.worker_count,
+                "queue": service.queue_size,
+            })
+        elif path == "/metrics":
+            body = metrics.render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "Không tìm thấy"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/extract":
+            self._send_json(404, {"error": "Không tìm thấy"})
+            return
+
+        raw_length = (self.headers.get("Content-Length") or "0").strip()
+        if not (raw_length.isascii() and raw_length.isdigit()):
+            # Không biết độ dài nội dung nên không thể đọc tiếp các yêu cầu khác trên kết nối này
+            self._send_json(400, {"error": "Content-Length không hợp lệ"}, {"Connection": "close"})
+            return
+        length = int(raw_length)
+        if length == 0:
+            self._send_json(400, {"error": "Thiếu nội dung ảnh"})
+            return
+        if length > self.server.max_body_bytes:
+            # Nội dung không được đọc nên đóng kết nối (header "Connection: close" đặt close_connection)
+            self._send_json(413, {"error": f"Ảnh vượt quá {self.server.max_body_bytes} bytes"},
+                            {"Connection": "close"})
+            return
+        content = self.rfile.read(length)
+
+        include_text = parse_qs(url.query).get("full_text", ["0"])[0] == "1"
+        try:
+            future = self.server.service.submit(content, include_text)
+        except QueueFull:
+            REJECTED.inc("queue_full")
+            self._send_json(429, {"error": "Hàng đợi đã đầy, vui lòng thử lại sau"}, {"Retry-After": "1"})
+            return
+        except ServiceStopped:
+            REJECTED.inc("stopped")
+            self._send_json(503, {"error": "Dịch vụ đang dừng"})
+            return
+
+        try:
+            result = future.result(timeout=self.server.request_timeout)
+        except FutureTimeoutError:
+            # Hủy nếu ảnh còn trong hàng đợi, worker sẽ bỏ qua
+            future.cancel()
+            REJECTED.inc("timeout")
+            self._send_json(503, {"error": "Quá thời gian xử lý, vui lòng thử lại sau"}, {"Retry-After": "5"})
+            return
+        except CircuitOpenError as e:
+            REJECTED.inc("circuit_open")
+            self._send_json(503, {"error": str(e)}, {"Retry-After": str(max(1, round(e.retry_after)))})
+            return
+        except Exception as e:
+            self._send_json(502, {"error": str(e)})
+            return
+
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hàng đợi kết nối của socket: đủ lớn để các yêu cầu dồn dập nhận được 429 thay vì bị reset kết nối
+    request_queue_size = 128
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                  max_body_bytes=DEFAULT_MAX_BODY_BYTES):
+    """Tạo HTTP server gắn với `service` (chưa chạy; gọi `serve_forever()` để phục vụ)"""
+    server = _ServiceServer((host, port), _ServiceHandler)
+    server.service = service
+    server.request_timeout = request_timeout
+    server.max_body_bytes = max_body_bytes
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP trích xuất thông tin hóa đơn")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Địa chỉ lắng nghe")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port lắng nghe")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Số worker gọi OCR đồng thời")
+    parser.add_argument("-q", "--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Số ảnh tối đa trong hàng đợi (vượt quá sẽ trả 429)")
+    parser.add_argument("-b", "--max-batch", type=int, default=MAX_BATCH_SIZE,
+                        help=f"Số ảnh tối đa trong một yêu cầu batch (tối đa {MAX_BATCH_SIZE})")
+    parser.add_argument("--batch-wait-ms", type=int, default=DEFAULT_BATCH_WAIT_MS,
+                        help="Thời gian chờ gom thêm ảnh vào một batch")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                        help="Thời gian tối đa cho một yêu cầu (vượt quá sẽ trả 503)")
+    args = parser.parse_args(argv)
+
+    service = InvoiceService(args.workers, args.queue_size, args.max_batch, args.batch_wait_ms / 1000)
+    service.start()
+    server = create_server(service, args.host, args.port, args.timeout)
+    logger.info(f"Dịch vụ trích xuất hóa đơn đang chạy tại http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
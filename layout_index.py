@@ -0,0 +1,145 @@
+import bisect
+import re
+import statistics
+from collections import namedtuple
+
+# Một từ trong kết quả OCR:
+# - text: nội dung, start/end: vị trí trong full_text (-1 nếu không xác định được)
+# - x0, y0, x1, y1: khung bao (tọa độ pixel, các trang được xếp chồng theo chiều dọc)
+# - confidence: độ tin cậy của Vision, block/paragraph: chỉ số khối và đoạn chứa từ
+Word = namedtuple('Word', ['text', 'start', 'end', 'x0', 'y0', 'x1', 'y1', 'confidence', 'block', 'paragraph'])
+
+# Từ chỉ gồm chữ số và dấu phân cách (một phần của số tiền)
+_NUMERIC_WORD_RE = re.compile(r'[\d\.,]+')
+
+# Từ chỉ gồm dấu câu đứng giữa nhãn và giá trị, ví dụ "Tổng cộng : 100.000"
+_SEPARATOR_WORD_RE = re.compile(r'[:=#\-]+')
+
+
+class LayoutIndex:
+    """
+    Chỉ mục không gian các từ trong `full_text_annotation` (pages/blocks/paragraphs/words).
+
+    Các từ được chia vào lưới ô vuông (cạnh bằng 2 lần chiều cao từ trung vị), nên truy vấn
+    "giá trị bên phải / bên dưới nhãn" hay "văn bản lân cận" chỉ duyệt vài ô thay vì toàn văn bản.
+    """
+
+    def __init__(self, annotation, full_text=None):
+        text = annotation.text if full_text is None else full_text
+        self.words = []
+
+        cursor = 0
+        page_offset = 0
+        block_index = 0
+        paragraph_index = 0
+        for page in annotation.pages:
+            page_bottom = page_offset
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        word_text = ''.join(symbol.text for symbol in word.symbols)
+                        xs = [vertex.x for vertex in word.bounding_box.vertices] or [0]
+                        ys = [vertex.y + page_offset for vertex in word.bounding_box.vertices] or [page_offset]
+
+                        # Vị trí của từ trong full_text: các từ xuất hiện theo đúng thứ tự của văn bản
+                        start = text.find(word_text, cursor) if word_text else -1
+                        if start == -1:
+                            end = -1
+                        else:
+                            end = cursor = start + len(word_text)
+
+                        self.words.append(Word(word_text, start, end, min(xs), min(ys), max(xs), max(ys),
+                                               word.confidence, block_index, paragraph_index))
+                        page_bottom = max(page_bottom, max(ys))
+                    paragraph_index += 1
+                block_index += 1
+            page_offset = max(page_offset + page.height, page_bottom)
+
+        heights = [word.y1 - word.y0 for word in self.words if word.y1 > word.y0]
+        self.line_height = statistics.median(heights) if heights else 1
+        self.cell_size = max(1, 2 * self.line_height)
+
+        # Lưới không gian: (cột, hàng) -> chỉ số các từ giao với ô
+        self._grid = {}
+        for i, word in enumerate(self.words):
+            for cell in self._cells(word.x0, word.y0, word.x1, word.y1):
+                self._grid.setdefault(cell, []).append(i)
+
+        # Chỉ mục theo vị trí trong văn bản để ánh xạ kết quả regex sang từ
+        self._by_offset = sorted((word.start, i) for i, word in enumerate(self.words) if word.start >= 0)
+        self._offsets = [start for start, _ in self._by_offset]
+
+    def _cells(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for column in range(int(x0 // size), int(x1 // size) + 1):
+            for row in range(int(y0 // size), int(y1 // size) + 1):
+                yield column, row
+
+    def words_in_rect(self, x0, y0, x1, y1):
+        """Các từ giao với hình chữ nhật, sắp theo thứ tự đọc (trên xuống, trái sang)"""
+        found = set()
+        for cell in self._cells(x0, y0, x1, y1):
+            for i in self._grid.get(cell, ()):
+                word = self.words[i]
+                if word.x1 >= x0 and word.x0 <= x1 and word.y1 >= y0 and word.y0 <= y1:
+                    found.add(i)
+        return [self.words[i] for i in sorted(found, key=lambda i: (self.words[i].y0, self.words[i].x0))]
+
+    def word_at(self, offset):
+        """Từ chứa vị trí `offset` trong full_text (None nếu vị trí nằm ngoài mọi từ)"""
+        i = bisect.bisect_right(self._offsets, offset) - 1
+        if i < 0:
+            return None
+        word = self.words[self._by_offset[i][1]]
+        return word if word.start <= offset < word.end else None
+
+    def right_of(self, word, max_distance=None):
+        """Các từ cùng hàng nằm bên phải `word`, sắp theo hoành độ"""
+        height = max(word.y1 - word.y0, 1)
+        x1 = word.x1 + (max_distance if max_distance is not None else 40 * height)
+        center = (word.y0 + word.y1) / 2
+        candidates = self.words_in_rect(word.x1, word.y0, x1, word.y1)
+        return sorted(
+            (other for other in candidates
+             if other is not word and other.x0 >= word.x1 - height / 2 and other.y0 <= center <= other.y1),
+            key=lambda other: other.x0,
+        )
+
+    def below(self, word, lines=1.5):
+        """Các từ ngay bên dưới `word` (trong khoảng `lines` dòng), sắp theo thứ tự đọc"""
+        height = max(word.y1 - word.y0, 1)
+        candidates = self.words_in_rect(word.x0 - height, word.y1, word.x1 + height, word.y1 + lines * height)
+        return [other for other in candidates if other is not word and other.y0 >= word.y1 - height / 2]
+
+    def nearby_text(self, word, dx, dy):
+        """Văn bản các từ trong vùng lân cận `word` (dx, dy tính theo chiều cao dòng)"""
+        height = max(word.y1 - word.y0, 1)
+        words = self.words_in_rect(word.x0 - dx * height, word.y0 - dy * height,
+                                   word.x1 + dx * height, word.y1 + dy * height)
+        return ' '.join(other.text for other in words)
+
+
+def leading_number(words):
+    """
+    Ghép các từ số liền nhau đầu tiên trong danh sách (bỏ qua dấu ":" "=" đứng trước),
+    ví dụ ["-", ":", "1.380", ".000", "đ"] -> "1.380.000". Trả về None nếu không có.
+    """
+    parts = []
+    previous = None
+    for word in words:
+        if _NUMERIC_WORD_RE.fullmatch(word.text):
+            # Hai số cách xa nhau (ví dụ hai cột khác nhau) không phải một số tiền
+            if previous is not None and word.x0 - previous.x1 > max(word.y1 - word.y0, 1):
+                break
+            parts.append(word.text)
+            previous = word
+        elif parts or not _SEPARATOR_WORD_RE.fullmatch(word.text):
+            break
+    return ''.join(parts) or None
+
+
+def build_layout(annotation, full_text=None):
+    """Tạo chỉ mục không gian nếu kết quả OCR có thông tin bố cục, ngược lại trả về None"""
+    if annotation is None or not annotation.pages:
+        return None
+    return LayoutIndex(annotation, full_text)
@@ -0,0 +1,203 @@
+import bisect
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+DEFAULT_PROFILE_SLOW_MS = float(os.environ.get("OCR_PROFILE_SLOW_MS", "0"))
+DEFAULT_PROFILE_SAMPLE_RATE = float(os.environ.get("OCR_PROFILE_SAMPLE_RATE", "0.1"))
+DEFAULT_PROFILE_DIR = os.environ.get("OCR_PROFILE_DIR")
+
+# Ngưỡng (giây) của histogram thời gian, từ 0.5 ms đến 10 giây
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Bộ đếm tăng dần theo nhãn (kiểu Prometheus counter)"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histogram theo nhãn với các ngưỡng cố định (kiểu Prometheus histogram)"""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # {nhãn: [số lần theo từng ngưỡng (không cộng dồn) + ngưỡng +Inf, tổng, số lần]}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *label_values):
+        state = self._values.get(label_values)
+        return state[2] if state else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labels + ("le",), label_values + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "invoice_stage_seconds", "Thời gian từng bước xử lý hóa đơn (giây)", labels=("stage",)
+)
+PATTERN_HITS = Counter(
+    "invoice_pattern_hits_total", "Số lần mỗi mẫu/phương pháp tìm ra giá trị của trường", labels=("field", "pattern")
+)
+FIELD_NOT_FOUND = Counter(
+    "invoice_field_not_found_total", "Số lần không tìm thấy giá trị của trường", labels=("field",)
+)
+FIELD_ATTEMPTS = Counter(
+    "invoice_field_attempts_total", "Số lần trích xuất mỗi trường", labels=("field",)
+)
+REQUEST_ERRORS = Counter(
+    "invoice_request_errors_total", "Số hóa đơn xử lý lỗi", labels=("stage",)
+)
+
+REGISTRY = [STAGE_SECONDS, PATTERN_HITS, FIELD_NOT_FOUND, FIELD_ATTEMPTS, REQUEST_ERRORS]
+
+
+@contextlib.contextmanager
+def span(stage):
+    """Đo thời gian một bước xử lý và ghi vào histogram `invoice_stage_seconds`"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage)
+
+
+def record_match(field, pattern):
+    """Ghi nhận mẫu đã tìm ra giá trị của trường (`pattern` None nghĩa là không tìm thấy)"""
+    FIELD_ATTEMPTS.inc(field)
+    if pattern is None:
+        FIELD_NOT_FOUND.inc(field)
+    else:
+        PATTERN_HITS.inc(field, pattern)
+
+
+def render_metrics():
+    """Toàn bộ số liệu theo định dạng văn bản của Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def profile_if_slow(name, slow_ms=DEFAULT_PROFILE_SLOW_MS, sample_rate=DEFAULT_PROFILE_SAMPLE_RATE,
+                    output_dir=DEFAULT_PROFILE_DIR):
+    """
+    Chạy cProfile cho một phần yêu cầu (theo `sample_rate`) khi bật `OCR_PROFILE_SLOW_MS`;
+    nếu yêu cầu chậm hơn ngưỡng thì ghi các hàm tốn thời gian nhất ra log (và file .prof nếu có `output_dir`).
+    """
+    if not slow_ms or random.random() >= sample_rate:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    start_time = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        if elapsed_ms >= slow_ms:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(20)
+            logger.warning(f"Yêu cầu chậm {name} ({elapsed_ms:.0f} ms):\n{stream.getvalue()}")
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof"))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, host="0.0.0.0"):
+    """Mở endpoint `/metrics` trong thread nền (chỉ một lần mỗi tiến trình, bỏ qua nếu port là 0)"""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"Đã mở endpoint metrics tại http://{host}:{port}/metrics")
+    return _server
@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+# google.cloud.vision (kéo theo grpc và protobuf) chỉ được import khi thực sự gọi OCR,
+# để import module này, khởi động ứng dụng và chạy lại script Streamlit không tốn thời gian nạp thư viện
+
+logger = logging.getLogger(__name__)
+
+# Số ảnh tối đa trong một yêu cầu batch_annotate_images của Vision
+MAX_BATCH_SIZE = 16
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_BACKEND = os.environ.get("OCR_BACKEND", "vision")
+DEFAULT_CHANNEL_COUNT = int(os.environ.get("OCR_CHANNEL_COUNT", "2"))
+DEFAULT_KEEPALIVE_MS = int(os.environ.get("OCR_KEEPALIVE_MS", "30000"))
+
+
+def content_digest(content):
+    """Tính mã băm SHA-256 của nội dung ảnh (dùng làm khóa nhận diện ảnh)"""
+    return hashlib.sha256(content).hexdigest()
+
+
+class OCRError(Exception):
+    """Lỗi khi gọi OCR, kèm mã trạng thái gRPC (tên trong grpc.StatusCode, ví dụ "UNAVAILABLE")"""
+
+    def __init__(self, message, status="UNKNOWN"):
+        super().__init__(message)
+        self.status = status
+
+
+class OCRBackend:
+    """Giao diện chung cho các backend OCR"""
+
+    def document_text_detection(self, content, timeout=None):
+        """
+        Nhận diện văn bản có cấu trúc từ nội dung ảnh.
+
+        Args:
+            content (bytes): Nội dung file ảnh.
+            timeout (float): Thời gian tối đa (giây) cho lời gọi, None nếu không giới hạn.
+        Returns:
+            vision.AnnotateImageResponse: Kết quả OCR.
+        """
+        raise NotImplementedError
+
+    def batch_document_text_detection(self, contents, timeout=None):
+        """
+        Nhận diện văn bản cho nhiều ảnh trong một yêu cầu.
+
+        Mặc định gọi lần lượt từng ảnh; backend có API batch sẽ ghi đè phương thức này.
+        """
+        return [self.document_text_detection(content, timeout) for content in contents]
+
+    async def document_text_detection_async(self, content, timeout=None):
+        """
+        Phiên bản bất đồng bộ của `document_text_detection`.
+
+        Mặc định chạy phiên bản đồng bộ trong thread pool; backend có client async sẽ ghi đè.
+        """
+        return await asyncio.to_thread(self.document_text_detection, content, timeout)
+
+    def close(self):
+        """Giải phóng tài nguyên (kết nối, luồng...) của backend"""
+
+
+class VisionBackend(OCRBackend):
+    """
+    Backend dùng Google Cloud Vision với pool client dùng chung cho cả tiến trình.
+
+    Mỗi client giữ một kênh gRPC riêng; các lời gọi được phân phối vòng tròn
+    giữa các kênh nên không phải bắt tay TLS và nạp credentials cho mỗi hóa đơn.
+    """
+
+    def __init__(self, channel_count=DEFAULT_CHANNEL_COUNT, keepalive_ms=DEFAULT_KEEPALIVE_MS):
+        self.channel_count = max(1, int(channel_count))
+        self.keepalive_ms = int(keepalive_ms)
+        self._clients = []
+        self._lock = threading.Lock()
+        self._next_index = itertools.count()
+        # Client async gắn với event loop đã tạo ra nó: {loop: client}
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _channel_options(self):
+        return [
+            ("grpc.keepalive_time_ms", self.keepalive_ms),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+            ("grpc.max_send_message_length", -1),
+            ("grpc.max_receive_message_length", -1),
+        ]
+
+    def _create_client(self):
+        """Tạo một client Vision với kênh gRPC có keepalive"""
+        from google.cloud import vision
+        from google.cloud.vision_v1.services.image_annotator.transports.grpc import (
+            ImageAnnotatorGrpcTransport,
+        )
+
+        channel = ImageAnnotatorGrpcTransport.create_channel(options=self._channel_options())
+        return vision.ImageAnnotatorClient(transport=ImageAnnotatorGrpcTransport(channel=channel))
+
+    def get_async_client(self):
+        """Lấy client async của event loop hiện tại (mỗi loop dùng một kênh gRPC asyncio)"""
+        from google.cloud import vision
+        from google.cloud.vision_v1.services.image_annotator.transports.grpc_asyncio import (
+            ImageAnnotatorGrpcAsyncIOTransport,
+        )
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            channel = ImageAnnotatorGrpcAsyncIOTransport.create_channel(options=self._channel_options())
+            client = vision.ImageAnnotatorAsyncClient(
+                transport=ImageAnnotatorGrpcAsyncIOTransport(channel=channel)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def get_client(self):
+        """Lấy một client trong pool (khởi tạo lười, an toàn đa luồng)"""
+        if len(self._clients) < self.channel_count:
+            with self._lock:
+                while len(self._clients) < self.channel_count:
+                    self._clients.append(self._create_client())
+                    logger.info(f"Đã tạo kênh gRPC Vision #{len(self._clients)}")
+        return self._clients[next(self._next_index) % self.channel_count]
+
+    def document_text_detection(self, content, timeout=None):
+        from google.cloud import vision
+
+        image = vision.Image(content=content)
+        return self.get_client().document_text_detection(image=image, timeout=timeout)
+
+    async def document_text_detection_async(self, content, timeout=None):
+        from google.cloud import vision
+
+        image = vision.Image(content=content)
+        return await self.get_async_client().document_text_detection(image=image, timeout=timeout)
+
+    def batch_document_text_detection(self, contents, timeout=None):
+        from google.cloud import vision
+
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        responses = []
+        for start in range(0, len(contents), MAX_BATCH_SIZE):
+            requests = [
+                vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+                for content in contents[start:start + MAX_BATCH_SIZE]
+            ]
+            responses.extend(self.get_client().batch_annotate_images(requests=requests, timeout=timeout).responses)
+        return responses
+
+    def close(self):
+        with self._lock:
+            for client in self._clients:
+                client.transport.close()
+            self._clients = []
+
+
+class FakeBackend(OCRBackend):
+    """
+    Backend giả lập chạy cục bộ, không gọi mạng (dùng để chạy offline và load test).
+
+    Nếu có `responses_dir`, kết quả được phát lại từ file `<sha256>.pb` chứa
+    `AnnotateImageResponse` đã serialize; nếu không, trả về `text` mặc định.
+
+    Để kiểm thử bộ điều phối OCR, backend có thể giả lập lỗi và độ trễ: mỗi lời gọi lỗi `OCRError(error_status)`
+    với xác suất `error_rate`, và chậm thêm `tail_latency` giây với xác suất `tail_rate`.
+    Lời gọi chậm hơn `timeout` bị dừng với lỗi DEADLINE_EXCEEDED như kênh gRPC thật.
+    """
+
+    def __init__(self, text="", responses_dir=None, latency=0.0, error_rate=0.0, error_status="UNAVAILABLE",
+                 tail_rate=0.0, tail_latency=0.0, seed=None):
+        self.text = text
+        self.responses_dir = responses_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.call_count = 0
+        self.error_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def load_response(self, digest):
+        """Đọc kết quả đã ghi sẵn theo mã băm ảnh, trả về None nếu không có"""
+        if not self.responses_dir:
+            return None
+        path = os.path.join(self.responses_dir, f"{digest}.pb")
+        if not os.path.exists(path):
+            return None
+        from google.cloud import vision
+
+        with open(path, "rb") as f:
+            return vision.AnnotateImageResponse.deserialize(f.read())
+
+    def _plan(self, timeout):
+        """Độ trễ và lỗi (nếu có) của một lời gọi: (số giây chờ, lỗi hoặc None)"""
+        with self._lock:
+            self.call_count += 1
+            delay = self.latency
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                delay += self.tail_latency
+            error = None
+            if timeout is not None and delay > timeout:
+                delay, error = timeout, OCRError("Quá thời gian chờ OCR (giả lập)", "DEADLINE_EXCEEDED")
+            elif self.error_rate and self._random.random() < self.error_rate:
+                error = OCRError(f"Lỗi OCR giả lập ({self.error_status})", self.error_status)
+            if error is not None:
+                self.error_count += 1
+        return delay, error
+
+    def _respond(self, content):
+        response = self.load_response(content_digest(content))
+        if response is None:
+            from google.cloud import vision
+
+            response = vision.AnnotateImageResponse(
+                full_text_annotation=vision.TextAnnotation(text=self.text)
+            )
+        return response
+
+    def document_text_detection(self, content, timeout=None):
+        delay, error = self._plan(timeout)
+        if delay:
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(content)
+
+    async def document_text_detection_async(self, content, timeout=None):
+        delay, error = self._plan(timeout)
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(content)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=DEFAULT_BACKEND, scheduled=None):
+    """
+    Tạo backend theo tên cấu hình ("vision" hoặc "fake"), đặt sau bộ điều phối `ocr_scheduler.ScheduledBackend`
+    (giới hạn tốc độ, thử lại, thời hạn, ngắt mạch) trừ khi tắt bằng OCR_SCHEDULER=0 hoặc `scheduled=False`.
+    """
+    import ocr_scheduler
+
+    backend = _create_backend(name)
+    if scheduled is None:
+        scheduled = ocr_scheduler.DEFAULT_ENABLED
+    return ocr_scheduler.ScheduledBackend(backend) if scheduled else backend
+
+
+def _create_backend(name):
+    if name == "vision":
+        return VisionBackend()
+    if name == "fake":
+        return FakeBackend(
+            text=os.environ.get("OCR_FAKE_TEXT", ""),
+            responses_dir=os.environ.get("OCR_FAKE_RESPONSES_DIR"),
+            latency=int(os.environ.get("OCR_FAKE_LATENCY_MS", "0")) / 1000,
+            error_rate=float(os.environ.get("OCR_FAKE_ERROR_RATE", "0")),
+            error_status=os.environ.get("OCR_FAKE_ERROR_STATUS", "UNAVAILABLE"),
+            tail_rate=float(os.environ.get("OCR_FAKE_TAIL_RATE", "0")),
+            tail_latency=int(os.environ.get("OCR_FAKE_TAIL_LATENCY_MS", "0")) / 1000,
+        )
+    raise ValueError(f"Backend OCR không được hỗ trợ: {name}")
+
+
+def get_backend():
+    """Lấy backend OCR dùng chung cho toàn tiến trình"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """Thay backend dùng chung (ví dụ dùng FakeBackend khi kiểm thử), trả về backend cũ"""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
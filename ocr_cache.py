@@ -0,0 +1,202 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_MEMORY_SIZE = int(os.environ.get("OCR_CACHE_SIZE", "256"))
+DEFAULT_DB_PATH = os.environ.get("OCR_CACHE_DB")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "100000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+DEFAULT_TTL = float(os.environ.get("OCR_CACHE_TTL", "0")) or None
+
+
+class OCRCache:
+    """
+    Cache kết quả OCR theo mã băm nội dung ảnh, gồm hai tầng:
+    - Tầng bộ nhớ: LRU giới hạn số phần tử.
+    - Tầng đĩa (tùy chọn): SQLite lưu `AnnotateImageResponse` đã serialize,
+      giới hạn theo số phần tử và tổng dung lượng.
+    Cả hai tầng đều hết hạn theo TTL (giây) nếu được cấu hình.
+    Số phần tử và tổng dung lượng tầng đĩa được giữ trong bộ nhớ (đọc một lần khi mở), nên mỗi lần lưu
+    không phải đếm lại cả bảng; bảng chỉ được duyệt khi vượt giới hạn.
+    """
+
+    def __init__(self, memory_size=DEFAULT_MEMORY_SIZE, db_path=DEFAULT_DB_PATH,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = None
+        self._disk_count = 0
+        self._disk_bytes = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                " digest TEXT PRIMARY KEY,"
+                " response BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_accessed ON ocr_cache(accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_created ON ocr_cache(created_at)")
+            self._db.commit()
+            self._count_disk()
+
+    def _count_disk(self):
+        """Đọc lại số phần tử và tổng dung lượng tầng đĩa (duyệt cả bảng)"""
+        self._disk_count, self._disk_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache"
+        ).fetchone()
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, digest):
+        """Lấy kết quả OCR đã lưu theo mã băm, trả về None nếu không có hoặc đã hết hạn"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None:
+                created_at, response = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(digest)
+                    self.stats["memory_hits"] += 1
+                    return response
+                del self._memory[digest]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created_at FROM ocr_cache WHERE digest = ?", (digest,)
+                ).fetchone()
+                if row is not None:
+                    data, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute("UPDATE ocr_cache SET accessed_at = ? WHERE digest = ?", (now, digest))
+                        self._db.commit()
+                        from google.cloud import vision
+
+                        response = vision.AnnotateImageResponse.deserialize(data)
+                        self._remember(digest, response, created_at)
+                        self.stats["disk_hits"] += 1
+                        return response
+                    self._delete_disk(digest)
+                    self._db.commit()
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, digest, response):
+        """Lưu kết quả OCR vào cả hai tầng cache"""
+        now = time.time()
+        with self._lock:
+            self._remember(digest, response, now)
+            if self._db is not None:
+                from google.cloud import vision
+
+                data = vision.AnnotateImageResponse.serialize(response)
+                self._delete_disk(digest)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO ocr_cache (digest, response, size, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (digest, data, len(data), now, now),
+                )
+                self._disk_count += 1
+                self._disk_bytes += len(data)
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, digest, response, created_at):
+        """Thêm vào tầng bộ nhớ và loại bỏ phần tử ít dùng nhất khi vượt giới hạn"""
+        if self.memory_size <= 0:
+            return
+        self._memory[digest] = (created_at, response)
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _delete_disk(self, digest):
+        """Xóa một phần tử khỏi tầng đĩa (nếu có) và cập nhật bộ đếm"""
+        row = self._db.execute("SELECT size FROM ocr_cache WHERE digest = ?", (digest,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM ocr_cache WHERE digest = ?", (digest,))
+            self._disk_count -= 1
+            self._disk_bytes -= row[0]
+
+    def _evict_disk(self, now):
+        """Xóa các phần tử hết hạn và các phần tử ít dùng nhất khi vượt giới hạn tầng đĩa"""
+        if self.ttl is not None:
+            expired, expired_size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache WHERE created_at < ?", (now - self.ttl,)
+            ).fetchone()
+            if expired:
+                self._db.execute("DELETE FROM ocr_cache WHERE created_at < ?", (now - self.ttl,))
+                self._disk_count -= expired
+                self._disk_bytes -= expired_size
+                self.stats["evictions"] += expired
+
+        if self._disk_count <= self.max_entries and self._disk_bytes <= self.max_bytes:
+            return
+
+        # Đếm lại (file cache có thể được tiến trình khác dùng chung) rồi duyệt từ phần tử cũ nhất,
+        # xóa đến khi trở lại trong giới hạn
+        self._count_disk()
+        victims = []
+        for digest, size in self._db.execute("SELECT digest, size FROM ocr_cache ORDER BY accessed_at"):
+            if self._disk_count <= self.max_entries and self._disk_bytes <= self.max_bytes:
+                break
+            victims.append((digest,))
+            self._disk_count -= 1
+            self._disk_bytes -= size
+        self._db.executemany("DELETE FROM ocr_cache WHERE digest = ?", victims)
+        self.stats["evictions"] += len(victims)
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM ocr_cache")
+                self._db.commit()
+                self._disk_count = self._disk_bytes = 0
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Lấy cache OCR dùng chung cho toàn tiến trình"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache()
+    return _cache
+
+
+def set_cache(cache):
+    """Thay cache dùng chung, trả về cache cũ"""
+    global _cache
+    with _cache_lock:
+        previous, _cache = _cache, cache
+    return previous
@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from ocr_backend import OCRBackend, OCRError
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_ENABLED = os.environ.get("OCR_SCHEDULER", "1") == "1"
+DEFAULT_RATE = float(os.environ.get("OCR_RATE_LIMIT", "0"))
+DEFAULT_BURST = int(os.environ.get("OCR_RATE_BURST", "16"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("OCR_MAX_RETRIES", "4"))
+DEFAULT_BACKOFF_BASE = int(os.environ.get("OCR_BACKOFF_BASE_MS", "200")) / 1000
+DEFAULT_BACKOFF_MAX = int(os.environ.get("OCR_BACKOFF_MAX_MS", "10000")) / 1000
+DEFAULT_DEADLINE = float(os.environ.get("OCR_DEADLINE_SECONDS", "60"))
+DEFAULT_HEDGE_AFTER = int(os.environ.get("OCR_HEDGE_AFTER_MS", "0")) / 1000
+DEFAULT_BREAKER_FAILURES = int(os.environ.get("OCR_BREAKER_FAILURES", "5"))
+DEFAULT_BREAKER_RESET = float(os.environ.get("OCR_BREAKER_RESET_SECONDS", "30"))
+DEFAULT_HEDGE_WORKERS = int(os.environ.get("OCR_HEDGE_WORKERS", "32"))
+
+# Mã trạng thái gRPC nên thử lại: hết hạn mức, dịch vụ tạm thời không sẵn sàng, quá thời gian, xung đột
+RETRYABLE_STATUSES = frozenset({"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "ABORTED"})
+
+# Mã số của các trạng thái trên trong `response.error.code` (google.rpc.Status)
+_STATUS_NAMES = {4: "DEADLINE_EXCEEDED", 8: "RESOURCE_EXHAUSTED", 10: "ABORTED", 14: "UNAVAILABLE"}
+
+OCR_ATTEMPTS = metrics.Counter(
+    "invoice_ocr_attempts_total", "Số lần gọi OCR qua bộ điều phối, theo kết quả", labels=("outcome",)
+)
+RATE_LIMIT_WAIT = metrics.Histogram(
+    "invoice_ocr_rate_limit_wait_seconds", "Thời gian chờ lượt gọi OCR theo giới hạn tốc độ (giây)"
+)
+BREAKER_TRANSITIONS = metrics.Counter(
+    "invoice_ocr_breaker_transitions_total", "Số lần bộ ngắt mạch OCR chuyển trạng thái", labels=("state",)
+)
+metrics.REGISTRY.extend([OCR_ATTEMPTS, RATE_LIMIT_WAIT, BREAKER_TRANSITIONS])
+
+
+class CircuitOpenError(OCRError):
+    """Bộ ngắt mạch đang mở: OCR lỗi liên tiếp nên tạm ngừng gọi, báo lỗi ngay"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Dịch vụ OCR tạm ngừng do lỗi liên tiếp, thử lại sau {retry_after:.0f} giây", "UNAVAILABLE")
+        self.retry_after = retry_after
+
+
+def error_status(error):
+    """Tên mã trạng thái gRPC của lỗi (ví dụ "UNAVAILABLE"), None nếu không xác định được"""
+    if isinstance(error, OCRError):
+        return error.status
+    if isinstance(error, TimeoutError):
+        return "DEADLINE_EXCEEDED"
+    # google.api_core.exceptions.GoogleAPICallError
+    status = getattr(error, "grpc_status_code", None)
+    # grpc.RpcError
+    if status is None and callable(getattr(error, "code", None)):
+        try:
+            status = error.code()
+        except Exception:
+            status = None
+    return getattr(status, "name", None)
+
+
+def _check_response(response):
+    """Lỗi tạm thời Vision trả về trong `response.error` (thay vì ngoại lệ) cũng được thử lại"""
+    error = getattr(response, "error", None)
+    status = _STATUS_NAMES.get(getattr(error, "code", 0))
+    if status is not None:
+        raise OCRError(f"Lỗi từ Google Cloud Vision: {error.message}", status)
+    return response
+
+
+def _deadline_error():
+    return OCRError("Quá thời hạn xử lý yêu cầu OCR", "DEADLINE_EXCEEDED")
+
+
+class TokenBucket:
+    """
+    Giới hạn tốc độ kiểu token bucket: `rate` lượt mỗi giây, cho phép dồn tối đa `burst` lượt.
+    Lượt được giữ chỗ theo thứ tự yêu cầu (số token có thể âm), người đến sau chờ lâu hơn. Một batch lớn hơn
+    `burst` vẫn trả đủ số lượt (chờ phần thiếu), nên tốc độ trung bình không vượt `rate` ảnh mỗi giây.
+    """
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1, max_wait=None):
+        """
+        Giữ chỗ `tokens` lượt.
+
+        Returns:
+            float: Số giây cần chờ trước khi gọi, None nếu phải chờ quá `max_wait` (khi đó không giữ chỗ).
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            delay = max(0.0, (tokens - self._tokens) / self.rate)
+            if max_wait is not None and delay > max_wait:
+                return None
+            self._tokens -= tokens
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Bộ ngắt mạch: sau `failure_threshold` lỗi tạm thời liên tiếp thì mở (báo lỗi ngay mọi yêu cầu)
+    trong `reset_timeout` giây, sau đó cho một yêu cầu thử; thành công thì đóng lại, lỗi thì mở tiếp.
+    Yêu cầu thử kết thúc mà không có kết quả (hết thời hạn, bị hủy) được tính là lỗi; nếu sau `reset_timeout`
+    giây vẫn chưa có kết quả thì một yêu cầu khác được thử, nên mạch không thể kẹt ở trạng thái nửa mở.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=DEFAULT_BREAKER_FAILURES, reset_timeout=DEFAULT_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            self.state = state
+            BREAKER_TRANSITIONS.inc(state)
+            logger.warning(f"Bộ ngắt mạch OCR chuyển sang trạng thái {state}")
+
+    def allow(self):
+        """Kiểm tra trước mỗi lượt gọi; báo `CircuitOpenError` nếu mạch đang mở"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            since = self._opened_at if self.state == self.OPEN else self._probe_at
+            retry_after = since + self.reset_timeout - now
+            if retry_after <= 0:
+                # Cho đúng một yêu cầu thử, các yêu cầu khác vẫn bị từ chối đến khi có kết quả
+                # (hoặc đến khi yêu cầu thử quá `reset_timeout` giây mà chưa có kết quả)
+                self._probe_at = now
+                self._transition(self.HALF_OPEN)
+                return
+        OCR_ATTEMPTS.inc("circuit_open")
+        raise CircuitOpenError(max(retry_after, 0.0))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._transition(self.CLOSED)
+
+    def record_abandoned(self):
+        """Lượt gọi kết thúc mà không có kết quả (hết thời hạn trước khi gọi, bị hủy): là lỗi nếu đó là yêu cầu thử"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (self.failure_threshold and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+
+class ScheduledBackend(OCRBackend):
+    """
+    Bộ điều phối đặt trước một backend OCR:
+    - giới hạn tốc độ bằng token bucket để không vượt hạn mức của Vision khi tải dồn dập;
+    - thử lại các lỗi tạm thời (`RETRYABLE_STATUSES`) với thời gian chờ tăng theo cấp số nhân, có jitter;
+    - thời hạn cho cả yêu cầu (gồm chờ lượt, thử lại), phần còn lại được truyền xuống lời gọi gRPC;
+    - gửi thêm một yêu cầu dự phòng nếu yêu cầu đầu chưa xong sau `hedge_after` giây (giảm độ trễ p99);
+    - bộ ngắt mạch báo lỗi ngay khi OCR lỗi liên tiếp, thay vì để mọi yêu cầu chờ hết thời hạn.
+    """
+
+    def __init__(self, backend, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, deadline=DEFAULT_DEADLINE,
+                 hedge_after=DEFAULT_HEDGE_AFTER, breaker_failures=DEFAULT_BREAKER_FAILURES,
+                 breaker_reset=DEFAULT_BREAKER_RESET):
+        self.backend = backend
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Các thuộc tính riêng của backend bên trong (ví dụ call_count của FakeBackend)
+        if "backend" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["backend"], name)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=DEFAULT_HEDGE_WORKERS, thread_name_prefix="ocr-hedge")
+        return self._executor
+
+    @staticmethod
+    def _remaining(deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            OCR_ATTEMPTS.inc("deadline")
+            raise _deadline_error()
+        return remaining
+
+    def _admit(self, tokens, deadline):
+        """Kiểm tra bộ ngắt mạch và giữ lượt gọi; trả về số giây cần chờ"""
+        self.breaker.allow()
+        try:
+            delay = self.bucket.reserve(tokens, max_wait=self._remaining(deadline))
+            if delay is None:
+                OCR_ATTEMPTS.inc("deadline")
+                raise _deadline_error()
+        except OCRError:
+            self.breaker.record_abandoned()
+            raise
+        if self.bucket.rate:
+            RATE_LIMIT_WAIT.observe(delay)
+        return delay
+
+    def _retry_delay(self, error, retry, deadline):
+        """Số giây chờ trước lần thử lại, hoặc báo lại lỗi nếu không được thử lại"""
+        status = error_status(error)
+        if isinstance(error, CircuitOpenError) or status not in RETRYABLE_STATUSES:
+            # Lỗi không tạm thời (ví dụ ảnh không hợp lệ) nghĩa là dịch vụ vẫn trả lời bình thường
+            if not isinstance(error, CircuitOpenError):
+                self.breaker.record_success()
+            OCR_ATTEMPTS.inc("error")
+            raise error
+        self.breaker.record_failure()
+        # Full jitter: chờ ngẫu nhiên trong [0, base * 2^retry] để các client không thử lại cùng lúc
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+        if retry >= self.max_retries or time.monotonic() + delay >= deadline:
+            OCR_ATTEMPTS.inc("error")
+            raise error
+        OCR_ATTEMPTS.inc("retry")
+        logger.warning(f"Lỗi OCR tạm thời ({status}), thử lại sau {delay:.2f} giây: {error}")
+        return delay
+
+    def _succeeded(self, response):
+        self.breaker.record_success()
+        OCR_ATTEMPTS.inc("ok")
+        return response
+
+    def _call(self, attempt, timeout, tokens=1, hedge=True):
+        deadline = time.monotonic() + (timeout if timeout is not None else self.deadline)
+        retry = 0
+        while True:
+            delay = self._admit(tokens, deadline)
+            if delay:
+                time.sleep(delay)
+            try:
+                if hedge and self.hedge_after:
+                    response = self._hedged(attempt, deadline)
+                else:
+                    response = attempt(self._remaining(deadline))
+            except Exception as e:
+                time.sleep(self._retry_delay(e, retry, deadline))
+                retry += 1
+                continue
+            return self._succeeded(response)
+
+    def _hedged(self, attempt, deadline):
+        """Gửi yêu cầu; nếu chưa xong sau `hedge_after` giây thì gửi thêm một bản, lấy kết quả thành công đầu tiên"""
+        executor = self._get_executor()
+        pending = {executor.submit(attempt, self._remaining(deadline))}
+        done, pending = wait(pending, timeout=min(self.hedge_after, self._remaining(deadline)))
+        # Yêu cầu dự phòng chỉ dùng lượt sẵn có, không chờ, để không vượt hạn mức
+        if not done and self.bucket.reserve(1, max_wait=0) is not None:
+            OCR_ATTEMPTS.inc("hedge")
+            pending.add(executor.submit(attempt, self._remaining(deadline)))
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                OCR_ATTEMPTS.inc("deadline")
+                raise _deadline_error()
+
+    async def _call_async(self, attempt, timeout, tokens=1):
+        deadline = time.monotonic() + (timeout if timeout is not None else self.deadline)
+        retry = 0
+        while True:
+            delay = self._admit(tokens, deadline)
+            try:
+                if delay:
+                    await asyncio.sleep(delay)
+                if self.hedge_after:
+                    response = await self._hedged_async(attempt, deadline)
+                else:
+                    remaining = self._remaining(deadline)
+                    response = await asyncio.wait_for(attempt(remaining), remaining)
+            except asyncio.CancelledError:
+                self.breaker.record_abandoned()
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, retry, deadline))
+                retry += 1
+                continue
+            return self._succeeded(response)
+
+    async def _hedged_async(self, attempt, deadline):
+        """Phiên bản bất đồng bộ của `_hedged`; yêu cầu chậm hơn bị hủy khi đã có kết quả"""
+        pending = {asyncio.ensure_future(attempt(self._remaining(deadline)))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=min(self.hedge_after, self._remaining(deadline)))
+            if not done and self.bucket.reserve(1, max_wait=0) is not None:
+                OCR_ATTEMPTS.inc("hedge")
+                pending.add(asyncio.ensure_future(attempt(self._remaining(deadline))))
+
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, timeout=self._remaining(deadline),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    OCR_ATTEMPTS.inc("deadline")
+                    raise _deadline_error()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def document_text_detection(self, content, timeout=None):
+        return self._call(
+            lambda remaining: _check_response(self.backend.document_text_detection(content, remaining)), timeout
+        )
+
+    def batch_document_text_detection(self, contents, timeout=None):
+        # Hạn mức của Vision tính theo số ảnh; không gửi dự phòng cho cả nhóm ảnh
+        return self._call(
+            lambda remaining: self.backend.batch_document_text_detection(contents, remaining), timeout,
+            tokens=len(contents), hedge=False,
+        )
+
+    async def document_text_detection_async(self, content, timeout=None):
+        async def attempt(remaining):
+            return _check_response(await self.backend.document_text_detection_async(content, remaining))
+
+        return await self._call_async(attempt, timeout)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.backend.close()
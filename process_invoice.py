@@ -1,309 +1,684 @@
 import re
-from google.cloud import vision
 import io
 import os
+import mmap
+import asyncio
 import logging
+import weakref
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from ocr_backend import content_digest, get_backend
+from ocr_cache import get_cache
+from image_preprocess import DEFAULT_ENABLED as PREPROCESS_ENABLED, prepare_content
+from dedup import DEFAULT_ENABLED as DEDUP_ENABLED, get_duplicate_index, image_hash
+from amount_index import AmountIndex, clean_amount, is_valid_amount
+from field_scanner import (
+    DATE_KEYWORD_PATTERNS,
+    INVOICE_LINE_PATTERN,
+    INVOICE_NUMBER_PATTERNS,
+    TOTAL_AMOUNT_PATTERNS,
+    TOTAL_FALLBACK_PATTERN,
+    TOTAL_KEYWORD_PATTERN,
+    TOTAL_LABEL_PATTERNS,
+    is_currency_unit,
+    scan_fields,
+)
+from layout_index import build_layout, leading_number
+from document_pages import DEFAULT_PAGE_WORKERS, document_type, iter_pages
+from vendor_templates import get_template_registry
+from tiered_ocr import DEFAULT_ENABLED as TIERED_ENABLED, build_roi, is_confident, record_outcome
 
 # Thiết lập logging cơ bản
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_invoice_data(image_path):
+# Số lời gọi OCR bất đồng bộ tối đa đang chạy cùng lúc (mỗi event loop)
+MAX_IN_FLIGHT = int(os.environ.get("OCR_MAX_IN_FLIGHT", "64"))
+
+# Ghi toàn bộ văn bản OCR ra log (chỉ bật khi gỡ lỗi: chậm và làm log rất dài)
+LOG_FULL_TEXT = os.environ.get("OCR_LOG_FULL_TEXT", "0") == "1"
+
+# Các regex phụ dùng nhiều lần, biên dịch sẵn khi import
+_LONG_NUMBER_RE = re.compile(r'(\d{6,})')
+_SHORT_TOKEN_RE = re.compile(r'\b[A-Za-z0-9-\/]{3,10}\b')
+# Phần đầu không dấu của số hóa đơn: mẫu so trên văn bản đã bỏ dấu nên có thể bắt cả chữ có dấu ("AB12Đ")
+_INVOICE_CODE_RE = re.compile(r'[A-Za-z0-9-\/]+')
+_DIGIT_RE = re.compile(r'\d')
+# Từ khóa gần số hóa đơn tìm bằng phương pháp nâng cao (so trên văn bản đã bỏ dấu, chữ thường)
+_INVOICE_CONTEXT_RE = re.compile(r'hd|\bso\b|hoa don|thanh toan|bill')
+# Các từ sau được so trên văn bản gốc: khi bỏ dấu chúng trùng với những từ thường gặp trên hóa đơn
+# (quận/quán, phố/phở, đường/dương, đồng/đông/dòng)
+_ADDRESS_RE = re.compile(r'đường|phố|quận|huyện', re.IGNORECASE)
+_DONG_RE = re.compile(r'đồng', re.IGNORECASE)
+
+# Semaphore giới hạn số lời gọi OCR theo từng event loop: {loop: asyncio.Semaphore}
+_ocr_semaphores = weakref.WeakKeyDictionary()
+
+def extract_invoice_data(image):
     """
     Trích xuất số hóa đơn và tổng tiền từ ảnh hóa đơn sử dụng Google Cloud Vision API.
     Hỗ trợ nhiều định dạng và bố cục hóa đơn tiếng Việt.
     
     Args:
-        image_path (str): Đường dẫn đến file ảnh hóa đơn.
+        image: Đường dẫn file ảnh, nội dung ảnh (bytes, bytearray, memoryview)
+            hoặc đối tượng file (ví dụ file tải lên từ Streamlit).
     Returns:
         dict: Chứa số hóa đơn và tổng tiền.
     """
+    stage = "read"
     try:
-        # Khởi tạo client của Google Cloud Vision
-        client = vision.ImageAnnotatorClient()
-
-        # Đọc file ảnh
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
-
-        image = vision.Image(content=content)
-
-        # Thực hiện OCR với DOCUMENT_TEXT_DETECTION để nhận diện văn bản có cấu trúc
-        response = client.document_text_detection(image=image)
-        
-        if response.error.message:
-            raise Exception(f'Lỗi từ Google Cloud Vision: {response.error.message}')
-
-        # Lấy toàn bộ văn bản từ kết quả OCR
-        full_text = response.full_text_annotation.text
-
-        # Log kết quả OCR đầy đủ để phân tích
-        logger.info(f"Văn bản OCR đầy đủ:\n{full_text}")
-
-        # Tách văn bản thành dòng để xử lý theo dòng
-        lines = full_text.split('\n')
-        
-        # PHẦN 1: TRÍCH XUẤT SỐ HÓA ĐƠN ==================================================
-        invoice_number = extract_invoice_number(full_text, lines)
-        
-        # PHẦN 2: TRÍCH XUẤT TỔNG TIỀN ===================================================
-        total_amount = extract_total_amount(full_text, lines)
-
-        # PHẦN 3: TRÍCH XUẤT THÔNG TIN THỜI GIAN =========================================
-        date_info = extract_date_info(full_text, lines)
-
-        return {
-            'invoice_number': invoice_number,
-            'total_amount': total_amount,
-            'date_info': date_info,
-            'full_text': full_text
-        }
+        with metrics.profile_if_slow("extract_invoice_data"), metrics.span("total"):
+            with contextlib.ExitStack() as stack:
+                # Đọc ảnh không sao chép: file được ánh xạ bộ nhớ (mmap), buffer được dùng trực tiếp
+                with metrics.span("read"):
+                    content = stack.enter_context(open_content(image))
+
+                # Tài liệu nhiều trang (TIFF, PDF): OCR song song từng trang rồi trích xuất một lần
+                if document_type(content) is not None:
+                    stage = "ocr"
+                    return extract_document_data(content)
+
+                # Ảnh chụp lại hóa đơn đã xử lý: trả lời bằng kết quả đã lưu, không gọi OCR
+                stage = "dedup"
+                phash = None
+                if DEDUP_ENABLED:
+                    with metrics.span("dedup"):
+                        phash = image_hash(content)
+                        duplicate = get_duplicate_index().find(phash)
+                    if duplicate is not None:
+                        return duplicate
+                    key = content_digest(content)
+
+                # Chế độ theo vùng: OCR phần đầu và cuối hóa đơn ở độ phân giải thấp trước,
+                # chỉ OCR toàn trang khi kết quả thiếu hoặc độ tin cậy thấp
+                stage = "ocr"
+                if TIERED_ENABLED:
+                    with metrics.span("ocr_roi"):
+                        result = extract_roi_fields(content)
+                    if result is not None:
+                        if DEDUP_ENABLED:
+                            result = get_duplicate_index().add(phash, key, result)
+                        return result
+
+                # Thực hiện OCR với DOCUMENT_TEXT_DETECTION để nhận diện văn bản có cấu trúc
+                with metrics.span("ocr"):
+                    response = annotate_image(content)
+
+            # Lấy toàn bộ văn bản từ kết quả OCR
+            full_text = response.full_text_annotation.text
+
+            # Log kết quả OCR đầy đủ để phân tích (chỉ khi bật OCR_LOG_FULL_TEXT)
+            if LOG_FULL_TEXT:
+                logger.info(f"Văn bản OCR đầy đủ:\n{full_text}")
+
+            stage = "extract"
+            result = extract_fields(full_text, response.full_text_annotation)
+            if DEDUP_ENABLED:
+                result = get_duplicate_index().add(phash, key, result)
+            return result
     
     except Exception as e:
         logger.error(f"Lỗi khi xử lý ảnh: {str(e)}")
-        return {
-            'invoice_number': "Không thể trích xuất số hóa đơn",
-            'total_amount': "Không thể trích xuất tổng tiền",
-            'date_info': "Không thể trích xuất thông tin thời gian",
-            'full_text': f"Lỗi: {str(e)}"
-        }
-
-def extract_invoice_number(full_text, lines):
+        metrics.REQUEST_ERRORS.inc(stage)
+        return error_result(e)
+
+async def extract_invoice_data_async(image, timeout=None):
+    """
+    Phiên bản bất đồng bộ của `extract_invoice_data`, dùng client async của Vision.
+    Số lời gọi OCR đồng thời bị giới hạn bởi `MAX_IN_FLIGHT`; hủy task sẽ hủy luôn lời gọi OCR.
+
+    Args:
+        image: Đường dẫn file ảnh, nội dung ảnh (bytes, bytearray, memoryview) hoặc đối tượng file.
+        timeout (float): Thời gian tối đa (giây) cho cả yêu cầu, tính từ lúc gọi: các bước OCR (vùng đầu/cuối,
+            toàn trang) dùng chung thời hạn này, tính cả thời gian chờ lượt.
+    Returns:
+        dict: Chứa số hóa đơn và tổng tiền.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    stage = "read"
+    try:
+        with metrics.span("total"):
+            # Đọc file trong thread riêng để không chặn event loop; buffer được dùng trực tiếp
+            with metrics.span("read"):
+                if _is_path(image):
+                    source = contextlib.nullcontext(await asyncio.to_thread(_read_file, image))
+                else:
+                    source = open_content(image)
+
+            with source as content:
+                if document_type(content) is not None:
+                    stage = "ocr"
+                    return await asyncio.wait_for(asyncio.to_thread(extract_document_data, content), remaining())
+
+                stage = "dedup"
+                phash = None
+                if DEDUP_ENABLED:
+                    with metrics.span("dedup"):
+                        phash = await asyncio.to_thread(image_hash, content)
+                        duplicate = get_duplicate_index().find(phash)
+                    if duplicate is not None:
+                        return duplicate
+                    key = content_digest(content)
+
+                stage = "ocr"
+                if TIERED_ENABLED:
+                    with metrics.span("ocr_roi"):
+                        result = await asyncio.wait_for(extract_roi_fields_async(content), remaining())
+                    if result is not None:
+                        if DEDUP_ENABLED:
+                            result = get_duplicate_index().add(phash, key, result)
+                        return result
+
+                with metrics.span("ocr"):
+                    response = await asyncio.wait_for(annotate_image_async(content), remaining())
+            full_text = response.full_text_annotation.text
+
+            if LOG_FULL_TEXT:
+                logger.info(f"Văn bản OCR đầy đủ:\n{full_text}")
+
+            stage = "extract"
+            result = extract_fields(full_text, response.full_text_annotation)
+            if DEDUP_ENABLED:
+                result = get_duplicate_index().add(phash, key, result)
+            return result
+
+    except asyncio.TimeoutError:
+        logger.error(f"Quá thời gian chờ OCR ({timeout} giây): {image if _is_path(image) else 'buffer'}")
+        metrics.REQUEST_ERRORS.inc("timeout")
+        return error_result(f"Quá thời gian chờ OCR ({timeout} giây)")
+
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý ảnh: {str(e)}")
+        metrics.REQUEST_ERRORS.inc(stage)
+        return error_result(e)
+
+def extract_document_data(document, max_workers=DEFAULT_PAGE_WORKERS, header_only=False):
+    """
+    Trích xuất thông tin từ hóa đơn nhiều trang (TIFF nhiều trang, PDF) hoặc ảnh một trang.
+
+    Các trang được giải mã lần lượt và OCR song song (tối đa `max_workers` trang cùng lúc), sau đó văn bản
+    của mọi trang được ghép lại để trích xuất một lần.
+
+    Args:
+        document: Đường dẫn file, nội dung file hoặc đối tượng file.
+        max_workers (int): Số trang OCR đồng thời.
+        header_only (bool): Chỉ cần số hóa đơn và ngày: dừng ở trang đầu tiên (theo thứ tự) có đủ hai trường,
+            các trang sau không được giải mã hay OCR.
+    Returns:
+        dict: Như `extract_fields`, thêm `pages` là số trang đã OCR.
+    Raises:
+        Exception: Lỗi đọc tài liệu hoặc lỗi OCR của một trang.
+    """
+    annotations = []
+    with open_content(document) as content, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = iter_pages(content)
+        pending = deque()
+
+        # Chỉ giải mã trước số trang bằng số worker để giới hạn bộ nhớ
+        def fill():
+            for page in pages:
+                pending.append(executor.submit(annotate_image, page))
+                if len(pending) >= max_workers:
+                    break
+
+        fill()
+        while pending:
+            # Nhận kết quả theo đúng thứ tự trang
+            annotations.append(pending.popleft().result().full_text_annotation)
+            if header_only and _has_header_fields('\n'.join(annotation.text for annotation in annotations)):
+                for future in pending:
+                    future.cancel()
+                break
+            fill()
+        pages.close()
+
+    if len(annotations) == 1:
+        annotation = annotations[0]
+    else:
+        from google.cloud import vision
+
+        annotation = vision.TextAnnotation(
+            text='\n'.join(annotation.text for annotation in annotations),
+            pages=[page for annotation in annotations for page in annotation.pages],
+        )
+
+    result = extract_fields(annotation.text, annotation)
+    result['pages'] = len(annotations)
+    return result
+
+def _has_header_fields(full_text):
+    """Văn bản đã có ứng viên cho cả số hóa đơn và ngày tháng (kiểm tra nhanh, không ghi metrics)"""
+    scan = scan_fields(full_text)
+    if scan.first_date is None and not any(scan.search(pattern, kinds) for pattern, kinds in DATE_KEYWORD_PATTERNS):
+        return False
+    return any(scan.search(pattern, kinds) for pattern, kinds in INVOICE_NUMBER_PATTERNS)
+
+def accept_roi(roi, response):
+    """
+    Trích xuất từ kết quả OCR của vùng đầu/cuối hóa đơn và ghi nhận thống kê.
+
+    Returns:
+        dict: Kết quả nếu đủ số hóa đơn và tổng tiền với độ tin cậy đủ cao, None nếu cần OCR toàn trang.
+    """
+    if response.error.message:
+        record_outcome(roi, escalated=True)
+        return None
+    annotation = response.full_text_annotation
+    result = extract_fields(annotation.text, annotation)
+    if is_confident(annotation, result):
+        record_outcome(roi, escalated=False)
+        # `full_text` chỉ là văn bản của vùng đầu/cuối: lịch sử không lưu văn bản này để trích xuất lại
+        result['ocr_region'] = 'roi'
+        return result
+    record_outcome(roi, escalated=True)
+    return None
+
+def extract_roi_fields(content):
+    """Bước đầu của chế độ theo vùng: None nếu cần OCR toàn trang"""
+    roi = build_roi(content)
+    if roi is None:
+        record_outcome(None, escalated=True)
+        return None
+    return accept_roi(roi, annotate_image(roi.content))
+
+async def extract_roi_fields_async(content):
+    """Phiên bản bất đồng bộ của `extract_roi_fields`"""
+    roi = await asyncio.to_thread(build_roi, content)
+    if roi is None:
+        record_outcome(None, escalated=True)
+        return None
+    return accept_roi(roi, await annotate_image_async(roi.content))
+
+def error_result(error):
+    """Kết quả mặc định khi không thể xử lý ảnh"""
+    return {
+        'invoice_number': "Không thể trích xuất số hóa đơn",
+        'total_amount': "Không thể trích xuất tổng tiền",
+        'date_info': "Không thể trích xuất thông tin thời gian",
+        'full_text': f"Lỗi: {str(error)}"
+    }
+
+def _read_file(image_path):
+    with io.open(image_path, 'rb') as image_file:
+        return image_file.read()
+
+def _is_path(image):
+    return isinstance(image, (str, os.PathLike))
+
+@contextlib.contextmanager
+def open_content(image):
+    """
+    Mở nội dung ảnh dưới dạng buffer chỉ đọc mà không sao chép dữ liệu.
+
+    - bytes, bytearray, memoryview: dùng trực tiếp.
+    - Đối tượng có `getbuffer()` (io.BytesIO, file tải lên từ Streamlit): dùng buffer bên trong.
+    - Đối tượng file khác: đọc toàn bộ.
+    - Đường dẫn: ánh xạ file vào bộ nhớ (mmap), trang dữ liệu chỉ được đọc khi cần.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        yield image
+    elif hasattr(image, 'getbuffer'):
+        buffer = image.getbuffer()
+        try:
+            yield buffer
+        finally:
+            buffer.release()
+    elif hasattr(image, 'read'):
+        yield image.read()
+    else:
+        with io.open(image, 'rb') as image_file:
+            try:
+                mapped = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # File rỗng không ánh xạ được
+                yield b''
+                return
+            with mapped:
+                yield mapped
+
+def _as_bytes(content):
+    """Protobuf của Vision chỉ nhận bytes: chỉ sao chép khi thực sự gửi ảnh đi"""
+    return content if isinstance(content, bytes) else bytes(content)
+
+def extract_fields(full_text, annotation=None):
+    """
+    Trích xuất các trường thông tin từ văn bản OCR (không gọi mạng).
+
+    Args:
+        full_text (str): Toàn bộ văn bản OCR của hóa đơn.
+        annotation (vision.TextAnnotation): Kết quả OCR có bố cục (pages/blocks/words), nếu có
+            thì các trường được tra cứu theo vị trí thay vì theo cửa sổ ký tự.
+    Returns:
+        dict: Chứa số hóa đơn, tổng tiền, thông tin thời gian và văn bản đầy đủ.
+    """
+    # Tách văn bản thành dòng để xử lý theo dòng
+    lines = full_text.split('\n')
+
+    # Quét văn bản một lần, tìm ứng viên cho mọi trường
+    scan = scan_fields(full_text)
+
+    # Chỉ mục không gian các từ (None nếu kết quả OCR không có thông tin bố cục)
+    with metrics.span("layout"):
+        layout = build_layout(annotation, full_text)
+
+    # Nhà cung cấp đã biết (theo tên, mã số thuế ở các dòng đầu): dùng mẫu riêng trước,
+    # trường nào mẫu riêng không tìm được mới dùng luồng chung
+    with metrics.span("classify_vendor"):
+        template = get_template_registry().classify(full_text)
+
+    # PHẦN 1: TRÍCH XUẤT SỐ HÓA ĐƠN ==================================================
+    with metrics.span("extract_invoice_number"):
+        invoice_number = extract_by_template(template, 'invoice_number', full_text)
+        if invoice_number is None:
+            invoice_number = extract_invoice_number(full_text, lines, scan, layout)
+
+    # PHẦN 2: TRÍCH XUẤT TỔNG TIỀN ===================================================
+    with metrics.span("extract_total_amount"):
+        total_amount = extract_by_template(template, 'total_amount', full_text)
+        if total_amount is None:
+            total_amount = extract_total_amount(full_text, lines, scan, layout)
+
+    # PHẦN 3: TRÍCH XUẤT THÔNG TIN THỜI GIAN =========================================
+    with metrics.span("extract_date_info"):
+        date_info = extract_by_template(template, 'date_info', full_text)
+        if date_info is None:
+            date_info = extract_date_info(full_text, lines, scan)
+
+    return {
+        'invoice_number': invoice_number,
+        'total_amount': total_amount,
+        'date_info': date_info,
+        'vendor': template.name if template is not None else None,
+        'full_text': full_text
+    }
+
+def extract_by_template(template, field, full_text):
+    """Giá trị của trường theo mẫu riêng của nhà cung cấp, None nếu không có mẫu hoặc không khớp"""
+    if template is None:
+        return None
+    for pattern in template.patterns[field]:
+        for match in pattern.finditer(full_text):
+            value = match.group(1).strip()
+            if field == 'total_amount':
+                value = clean_amount(value)
+                if not is_valid_amount(value):
+                    continue
+            metrics.record_match(field, 'template')
+            return value
+    return None
+
+def annotate_image(content):
+    """
+    Thực hiện OCR một ảnh, dùng lại kết quả đã lưu nếu ảnh đã được xử lý trước đó.
+
+    Args:
+        content (bytes-like): Nội dung file ảnh (bytes, memoryview hoặc mmap).
+    Returns:
+        vision.AnnotateImageResponse: Kết quả OCR.
+    """
+    cache = get_cache()
+    digest = content_digest(content)
+
+    # Ảnh trùng nội dung: bỏ qua lời gọi mạng, chỉ chạy lại phần trích xuất
+    response = cache.get(digest)
+    if response is not None:
+        return response
+
+    # Dùng backend OCR dùng chung cho toàn tiến trình (không tạo client mới mỗi lần);
+    # cache vẫn dùng mã băm của ảnh gốc nên ảnh trùng không phải tiền xử lý lại
+    response = get_backend().document_text_detection(_as_bytes(prepare_content(content)))
+
+    if response.error.message:
+        raise Exception(f'Lỗi từ Google Cloud Vision: {response.error.message}')
+
+    cache.put(digest, response)
+    return response
+
+async def annotate_image_async(content):
+    """Phiên bản bất đồng bộ của `annotate_image`"""
+    cache = get_cache()
+    digest = content_digest(content)
+
+    response = cache.get(digest)
+    if response is not None:
+        return response
+
+    loop = asyncio.get_running_loop()
+    semaphore = _ocr_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _ocr_semaphores[loop] = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    # Tiền xử lý ảnh tốn CPU nên chạy trong thread riêng để không chặn event loop
+    payload = await asyncio.to_thread(prepare_content, content) if PREPROCESS_ENABLED else content
+    payload = _as_bytes(payload)
+    async with semaphore:
+        response = await get_backend().document_text_detection_async(payload)
+
+    if response.error.message:
+        raise Exception(f'Lỗi từ Google Cloud Vision: {response.error.message}')
+
+    cache.put(digest, response)
+    return response
+
+def annotate_images(contents):
+    """
+    Thực hiện OCR nhiều ảnh trong một yêu cầu batch, chỉ gửi các ảnh chưa có trong cache.
+
+    Args:
+        contents (list[bytes]): Nội dung các file ảnh.
+    Returns:
+        list: Kết quả OCR theo đúng thứ tự đầu vào. Ảnh bị lỗi có `response.error.message`.
+    """
+    cache = get_cache()
+    digests = [content_digest(content) for content in contents]
+    responses = [cache.get(digest) for digest in digests]
+
+    missing = [i for i, response in enumerate(responses) if response is None]
+    if missing:
+        fresh = get_backend().batch_document_text_detection([_as_bytes(prepare_content(contents[i])) for i in missing])
+        for i, response in zip(missing, fresh):
+            responses[i] = response
+            if not response.error.message:
+                cache.put(digests[i], response)
+
+    return responses
+
+def extract_invoice_number(full_text, lines, scan=None, layout=None):
     """Trích xuất số hóa đơn với nhiều mẫu khác nhau"""
-    
-    # Danh sách các mẫu regex để tìm số hóa đơn
-    invoice_number_patterns = [
-        # Mẫu 1: Ưu tiên mã hóa đơn dài (6 chữ số trở lên) sau "Số:", "Số HĐ:", v.v.
-        r'(?:Số|Số\s*HĐ|Số\s*HD|Số\s*hóa\s*đơn|Số\s*hoá\s*đơn|Mã\s*HĐ|Mã\s*HD)\s*[:#=\.]?\s*(\d{6,})',
-        
-        # Mẫu 2: Các kiểu định dạng chuẩn với "Số HĐ", "Số HD", etc.
-        r'(?:Số\s*HĐ|Số\s*HD|Số\s*hóa\s*đơn|Số\s*hoá\s*đơn|Mã\s*HĐ|Mã\s*HD)\s*[:#=\.]?\s*([A-Za-z0-9-\/]+)',
-        
-        # Mẫu 3: "HÓA ĐƠN THANH TOÁN" và sau đó là số
-        r'HÓA\s*ĐƠN\s*THANH\s*TOÁN\s*(?:.*\n){0,2}.*?(?:Số|No|Mã)\s*[:#=\.]?\s*([A-Za-z0-9-\/]+)',
-        
-        # Mẫu 4: "HD" hoặc "HĐ" và sau đó là số
-        r'(?:HD|HĐ|H\.Đ|H\.D)[:#=\.\s]*([A-Za-z0-9-\/]+)',
-        
-        # Mẫu 5: Tiếng Anh - Invoice number
-        r'(?:Invoice\s*(?:Number|No\.?|ID)|Bill\s*No\.?)\s*[:#=]?\s*([A-Za-z0-9-\/]+)',
-    ]
-    
-    # Tìm kiếm qua các mẫu đã định nghĩa
-    for pattern in invoice_number_patterns:
-        match = re.search(pattern, full_text, re.IGNORECASE)
-        if match:
-            candidate = match.group(1).strip()
+    if scan is None:
+        scan = scan_fields(full_text)
+    
+    # Tìm kiếm qua các mẫu đã định nghĩa (theo thứ tự ưu tiên)
+    for pattern_no, (pattern, kinds) in enumerate(INVOICE_NUMBER_PATTERNS, 1):
+        match = scan.search(pattern, kinds)
+        code = _INVOICE_CODE_RE.match(match.group(1)) if match else None
+        if code:
+            candidate = code.group()
             # Kiểm tra để loại bỏ số nhà trong địa chỉ
-            nearby_text = get_text_around(full_text, candidate, 50).lower()
-            if not any(keyword in nearby_text for keyword in ["đường", "phố", "quận", "huyện", "thành phố"]):
+            nearby_text = get_context(full_text, match.start(1), candidate, layout)
+            if not _ADDRESS_RE.search(nearby_text):
+                metrics.record_match('invoice_number', f'pattern_{pattern_no}')
                 return candidate
     
     # Tìm kiếm theo từng dòng với mẫu cụ thể
-    for line in lines:
-        if re.search(r'(Số\s*HĐ|Số\s*HD|Số\s*hoá\s*đơn|Số\s*hóa\s*đơn)', line, re.IGNORECASE):
-            match = re.search(r'(\d{6,})', line)
-            if match:
-                return match.group(1).strip()
+    for line_no in scan.matching_lines(*INVOICE_LINE_PATTERN):
+        match = _LONG_NUMBER_RE.search(lines[line_no])
+        if match:
+            metrics.record_match('invoice_number', 'line')
+            return match.group(1).strip()
     
     # Nếu không tìm thấy theo các mẫu tiêu chuẩn, tìm kiếm nâng cao
-    return find_invoice_number_advanced(full_text, lines)
+    invoice_number = find_invoice_number_advanced(full_text, lines, scan)
+    metrics.record_match('invoice_number', None if invoice_number == "Không tìm thấy số hóa đơn" else 'advanced')
+    return invoice_number
 
-def find_invoice_number_advanced(full_text, lines):
+def find_invoice_number_advanced(full_text, lines, scan=None):
     """Phương pháp tìm số hóa đơn nâng cao"""
+    if scan is None:
+        scan = scan_fields(full_text)
+    normalized = scan.normalized
     
     # Tìm các chuỗi ngắn có dạng số hoặc chữ và số
-    potential_numbers = re.findall(r'\b[A-Za-z0-9-\/]{3,10}\b', full_text)
+    potential_numbers = _SHORT_TOKEN_RE.findall(full_text)
     
     # Kiểm tra các chuỗi tìm được trong 10 dòng đầu tiên (thường số hóa đơn ở phần đầu)
-    top_lines = '\n'.join(lines[:10])
+    top_lines = full_text[:len('\n'.join(lines[:10]))]
+    checked = set()
     for num in potential_numbers:
+        # Mỗi chuỗi chỉ cần kiểm tra một lần
+        if num in checked:
+            continue
+        checked.add(num)
+
         # Nếu số xuất hiện ở 10 dòng đầu và có dạng hợp lệ
-        if num in top_lines and re.match(r'^[A-Za-z0-9-\/]+$', num):
-            nearby_text = get_text_around(top_lines, num, 20)
-            # Nếu gần số này có từ khóa liên quan đến hóa đơn
-            if any(keyword in nearby_text.lower() for keyword in ["hd", "hđ", "số", "Số", "hoá đơn", "hóa đơn", "thanh toán", "bill"]):
+        pos = top_lines.find(num)
+        if pos != -1:
+            # Nếu gần số này có từ khóa liên quan đến hóa đơn (cửa sổ 20 ký tự, lấy từ bản đã chuẩn hóa)
+            start = normalized.folded_pos(max(0, pos - 20))
+            end = normalized.folded_pos(min(len(top_lines), pos + len(num) + 20))
+            if _INVOICE_CONTEXT_RE.search(normalized.folded[start:end]):
                 return num
     
     return "Không tìm thấy số hóa đơn"
 
-def extract_total_amount(full_text, lines):
+def extract_total_amount(full_text, lines, scan=None, layout=None):
     """Trích xuất tổng tiền với nhiều mẫu khác nhau"""
-    
-    # Danh sách các mẫu regex để tìm tổng tiền
-    total_amount_patterns = [
-        # Mẫu 1: Các biến thể của "Tổng cộng", "Tổng tiền", "Thành tiền"
-        r'(?:Tổng\s*(?:cộng|tiền|thanh\s*toán)|T\.\s*(?:CỘNG|Cộng)|Thành\s*tiền)\s*[:=]?\s*([\d\., ]+)',
-        
-        # Mẫu 2: "TIỀN MẶT" hoặc các biến thể
-        r'(?:TIỀN\s*MẶT|TIEN\s*MAT|Tiền\s*mặt)\s*[:=]?\s*([\d\., ]+)',
-        
-        # Mẫu 3: "TỔNG TIỀN" và các biến thể
-        r'(?:TỔNG\s*TIỀN|Tổng\s*tiền|TONG\s*TIEN)\s*[:=]?\s*([\d\., ]+)',
-        
-        # Mẫu 4: Tiếng Anh - Total, Grand Total, Amount
-        r'(?:Total|Grand\s*Total|Amount|Sum|Total\s*Amount)\s*[:=]?\s*(?:VND|VNĐ|₫|đ)?\s*([\d\., ]+)',
-        
-        # Mẫu 5: Số tiền lớn nhất với đơn vị tiền tệ
-        r'([\d\., ]+)(?:\s*(?:VND|VNĐ|₫|đ|đồng))',
-        
-        # Mẫu 6: "SỐ TIỀN" hoặc "THANH TOÁN"
-        r'(?:SỐ\s*TIỀN|THANH\s*TOÁN)\s*[:=]?\s*([\d\., ]+)'
-    ]
-    
-    # Phương pháp 1: Dùng regex để tìm tổng tiền
-    for pattern in total_amount_patterns:
-        matches = re.finditer(pattern, full_text, re.IGNORECASE)
-        for match in matches:
-            amount = match.group(1).strip()
-            # Xử lý định dạng số
-            amount = clean_amount(amount)
-            # Kiểm tra xem kết quả có hợp lệ không
-            if is_valid_amount(amount):
+    if scan is None:
+        scan = scan_fields(full_text)
+    
+    # Chỉ mục chuỗi số dùng chung cho mọi heuristic tìm tổng tiền của văn bản này
+    index = AmountIndex(lines)
+    
+    # Phương pháp 0: Tra cứu theo bố cục - giá trị nằm bên phải hoặc ngay bên dưới nhãn tổng tiền
+    if layout is not None:
+        amount = find_total_by_layout(scan, layout, index)
+        if amount is not None:
+            metrics.record_match('total_amount', 'layout')
+            return amount
+    
+    # Phương pháp 1: Dùng regex để tìm tổng tiền (theo thứ tự ưu tiên)
+    for pattern_no, (pattern, kinds) in enumerate(TOTAL_AMOUNT_PATTERNS, 1):
+        for match in scan.finditer(pattern, kinds):
+            # Mẫu có nhóm đơn vị tiền tệ: kiểm tra lại đơn vị trên văn bản gốc
+            if match.match.lastindex == 2 and not is_currency_unit(match.group(2)):
+                continue
+            # Xử lý định dạng số và kiểm tra xem kết quả có hợp lệ không
+            amount, _, valid = index.parse(match.group(1))
+            if valid:
+                metrics.record_match('total_amount', f'pattern_{pattern_no}')
                 return amount
             
     # Tìm "Tổng:" theo sau là số (có thể có dấu phẩy)
-    total_pattern = r'Tổng:\s*([\d\.,]+)'
-    match = re.search(total_pattern, full_text)
+    match = scan.search(*TOTAL_FALLBACK_PATTERN)
     if match:
+        metrics.record_match('total_amount', 'fallback')
         return clean_amount(match.group(1).strip())
     
     # Phương pháp 2: Tìm kiếm theo dòng với từ khóa cụ thể
-    return find_total_by_keywords(lines)
+    amount = find_total_by_keywords(lines, index, scan)
+    metrics.record_match('total_amount', None if amount == "Không tìm thấy tổng tiền" else 'keywords')
+    return amount
     
 
-def find_total_by_keywords(lines):
+def find_total_by_layout(scan, layout, index):
+    """Tìm tổng tiền là số đứng bên phải hoặc bên dưới nhãn, trả về None nếu không tìm thấy"""
+    for pattern, kinds in TOTAL_LABEL_PATTERNS:
+        for match in scan.finditer(pattern, kinds):
+            label = layout.word_at(match.end() - 1)
+            if label is None:
+                continue
+            for neighbours in (layout.right_of(label), layout.below(label)):
+                raw = leading_number(neighbours)
+                if raw is None:
+                    continue
+                amount, _, valid = index.parse(raw)
+                if valid:
+                    return amount
+    return None
+
+def find_total_by_keywords(lines, index=None, scan=None):
     """Tìm tổng tiền dựa trên từ khóa theo dòng"""
-    
-    # Danh sách các từ khóa liên quan đến tổng tiền
-    amount_keywords = [
-        "tổng cộng", "tổng tiền", "tiền mặt", "thanh toán", "Tổng"
-        "T.CONG","t.cong", "t.tiền", "thành tiền", "tổng", "total", "T.CONG"
-    ]
-    
-    potential_amounts = []
-    
-    # Ưu tiên các dòng có từ khóa về tổng tiền
-    for line in lines:
-        line_lower = line.lower()
-        
-        # Kiểm tra nếu dòng chứa từ khóa
-        if any(keyword in line_lower for keyword in amount_keywords):
-            # Trích xuất tất cả số từ dòng này
-            numbers = re.findall(r'[\d\., ]+', line)
-            if numbers:
-                # Lấy số lớn nhất trên dòng (thường là tổng tiền)
-                largest = max([clean_amount(num) for num in numbers], 
-                             key=lambda x: float(x.replace(".", "").replace(",", "")) if x.replace(".", "").replace(",", "").isdigit() else 0)
-                potential_amounts.append((largest, 10))  # Độ ưu tiên cao
-    
-    # Tìm tất cả các số có dạng tiền tệ trong văn bản
-    for i, line in enumerate(lines):
-        if i < len(lines) - 1:  # Không phải dòng cuối
-            # Tìm các số lớn (có thể là tổng tiền)
-            numbers = re.findall(r'[\d\., ]+', line)
-            for num in numbers:
-                cleaned = clean_amount(num)
-                if is_valid_amount(cleaned) and float(cleaned.replace(".", "").replace(",", "")) > 1000:
-                    # Kiểm tra xem dòng tiếp theo có chứa từ "đồng" hay không
-                    if "đồng" in lines[i+1].lower():
-                        potential_amounts.append((cleaned, 5))  # Độ ưu tiên trung bình
-    
-    # Tìm số lớn nhất có dạng tiền tệ trong các dòng cuối
-    last_lines = lines[-5:] if len(lines) > 5 else lines
-    for line in last_lines:
-        numbers = re.findall(r'[\d\., ]+', line)
-        for num in numbers:
-            cleaned = clean_amount(num)
-            if is_valid_amount(cleaned) and float(cleaned.replace(".", "").replace(",", "")) > 10000:
-                potential_amounts.append((cleaned, 3))  # Độ ưu tiên thấp
-    
-    # Sắp xếp theo độ ưu tiên và lấy số tiền ưu tiên cao nhất
-    if potential_amounts:
-        potential_amounts.sort(key=lambda x: x[1], reverse=True)
-        return potential_amounts[0][0]
+    if index is None:
+        index = AmountIndex(lines)
+    if scan is None:
+        scan = scan_fields('\n'.join(lines))
+    
+    # Các nguồn được xét theo độ ưu tiên giảm dần, trả về ngay ứng viên đầu tiên của nguồn ưu tiên cao nhất
+    
+    # Ưu tiên cao: các dòng có từ khóa về tổng tiền ("tổng cộng", "tiền mặt", "T.CỘNG"...)
+    for i in scan.matching_lines(*TOTAL_KEYWORD_PATTERN):
+        # Lấy số lớn nhất trên dòng (thường là tổng tiền)
+        largest = index.largest_on_line(i)
+        if largest is not None:
+            return largest.cleaned
+    
+    # Ưu tiên trung bình: số lớn (có thể là tổng tiền) mà dòng tiếp theo có chữ "đồng"
+    for i in range(len(lines) - 1):  # Không phải dòng cuối
+        large = [token for token in index.tokens_on_line(i) if token.valid and token.value > 1000]
+        # Kiểm tra xem dòng tiếp theo có chứa từ "đồng" hay không
+        if large and _DONG_RE.search(lines[i + 1]):
+            return large[0].cleaned
+    
+    # Ưu tiên thấp: số tiền lớn trong các dòng cuối
+    first_last_line = len(lines) - 5 if len(lines) > 5 else 0
+    for token in index.tokens_from_line(first_last_line):
+        if token.valid and token.value > 10000:
+            return token.cleaned
     
     return "Không tìm thấy tổng tiền"
 
-def extract_date_info(full_text, lines):
+def extract_date_info(full_text, lines, scan=None):
     """Trích xuất thông tin thời gian từ hóa đơn"""
+    if scan is None:
+        scan = scan_fields(full_text)
     
-    # Các mẫu regex cho ngày tháng
-    date_patterns = [
-        # DD/MM/YYYY hoặc DD-MM-YYYY
-        r'(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})',
-        
-        # Mẫu "Ngày... tháng... năm..." trong tiếng Việt
-        r'Ngày\s*(\d{1,2})\s*tháng\s*(\d{1,2})\s*năm\s*(\d{2,4})',
-        
-        # Mẫu "Ngày" và sau đó là ngày
-        r'Ngày\s*[:]?\s*(\d{1,2}[\/\-\.]\d{1,2}[\/\-\.]\d{2,4})'
-    ]
+    # Tìm theo mẫu DD/MM/YYYY hoặc DD-MM-YYYY (đã được bộ quét tìm sẵn)
+    if scan.first_date is not None:
+        metrics.record_match('date_info', 'date')
+        return scan.first_date
     
-    # Tìm theo mẫu date
-    for pattern in date_patterns:
-        match = re.search(pattern, full_text)
+    # Tìm theo các mẫu có từ khóa "Ngày"
+    for pattern_no, (pattern, kinds) in enumerate(DATE_KEYWORD_PATTERNS, 1):
+        match = scan.search(pattern, kinds)
         if match:
+            metrics.record_match('date_info', f'keyword_{pattern_no}')
             return match.group(0)
     
-    # Tìm theo từng dòng
-    for line in lines:
-        if "ngày" in line.lower() and re.search(r'\d{1,2}', line):
-            return line
+    # Tìm theo từng dòng có chữ "ngày"
+    last_line = -1
+    for pos in scan.positions(('ngay',)):
+        line_no = scan.line_of(pos)
+        if line_no != last_line and _DIGIT_RE.search(lines[line_no]):
+            metrics.record_match('date_info', 'line')
+            return lines[line_no]
+        last_line = line_no
     
+    metrics.record_match('date_info', None)
     return "Không tìm thấy thông tin thời gian"
 
-def clean_amount(amount_str):
-    """Làm sạch và định dạng số tiền"""
-    # Loại bỏ khoảng trắng
-    amount_str = amount_str.strip().replace(" ", "")
-    
-    # Chỉ giữ lại số và dấu phân cách
-    amount_str = ''.join(c for c in amount_str if c.isdigit() or c in '.,')
-    
-    # Đảm bảo định dạng nhất quán
-    # Nếu có dấu '.' và ',' trong chuỗi
-    if '.' in amount_str and ',' in amount_str:
-        # Kiểm tra vị trí của dấu '.' và ','
-        dot_pos = amount_str.rfind('.')
-        comma_pos = amount_str.rfind(',')
-        
-        if dot_pos > comma_pos:
-            # Định dạng 1,234.56 - dấu '.' là phân cách thập phân
-            amount_str = amount_str.replace(',', '')
-        else:
-            # Định dạng 1.234,56 - dấu ',' là phân cách thập phân
-            amount_str = amount_str.replace('.', '').replace(',', '.')
-    
-    # Nếu chỉ có dấu ','
-    elif ',' in amount_str:
-        if amount_str.count(',') == 1 and len(amount_str.split(',')[1]) <= 2:
-            # Có thể là dấu thập phân, ví dụ: 123,45
-            amount_str = amount_str.replace(',', '.')
-        else:
-            # Dấu phân cách hàng nghìn, ví dụ: 1,234,567
-            amount_str = amount_str.replace(',', '')
-    
-    return amount_str
-
-def is_valid_amount(amount_str):
-    """Kiểm tra xem chuỗi có phải là số tiền hợp lệ không"""
-    # Loại bỏ dấu '.' và ',' để kiểm tra
-    clean_str = amount_str.replace('.', '').replace(',', '')
-    
-    # Kiểm tra xem có phải là số nguyên không
-    if not clean_str.isdigit():
-        return False
-    
-    # Kiểm tra độ dài - số tiền thường > 2 chữ số và < 10 chữ số
-    if len(clean_str) < 2 or len(clean_str) > 10:
-        return False
-    
-    return True
+def get_context(full_text, pos, target, layout=None):
+    """
+    Văn bản lân cận một giá trị tìm được tại vị trí `pos`: theo bố cục (các từ xung quanh trên ảnh)
+    nếu có, ngược lại là cửa sổ 50 ký tự quanh đúng vị trí đó.
+    """
+    if layout is not None:
+        word = layout.word_at(pos)
+        if word is not None:
+            return layout.nearby_text(word, dx=25, dy=1.5)
+    return get_text_around(full_text, target, 50, pos)
 
-def get_text_around(text, target, window_size=20):
-    """Lấy văn bản xung quanh một chuỗi mục tiêu"""
-    pos = text.find(target)
+def get_text_around(text, target, window_size=20, pos=None):
+    """Lấy văn bản xung quanh một chuỗi mục tiêu (tại vị trí `pos` nếu biết, ngược lại lần xuất hiện đầu tiên)"""
+    if pos is None:
+        pos = text.find(target)
     if pos == -1:
         return ""
     
@@ -0,0 +1,160 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from history_store import DEFAULT_DB_PATH, HistoryStore
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_CHUNK_SIZE = int(os.environ.get("REEXTRACT_CHUNK_SIZE", "1000"))
+
+# Các trường được trích xuất lại và so sánh
+REEXTRACT_FIELDS = ("invoice_number", "total_amount", "date_info")
+
+# Kho lịch sử riêng của mỗi tiến trình con (mở trong `_init_worker`)
+_worker_store = None
+
+
+def _init_worker(db_path):
+    global _worker_store
+    _worker_store = HistoryStore(db_path)
+
+
+def reextract_chunk(start_id, end_id, use_layout=True):
+    """
+    Trích xuất lại các hóa đơn có id trong khoảng [start_id, end_id) từ văn bản OCR đã lưu (chạy trong tiến trình con).
+    Tiến trình con tự đọc dữ liệu từ SQLite nên tiến trình chính chỉ gửi khoảng id, không gửi văn bản.
+
+    Khi dùng bố cục (`use_layout`), hóa đơn không lưu kết quả OCR gốc (lưu từ giao diện Streamlit, tài liệu nhiều
+    trang) bị bỏ qua: chúng đã được trích xuất theo bố cục, trích xuất lại chỉ từ văn bản sẽ cho khác biệt
+    không do thay đổi mẫu regex.
+
+    Returns:
+        tuple: (số hóa đơn đã xử lý, danh sách thay đổi, số hóa đơn bị bỏ qua vì không có bố cục). Mỗi thay đổi
+        là dict gồm `id`, `file` và `changes` ({trường: {"old": giá trị cũ, "new": giá trị mới}}).
+    """
+    from process_invoice import extract_fields
+
+    rows = _worker_store.documents(start_id, end_id)
+    diffs = []
+    skipped = 0
+    for doc_id, file_name, invoice_number, total_amount, date_info, full_text, data in rows:
+        annotation = None
+        if use_layout:
+            if data is None:
+                skipped += 1
+                continue
+            from google.cloud import vision
+
+            annotation = vision.AnnotateImageResponse.deserialize(data).full_text_annotation
+
+        result = extract_fields(full_text, annotation)
+        old = dict(zip(REEXTRACT_FIELDS, (invoice_number, total_amount, date_info)))
+        changes = {
+            field: {"old": old[field], "new": result[field]}
+            for field in REEXTRACT_FIELDS if result[field] != old[field]
+        }
+        if changes:
+            diffs.append({"id": doc_id, "file": file_name, "changes": changes})
+    return len(rows) - skipped, diffs, skipped
+
+
+def run_reextract(db_path, output, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, use_layout=True, apply=False):
+    """
+    Trích xuất lại toàn bộ hóa đơn đã lưu bằng pool tiến trình, mỗi tác vụ là một khoảng `chunk_size` id.
+    Chỉ giữ tối đa 2 * workers tác vụ đang chờ và nhận kết quả theo thứ tự id, nên bộ nhớ không phụ thuộc
+    số hóa đơn; các thay đổi được ghi ra JSONL ngay khi từng khoảng hoàn tất.
+
+    Returns:
+        dict: Số hóa đơn đã xử lý, số hóa đơn thay đổi, số thay đổi theo từng trường, số hóa đơn bị bỏ qua
+        vì không có bố cục (xem `reextract_chunk`) và thời gian chạy.
+    """
+    store = HistoryStore(db_path)
+    min_id, max_id = store.id_range()
+    stats = {"documents": 0, "changed": 0, "fields": dict.fromkeys(REEXTRACT_FIELDS, 0), "skipped": 0}
+    start_time = time.perf_counter()
+    if min_id is None:
+        stats["elapsed"] = 0.0
+        return stats
+
+    workers = workers or os.cpu_count() or 1
+    starts = iter(range(min_id, max_id + 1, chunk_size))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as executor:
+        pending = deque()
+
+        def fill():
+            for start in starts:
+                pending.append(executor.submit(reextract_chunk, start, start + chunk_size, use_layout))
+                if len(pending) >= 2 * workers:
+                    break
+
+        fill()
+        while pending:
+            count, diffs, skipped = pending.popleft().result()
+            stats["documents"] += count
+            stats["skipped"] += skipped
+            stats["changed"] += len(diffs)
+            for diff in diffs:
+                for field in diff["changes"]:
+                    stats["fields"][field] += 1
+                output.write(json.dumps(diff, ensure_ascii=False) + "\n")
+            output.flush()
+
+            if apply and diffs:
+                store.update_fields([
+                    tuple(diff["changes"].get(field, {}).get("new") for field in REEXTRACT_FIELDS) + (diff["id"],)
+                    for diff in diffs
+                ])
+            fill()
+
+    store.close()
+    stats["elapsed"] = time.perf_counter() - start_time
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Trích xuất lại các trường từ văn bản OCR đã lưu trong lịch sử (không gọi OCR) và ghi các thay đổi ra JSONL"
+    )
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="File SQLite lịch sử trích xuất")
+    parser.add_argument("-o", "--output", default="-", help="File JSONL các thay đổi (mặc định: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help="Số tiến trình trích xuất")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Số id hóa đơn trong mỗi tác vụ gửi cho tiến trình con")
+    parser.add_argument("--no-layout", action="store_true",
+                        help="Chỉ dùng văn bản, bỏ qua bố cục trong kết quả OCR gốc (xử lý cả hóa đơn không lưu"
+                             " kết quả OCR gốc, vốn bị bỏ qua khi dùng bố cục)")
+    parser.add_argument("--apply", action="store_true", help="Ghi các giá trị mới vào lịch sử")
+    args = parser.parse_args(argv)
+
+    if args.db == ":memory:":
+        logger.error("Cần file SQLite để các tiến trình con cùng đọc")
+        return 1
+
+    kwargs = dict(workers=args.workers, chunk_size=max(1, args.chunk_size), use_layout=not args.no_layout,
+                  apply=args.apply)
+    if args.output == "-":
+        stats = run_reextract(args.db, sys.stdout, **kwargs)
+    else:
+        with open(args.output, "w", encoding="utf-8") as output:
+            stats = run_reextract(args.db, output, **kwargs)
+
+    rate = stats["documents"] / stats["elapsed"] if stats["elapsed"] else 0
+    fields = ", ".join(f"{field}: {count}" for field, count in stats["fields"].items())
+    logger.info(f"Đã trích xuất lại {stats['documents']} hóa đơn trong {stats['elapsed']:.1f} giây"
+                f" ({rate:.0f} hóa đơn/giây), {stats['changed']} hóa đơn thay đổi ({fields})")
+    if stats["skipped"]:
+        logger.warning(f"Bỏ qua {stats['skipped']} hóa đơn không lưu kết quả OCR gốc (không có bố cục để trích xuất"
+                       f" lại giống lần đầu); dùng --no-layout để trích xuất lại chúng chỉ từ văn bản")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Tạo bộ dữ liệu tổng hợp cho benchmark_extraction.py và tests/test_golden.py: mỗi hóa đơn là một ảnh PNG nhỏ
+(chỉ dùng để tính mã băm) và kết quả OCR `<sha256>.pb` để FakeBackend phát lại, có bố cục (khung bao từng từ)
+trừ các hóa đơn `layout: False`. Cần google-cloud-vision và Pillow; chạy lại khi thêm hóa đơn:
+
+    python tests/fixtures/build_fixtures.py
+    python benchmark_extraction.py --update-golden --update-baseline
+"""
+import io
+import os
+import sys
+import unicodedata
+
+from google.cloud import vision
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from ocr_backend import content_digest  # noqa: E402
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(FIXTURES_DIR, "images")
+RESPONSES_DIR = os.path.join(FIXTURES_DIR, "responses")
+
+# Kích thước (pixel) của một ký tự và một dòng trong bố cục tổng hợp
+CHAR_WIDTH, LINE_HEIGHT = 10, 30
+
+INVOICES = {
+    "retail_accented": {
+        "text": "CỬA HÀNG TIỆN LỢI MINH AN\n12 Nguyễn Trãi, Quận 1\nHÓA ĐƠN BÁN HÀNG\nSố HĐ: HD0012345\n"
+                "Ngày 05 tháng 06 năm 2024\nSữa tươi 2 x 25.000 50.000\nBánh mì 1 x 15.000 15.000\n"
+                "Tổng cộng: 65.000 đ\nCảm ơn quý khách",
+    },
+    "vat_invoice": {
+        "text": "CÔNG TY TNHH THƯƠNG MẠI PHÚ HƯNG\nMã số thuế: 0312345678\nHÓA ĐƠN GIÁ TRỊ GIA TĂNG\n"
+                "Ký hiệu: 1C24TPH\nSố: 0000789\nNgày: 20/11/2024\nCộng tiền hàng: 1.200.000\n"
+                "Thuế GTGT 10%: 120.000\nTổng tiền thanh toán: 1.320.000\n",
+    },
+    "unaccented_ocr": {
+        "text": "SIEU THI HOA BINH\nHOA DON THANH TOAN\nSo hoa don: 55021\nNgay: 01-02-2024\n"
+                "Nuoc suoi 3 x 6.000 18.000\nTong cong: 18.000 VND\n",
+    },
+    "comma_thousands": {
+        "text": "NHA HANG BEP VIET\nInvoice No: BV-2024-0042\nDate: 15/03/2024\nPho bo 2 x 65,000 130,000\n"
+                "Tra da 2 x 5,000 10,000\nTOTAL: 140,000\n",
+    },
+    "decomposed_marks": {
+        # Văn bản dạng NFD (dấu kết hợp), kiểm tra ánh xạ vị trí của text_normalize
+        "text": unicodedata.normalize(
+            "NFD", "QUÁN CÀ PHÊ SÁNG\nSố hóa đơn: 000456\nNgày 12 tháng 03 năm 2024\nCà phê sữa 29.000\n"
+                   "Tổng tiền: 29.000 đồng\n"),
+    },
+    "missing_total": {
+        "text": "PHIẾU GIAO HÀNG\nSố HĐ: PG7781\nNgày 02/01/2025\nĐã nhận đủ hàng\n",
+    },
+    "phone_numbers": {
+        "text": "TẠP HÓA BÀ TƯ\nĐT: 0909123456 - 0909654321\nSố HĐ: 3391\nNgày 07/07/2024\n"
+                "Gạo 10kg 180.000\nThanh toán: 180.000\n",
+        "layout": False,
+    },
+    "text_only_vat": {
+        "text": "HÓA ĐƠN GTGT\nSố: 0001234\nNgày 01 tháng 02 năm 2024\nTổng cộng tiền thanh toán: 1.250.000\n",
+        "layout": False,
+    },
+}
+
+
+def build_annotation(text, layout=True):
+    """TextAnnotation tổng hợp: mỗi dòng là một khối, mỗi từ có khung bao theo vị trí ký tự"""
+    if not layout:
+        return vision.TextAnnotation(text=text)
+    blocks = []
+    for row, line in enumerate(text.split("\n")):
+        words = []
+        column = 0
+        for token in line.split(" "):
+            if token:
+                x0, y0 = column * CHAR_WIDTH, row * LINE_HEIGHT
+                box = vision.BoundingPoly(vertices=[
+                    vision.Vertex(x=x0, y=y0), vision.Vertex(x=x0 + len(token) * CHAR_WIDTH, y=y0),
+                    vision.Vertex(x=x0 + len(token) * CHAR_WIDTH, y=y0 + LINE_HEIGHT - 10),
+                    vision.Vertex(x=x0, y=y0 + LINE_HEIGHT - 10),
+                ])
+                words.append(vision.Word(bounding_box=box, confidence=0.98,
+                                         symbols=[vision.Symbol(text=char) for char in token]))
+            column += len(token) + 1
+        if words:
+            blocks.append(vision.Block(paragraphs=[vision.Paragraph(words=words)]))
+    height = (text.count("\n") + 1) * LINE_HEIGHT
+    width = max(len(line) for line in text.split("\n")) * CHAR_WIDTH
+    return vision.TextAnnotation(text=text, pages=[vision.Page(width=width, height=height, blocks=blocks)])
+
+
+def build_image(name):
+    """Ảnh PNG nhỏ, khác nhau theo tên hóa đơn (nội dung ảnh chỉ dùng để tính mã băm)"""
+    image = Image.new("L", (160, 40), color=255)
+    ImageDraw.Draw(image).text((4, 12), name, fill=0)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def main():
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    os.makedirs(RESPONSES_DIR, exist_ok=True)
+    for name, invoice in INVOICES.items():
+        content = build_image(name)
+        with open(os.path.join(IMAGES_DIR, f"{name}.png"), "wb") as f:
+            f.write(content)
+        response = vision.AnnotateImageResponse(
+            full_text_annotation=build_annotation(invoice["text"], invoice.get("layout", True))
+        )
+        with open(os.path.join(RESPONSES_DIR, f"{content_digest(content)}.pb"), "wb") as f:
+            f.write(vision.AnnotateImageResponse.serialize(response))
+    print(f"Đã tạo {len(INVOICES)} hóa đơn tổng hợp trong {FIXTURES_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+bzxTẠP HÓA BÀ TƯ
+ĐT: 0909123456 - 0909654321
+Số HĐ: 3391
+Ngày 07/07/2024
+Gạo 10kg 180.000
+Thanh toán: 180.000
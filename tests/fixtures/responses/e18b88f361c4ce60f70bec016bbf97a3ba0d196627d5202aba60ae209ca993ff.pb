@@ -0,0 +1,4 @@
+bigHÓA ĐƠN GTGT
+Số: 0001234
+Ngày 01 tháng 02 năm 2024
+Tổng cộng tiền thanh toán: 1.250.000
@@ -0,0 +1,43 @@
+import pytest
+
+from amount_index import amount_to_vnd, clean_amount, is_valid_amount
+
+
+@pytest.mark.parametrize("amount, expected", [
+    ("1380000", 1380000),
+    ("50.000", 50000),
+    ("1.380.000", 1380000),
+    ("12,500", 12500),
+    ("1,234,567", 1234567),
+    ("1.234.567,89", 1234568),
+    ("1000000.50", 1000001),
+    (" 150 000 ", 150000),
+])
+def test_amount_to_vnd(amount, expected):
+    assert amount_to_vnd(amount) == expected
+
+
+@pytest.mark.parametrize("amount", [
+    "Không tìm thấy tổng tiền",
+    "Không thể trích xuất tổng tiền",
+    "",
+    "5",
+    # Chuỗi số quá dài (ghép nhiều số điện thoại, số ngoài phạm vi int64)
+    "1234567890123456789012",
+    "090912345609091234560909123456",
+])
+def test_amount_to_vnd_rejects_non_amounts(amount):
+    assert amount_to_vnd(amount) is None
+
+
+def test_clean_amount_separators():
+    assert clean_amount("1,234.56") == "1234.56"
+    assert clean_amount("1.234,56") == "1234.56"
+    assert clean_amount("123,45") == "123.45"
+    assert clean_amount("1.500.000đ") == "1.500.000"
+
+
+def test_is_valid_amount_length():
+    assert is_valid_amount("1.500.000")
+    assert not is_valid_amount("7")
+    assert not is_valid_amount("12345678901")
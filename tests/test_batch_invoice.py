@@ -0,0 +1,43 @@
+import io
+import json
+
+import pytest
+
+import batch_invoice
+
+
+def fake_process_batch(paths, include_text=False, tiered=False, history=False):
+    if any("bad" in path for path in paths):
+        raise RuntimeError("history write failed")
+    return [{"file": path, "invoice_number": "HD001", "total_amount": "150.000"} for path in paths]
+
+
+def test_failing_batch_becomes_error_records(monkeypatch):
+    monkeypatch.setattr(batch_invoice, "process_batch", fake_process_batch)
+    paths = ["a.jpg", "b.jpg", "bad.jpg", "c.jpg"]
+    output = io.StringIO()
+    stats = batch_invoice.run_batch(paths, output, batch_size=2, concurrency=2)
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert sorted(record["file"] for record in records) == sorted(paths)
+    errors = {record["file"]: record["error"] for record in records if "error" in record}
+    assert errors == {"bad.jpg": "history write failed", "c.jpg": "history write failed"}
+    assert (stats["files"], stats["errors"]) == (4, 2)
+
+
+def test_parquet_output_is_closed_when_run_is_interrupted(monkeypatch, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupted(paths, *args):
+        if "c.jpg" in paths:
+            raise Interrupted()
+        return fake_process_batch(paths)
+
+    monkeypatch.setattr(batch_invoice, "process_batch", interrupted)
+    path = str(tmp_path / "results.parquet")
+    with pytest.raises(Interrupted):
+        batch_invoice.run_batch(["a.jpg", "b.jpg", "c.jpg"], path, batch_size=2, concurrency=1, fmt="parquet")
+    # File vẫn có phần kết thúc hợp lệ và chứa các nhóm đã xong
+    assert pq.read_table(path, columns=["file_name"]).column("file_name").to_pylist() == ["a.jpg", "b.jpg"]
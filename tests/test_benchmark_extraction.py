@@ -0,0 +1,47 @@
+import pytest
+
+import benchmark_extraction
+from benchmark_extraction import CALIBRATION_KEY, body_range, check_timings, enlarge_text
+
+TEXT = ("CỬA HÀNG MINH AN\n12 Nguyễn Trãi, Quận 1\nSố HĐ: HD0012345\nNgày 05/06/2024\n"
+        "Sữa tươi 2 x 25.000 50.000\nBánh mì 1 x 15.000 15.000\nTổng cộng: 65.000 đ\nCảm ơn quý khách")
+
+
+def test_body_range_is_item_lines():
+    lines = TEXT.split("\n")
+    start, end = body_range(TEXT)
+    assert lines[start:end] == ["Sữa tươi 2 x 25.000 50.000", "Bánh mì 1 x 15.000 15.000"]
+
+
+def test_enlarge_text_repeats_body_only():
+    enlarged = enlarge_text(TEXT, 3).split("\n")
+    assert enlarged[:4] == TEXT.split("\n")[:4]
+    assert enlarged[-2:] == TEXT.split("\n")[-2:]
+    assert enlarged.count("Sữa tươi 2 x 25.000 50.000") == 3
+
+
+def test_enlarge_text_without_item_lines_repeats_whole_text():
+    text = "HÓA ĐƠN GTGT\nSố: 0001234\nTổng cộng: 1.250.000"
+    assert enlarge_text(text, 4) == "\n".join([text] * 4)
+
+
+def test_enlarged_fixtures_grow_with_factor():
+    pytest.importorskip("google.cloud.vision")
+    from batch_invoice import collect_image_paths
+
+    paths = collect_image_paths(benchmark_extraction.DEFAULT_IMAGES)
+    documents = benchmark_extraction.load_documents(paths, benchmark_extraction.DEFAULT_RESPONSES_DIR)
+    assert documents
+    for name, full_text, _ in documents:
+        sizes = [len(enlarge_text(full_text, factor)) for factor in (1, 10, 50)]
+        assert sizes[0] < sizes[1] < sizes[2], name
+
+
+def test_check_timings_scales_baseline_by_calibration():
+    baseline = {CALIBRATION_KEY: 10.0, "extract_fields@x1": 100.0}
+    # Máy chậm gấp đôi: 190 µs vẫn trong ngưỡng so với mốc quy đổi 200 µs
+    assert check_timings({"extract_fields@x1": 190.0}, baseline, 0.25, calibration=20.0) == []
+    # Cùng tốc độ máy: chậm 90% là hồi quy
+    assert len(check_timings({"extract_fields@x1": 190.0}, baseline, 0.25, calibration=10.0)) == 1
+    # Mốc cũ không có thời gian hiệu chuẩn thì so trực tiếp
+    assert len(check_timings({"extract_fields@x1": 190.0}, {"extract_fields@x1": 100.0}, 0.25, 20.0)) == 1
@@ -0,0 +1,43 @@
+from dedup import BKTree, DuplicateIndex, hamming_distance
+
+
+def test_bktree_search_within_distance():
+    tree = BKTree()
+    keys = [0b0000, 0b0001, 0b0011, 0b0111, 0b1111, 0b1000_0000]
+    for key in keys:
+        tree.add(key, key)
+
+    assert tree.size == len(keys)
+    for max_distance in range(4):
+        found = tree.search(0b0000, max_distance)
+        assert sorted(value for _, value in found) == sorted(
+            key for key in keys if hamming_distance(key, 0b0000) <= max_distance)
+        assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+
+def test_bktree_empty():
+    assert BKTree().search(0, 5) == []
+
+
+def test_duplicate_index_finds_near_image():
+    index = DuplicateIndex(max_distance=2)
+    result = {"invoice_number": "HD001", "total_amount": "50.000", "date_info": "01/01/2024"}
+    assert index.add(0b1010_1010, "a.png", result) == result
+
+    found = index.find(0b1010_1011)
+    assert found["duplicate"] == "image"
+    assert found["duplicate_of"] == "a.png"
+    assert found["duplicate_distance"] == 1
+    assert index.find(0b0101_0101) is None
+    assert index.find(None) is None
+
+
+def test_duplicate_index_marks_same_invoice_fields():
+    index = DuplicateIndex(max_distance=0)
+    result = {"invoice_number": "HD001", "total_amount": "50.000", "date_info": "01/01/2024"}
+    index.add(1, "a.png", result)
+
+    assert index.add(2 ** 40, "b.png", result)["duplicate_of"] == "a.png"
+    missing = dict(result, total_amount="Không tìm thấy tổng tiền")
+    assert "duplicate" not in index.add(3, "c.png", missing)
+    assert "duplicate" not in index.add(4, "d.png", missing)
@@ -0,0 +1,56 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+from export import EXPORT_COLUMNS, export_chunks, export_row, iter_jsonl_chunks
+from history_store import HistoryStore
+
+
+def history_record(**fields):
+    record = {"invoice_number": "HD001", "total_amount": "1.250.000", "date_info": "Ngày 01 tháng 02 năm 2024",
+              "full_text": ""}
+    record.update(fields)
+    return record
+
+
+def test_export_row_typed_columns():
+    row = export_row({"file": "a.jpg", "invoice_number": "HD001", "total_amount": "1.250.000",
+                      "date_info": "20/11/2024"})
+    assert set(row) == set(EXPORT_COLUMNS)
+    assert row["file_name"] == "a.jpg"
+    assert row["amount_vnd"] == 1250000
+    assert row["invoice_date"] == datetime.date(2024, 11, 20)
+    missing = export_row({"total_amount": "Không tìm thấy tổng tiền", "date_info": "Không tìm thấy ngày"})
+    assert missing["amount_vnd"] is None and missing["invoice_date"] is None
+
+
+def test_export_row_oversized_amount_is_null():
+    row = export_row({"total_amount": "090912345609091234560909123456"})
+    assert row["amount_vnd"] is None
+
+
+def test_csv_export_of_history_in_chunks(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add_many([(history_record(invoice_number=f"HD{i}"), f"f{i}.jpg") for i in range(25)])
+    output = io.StringIO()
+    assert export_chunks(store.iter_chunks(10), output, "csv") == 25
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert [row["invoice_number"] for row in rows] == [f"HD{i}" for i in range(25)]
+    assert rows[0]["amount_vnd"] == "1250000" and rows[0]["invoice_date"] == "2024-02-01"
+    store.close()
+
+
+def test_parquet_export_with_oversized_amount(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    records = [{"file": "ok.jpg", "total_amount": "1.250.000"},
+               {"file": "phones.jpg", "total_amount": "1234567890123456789012"}]
+    path = str(tmp_path / "results.parquet")
+    lines = [json.dumps(record) + "\n" for record in records]
+    assert export_chunks(iter_jsonl_chunks(lines, 1), path, "parquet", chunk_size=1) == 2
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 2
+    table = parquet.read(columns=["file_name", "amount_vnd"])
+    assert table.column("amount_vnd").to_pylist() == [1250000, None]
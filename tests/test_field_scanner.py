@@ -0,0 +1,79 @@
+import datetime
+import unicodedata
+
+import pytest
+
+from field_scanner import TOTAL_KEYWORD_PATTERN, is_currency_unit, parse_date, scan_fields
+from process_invoice import extract_fields
+
+
+@pytest.mark.parametrize("date_info, expected", [
+    ("20/11/2024", datetime.date(2024, 11, 20)),
+    ("01-02-2024", datetime.date(2024, 2, 1)),
+    ("Ngày 12 tháng 03 năm 2024", datetime.date(2024, 3, 12)),
+    ("Ngay 5 thang 6 nam 2024", datetime.date(2024, 6, 5)),
+    ("Ngày bán: 07/07/24 - Quầy 2", datetime.date(2024, 7, 7)),
+])
+def test_parse_date(date_info, expected):
+    assert parse_date(date_info) == expected
+
+
+@pytest.mark.parametrize("date_info", [
+    "Không tìm thấy ngày tháng",
+    "31/02/2024",
+    "01/01/1850",
+    "",
+])
+def test_parse_date_rejects_invalid(date_info):
+    assert parse_date(date_info) is None
+
+
+@pytest.mark.parametrize("unit, expected", [
+    ("đ", True),
+    ("Đ", True),
+    ("đồng", True),
+    (unicodedata.normalize("NFD", "đồng"), True),
+    ("VNĐ", True),
+    ("vnd", True),
+    ("₫", True),
+    ("dòng", False),
+    ("đông", False),
+    ("d", False),
+])
+def test_is_currency_unit(unit, expected):
+    assert is_currency_unit(unit) is expected
+
+
+def test_line_count_is_not_taken_for_total():
+    # "dòng" bỏ dấu thành "dong" nhưng không phải đơn vị tiền tệ
+    result = extract_fields("HÓA ĐƠN BÁN LẺ\n12 dòng sản phẩm\nMùa đông 2024\nTổng: 45.000\n")
+    assert result["total_amount"] == "45.000"
+
+
+def test_amount_with_currency_unit():
+    assert extract_fields("Cà phê sữa\n29.000 đồng\n")["total_amount"] == "29.000"
+
+
+@pytest.mark.parametrize("text", [
+    "HÓA ĐƠN THANH TOÁN\nCửa hàng ABC - Hà Nội",
+    "HÓA ĐƠN THANH TOÁN\nThanh toán tiền mặt\nCảm ơn quý khách",
+])
+def test_invoice_label_inside_word_is_ignored(text):
+    # "no" trong "Nội" và "ma" trong "mặt" không phải nhãn số hóa đơn
+    assert extract_fields(text)["invoice_number"] not in ("i", "t")
+
+
+def test_invoice_number_stops_at_accented_letter():
+    assert extract_fields("Số HĐ: AB12Đ\n")["invoice_number"] == "AB12"
+
+
+def test_line_of_matches_newline_count():
+    text = "HÓA ĐƠN\n\nSố: 0001234\nTổng cộng: 65.000\n"
+    scan = scan_fields(text)
+    assert [scan.line_of(pos) for pos in range(len(text) + 1)] == [
+        text.count("\n", 0, pos) for pos in range(len(text) + 1)]
+
+
+def test_matching_lines_on_long_document():
+    text = "Sữa tươi 25.000\n" * 5000 + "Tổng cộng: 125.000.000\nTiền mặt: 130.000.000\n"
+    assert list(scan_fields(text).matching_lines(*TOTAL_KEYWORD_PATTERN)) == [5000, 5001]
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+pytest.importorskip("google.cloud.vision")
+
+import benchmark_extraction
+from batch_invoice import collect_image_paths
+
+
+@pytest.fixture(scope="module")
+def documents():
+    paths = collect_image_paths(benchmark_extraction.DEFAULT_IMAGES)
+    return benchmark_extraction.load_documents(paths, benchmark_extraction.DEFAULT_RESPONSES_DIR)
+
+
+def test_every_fixture_has_recorded_response(documents):
+    images = os.listdir(benchmark_extraction.DEFAULT_IMAGES[0])
+    assert len(documents) == len(images) > 0
+
+
+def test_extraction_matches_golden(documents):
+    golden = benchmark_extraction._load_json(benchmark_extraction.DEFAULT_GOLDEN_PATH)
+    assert set(golden) == {name for name, _, _ in documents}
+    assert benchmark_extraction.check_golden(documents, golden) == []
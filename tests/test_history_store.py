@@ -0,0 +1,54 @@
+import io
+
+from history_store import HistoryStore
+from process_invoice import extract_fields
+from reextract import run_reextract
+
+
+def result(**fields):
+    record = {"invoice_number": "HD001", "total_amount": "150.000", "date_info": "01/02/2024",
+              "full_text": "HÓA ĐƠN\nSố: HD001\nNgày 01/02/2024\nTổng cộng: 150.000"}
+    record.update(fields)
+    return record
+
+
+def test_iter_chunks_pages_by_id(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add_many([(result(invoice_number=f"HD{i}"), f"f{i}.jpg") for i in range(7)])
+    chunks = list(store.iter_chunks(3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [row["invoice_number"] for chunk in chunks for row in chunk] == [f"HD{i}" for i in range(7)]
+    store.close()
+
+
+def test_roi_and_error_results_are_not_kept_for_reextraction(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    store.add_many([
+        (result(), "full.jpg"),
+        (result(ocr_region="roi", full_text="HÓA ĐƠN\nTổng cộng: 150.000"), "roi.jpg"),
+        (result(invoice_number="Không thể trích xuất số hóa đơn", full_text="Lỗi: boom"), "error.jpg"),
+    ])
+    assert store.count() == 3
+    assert [row[1] for row in store.documents(*_id_bounds(store))] == ["full.jpg"]
+    store.close()
+
+
+def test_reextract_skips_rows_without_layout(tmp_path):
+    path = str(tmp_path / "history.db")
+    fields = extract_fields(result()["full_text"])
+    store = HistoryStore(path)
+    store.add_many([(fields, "app.jpg"), ({**fields, "total_amount": "999"}, "stale.jpg")])
+    store.close()
+
+    stats = run_reextract(path, io.StringIO(), workers=1)
+    assert (stats["documents"], stats["skipped"], stats["changed"]) == (0, 2, 0)
+
+    output = io.StringIO()
+    stats = run_reextract(path, output, workers=1, use_layout=False)
+    assert (stats["documents"], stats["skipped"], stats["changed"]) == (2, 0, 1)
+    assert '"stale.jpg"' in output.getvalue()
+
+
+def _id_bounds(store):
+    min_id, max_id = store.id_range()
+    return min_id, max_id + 1
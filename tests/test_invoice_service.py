@@ -0,0 +1,139 @@
+import http.client
+import io
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("google.cloud.vision")
+Image = pytest.importorskip("PIL.Image")
+
+import ocr_backend
+from invoice_service import InvoiceService, create_server
+
+TEXT = "HÓA ĐƠN\nSố: 0001234\nNgày 01/02/2024\nTổng cộng: 1.250.000\n"
+
+
+@pytest.fixture
+def service():
+    backend = ocr_backend.FakeBackend(text=TEXT)
+    previous = ocr_backend.set_backend(backend)
+    service = InvoiceService(workers=2, queue_size=8, batch_wait=0.01)
+    service.start()
+    yield service, backend
+    service.stop()
+    ocr_backend.set_backend(previous)
+
+
+@pytest.fixture
+def server(service):
+    service, backend = service
+    server = create_server(service, "127.0.0.1", 0, request_timeout=10, max_body_bytes=1024)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, service, backend
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=b"", headers=None):
+    """Gửi một yêu cầu với các header đặt sẵn (không tự tính Content-Length), trả về (mã trạng thái, JSON, headers)"""
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    try:
+        connection.putrequest(method, path)
+        for name, value in (headers or {}).items():
+            connection.putheader(name, value)
+        connection.endheaders(body or None)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read()), response
+    finally:
+        connection.close()
+
+
+def multipage_tiff(pages):
+    output = io.BytesIO()
+    frames = [Image.new("L", (64, 64), color=i * 40) for i in range(pages)]
+    frames[0].save(output, format="TIFF", save_all=True, append_images=frames[1:])
+    return output.getvalue()
+
+
+def test_images_are_extracted(service):
+    service, backend = service
+    result = service.submit(b"image-1").result(timeout=10)
+    assert result["invoice_number"] == "0001234"
+    assert "full_text" not in result
+
+
+def test_multipage_tiff_is_ocred_page_by_page(service):
+    service, backend = service
+    result = service.submit(multipage_tiff(3), include_text=True).result(timeout=10)
+    assert result["pages"] == 3
+    assert backend.call_count == 3
+    assert result["full_text"].count("HÓA ĐƠN") == 3
+
+
+def test_http_extract(server):
+    server, _, _ = server
+    status, payload, _ = request(server, "POST", "/extract", b"image-1", {"Content-Length": "7"})
+    assert status == 200
+    assert payload["invoice_number"] == "0001234"
+
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1_0", "+7", "0"])
+def test_http_rejects_invalid_content_length(server, length):
+    server, _, backend = server
+    status, payload, response = request(server, "POST", "/extract", headers={"Content-Length": length})
+    assert status == 400
+    if length != "0":
+        assert response.getheader("Connection") == "close"
+    assert backend.call_count == 0
+
+
+def test_http_rejects_missing_content_length(server):
+    server, _, _ = server
+    assert request(server, "POST", "/extract")[0] == 400
+
+
+def test_http_rejects_oversized_body(server):
+    server, _, backend = server
+    status, payload, response = request(server, "POST", "/extract", headers={"Content-Length": "4096"})
+    assert status == 413
+    assert response.getheader("Connection") == "close"
+    assert backend.call_count == 0
+
+
+def test_http_queue_full(monkeypatch):
+    previous = ocr_backend.set_backend(ocr_backend.FakeBackend(text=TEXT, latency=1.0))
+    service = InvoiceService(workers=1, queue_size=1, batch_wait=0)
+    service.start()
+    server = create_server(service, "127.0.0.1", 0, request_timeout=10)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # Worker duy nhất đang OCR ảnh đầu tiên, ảnh thứ hai lấp đầy hàng đợi
+        first = service.submit(b"queue-full-1")
+        while service.queue_size:
+            time.sleep(0.01)
+        service.submit(b"queue-full-2")
+
+        status, payload, response = request(server, "POST", "/extract", b"queue-full-3", {"Content-Length": "12"})
+        assert status == 429
+        assert response.getheader("Retry-After") == "1"
+        assert first.result(timeout=10)["invoice_number"] == "0001234"
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        ocr_backend.set_backend(previous)
+
+
+def test_http_healthz(server):
+    server, service, _ = server
+    status, payload, _ = request(server, "GET", "/healthz")
+    assert status == 200
+    assert payload == {"status": "ok", "workers": 2, "queue": 0}
+
+    service.stop()
+    status, payload, _ = request(server, "GET", "/healthz")
+    assert status == 503
+    assert payload["status"] == "unavailable"
@@ -0,0 +1,107 @@
+import pytest
+
+vision = pytest.importorskip("google.cloud.vision")
+
+from amount_index import AmountIndex
+from field_scanner import scan_fields
+from layout_index import build_layout, leading_number
+from process_invoice import extract_fields, find_total_by_layout
+
+# Kích thước (pixel) của một ký tự và chiều cao một từ, như tests/fixtures/build_fixtures.py
+CHAR_WIDTH, WORD_HEIGHT = 10, 20
+
+
+def make_word(text, x, y):
+    x1, y1 = x + len(text) * CHAR_WIDTH, y + WORD_HEIGHT
+    box = vision.BoundingPoly(vertices=[vision.Vertex(x=x, y=y), vision.Vertex(x=x1, y=y),
+                                        vision.Vertex(x=x1, y=y1), vision.Vertex(x=x, y=y1)])
+    return vision.Word(bounding_box=box, confidence=0.98, symbols=[vision.Symbol(text=char) for char in text])
+
+
+def make_annotation(text, blocks):
+    """TextAnnotation tổng hợp: mỗi khối là danh sách (từ, x, y) theo thứ tự xuất hiện trong `text`"""
+    page_blocks = [vision.Block(paragraphs=[vision.Paragraph(words=[make_word(*word) for word in words])])
+                   for words in blocks]
+    return vision.TextAnnotation(text=text, pages=[vision.Page(width=600, height=400, blocks=page_blocks)])
+
+
+def layout_total(text, annotation):
+    lines = text.split("\n")
+    return find_total_by_layout(scan_fields(text), build_layout(annotation, text), AmountIndex(lines))
+
+
+def test_value_right_of_label():
+    text = "Tổng cộng: 65.000 đ\n"
+    annotation = make_annotation(text, [[("Tổng", 0, 0), ("cộng:", 50, 0), ("65.000", 200, 0), ("đ", 270, 0)]])
+    layout = build_layout(annotation, text)
+
+    label = layout.word_at(text.index("cộng") + 3)
+    assert label.text == "cộng:"
+    assert [word.text for word in layout.right_of(label)] == ["65.000", "đ"]
+    assert layout_total(text, annotation) == "65.000"
+
+
+def test_value_below_label():
+    text = "Tổng cộng\n1.250.000\n"
+    annotation = make_annotation(text, [[("Tổng", 0, 0), ("cộng", 50, 0)], [("1.250.000", 40, 30)]])
+    layout = build_layout(annotation, text)
+
+    label = layout.word_at(text.index("cộng"))
+    assert layout.right_of(label) == []
+    assert [word.text for word in layout.below(label)] == ["1.250.000"]
+    assert layout_total(text, annotation) == "1.250.000"
+
+
+def test_column_order_text_uses_row_geometry():
+    # Vision trả văn bản theo cột: nhãn trước, giá trị sau; regex sẽ ghép "Tổng cộng:" với số đầu tiên (100.000)
+    text = "Tiền mặt:\nTổng cộng:\n100.000\n65.000\n"
+    annotation = make_annotation(text, [
+        [("Tiền", 0, 0), ("mặt:", 50, 0), ("Tổng", 0, 30), ("cộng:", 50, 30)],
+        [("100.000", 300, 0), ("65.000", 300, 30)],
+    ])
+    assert extract_fields(text)["total_amount"] == "100.000"
+    assert extract_fields(text, annotation)["total_amount"] == "65.000"
+
+
+def test_skewed_row():
+    # Ảnh chụp nghiêng: tung độ tăng 1 pixel mỗi 20 pixel hoành độ, dòng sau cách 30 pixel
+    def skewed(text, x, y):
+        return text, x, y + x // 20
+
+    text = "Tổng cộng: 1.250.000\nTiền thừa: 50.000\n"
+    annotation = make_annotation(text, [
+        [skewed("Tổng", 0, 100), skewed("cộng:", 50, 100), skewed("1.250.000", 160, 100)],
+        [skewed("Tiền", 0, 130), skewed("thừa:", 50, 130), skewed("50.000", 160, 130)],
+    ])
+    layout = build_layout(annotation, text)
+
+    label = layout.word_at(text.index("cộng"))
+    assert [word.text for word in layout.right_of(label)] == ["1.250.000"]
+    assert layout_total(text, annotation) == "1.250.000"
+
+
+def test_falls_back_to_regex_without_geometry():
+    text = "HÓA ĐƠN BÁN LẺ\nSố HĐ: HD0012345\nTổng cộng: 65.000 đ\n"
+    assert build_layout(None) is None
+    assert build_layout(vision.TextAnnotation(text=text)) is None
+    assert extract_fields(text, vision.TextAnnotation(text=text)) == extract_fields(text)
+
+
+def test_label_without_word_box_falls_back_to_regex():
+    # Bố cục không có từ chứa nhãn tổng tiền: tra cứu theo bố cục không tìm được, dùng regex
+    text = "HÓA ĐƠN\nTổng cộng: 65.000 đ\n"
+    annotation = make_annotation(text, [[("HÓA", 0, 0), ("ĐƠN", 40, 0)]])
+    assert layout_total(text, annotation) is None
+    assert extract_fields(text, annotation)["total_amount"] == "65.000"
+
+
+def test_leading_number_joins_adjacent_parts():
+    text = "Tổng : 1.380 .000 đ"
+    annotation = make_annotation(text, [[("Tổng", 0, 0), (":", 50, 0), ("1.380", 70, 0), (".000", 120, 0),
+                                         ("đ", 170, 0)]])
+    words = build_layout(annotation, text).words
+    assert leading_number(words[1:]) == "1.380.000"
+    # Hai số cách xa nhau (hai cột) không được ghép
+    far = make_annotation("1.380 000", [[("1.380", 0, 0), ("000", 200, 0)]])
+    assert leading_number(build_layout(far).words) == "1.380"
+    assert leading_number(words[:1]) is None
@@ -0,0 +1,69 @@
+import pytest
+
+vision = pytest.importorskip("google.cloud.vision")
+
+from ocr_cache import OCRCache
+
+
+def response(text):
+    return vision.AnnotateImageResponse(full_text_annotation=vision.TextAnnotation(text=text))
+
+
+def disk_totals(cache):
+    return cache._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = OCRCache(memory_size=0, db_path=str(tmp_path / "cache.db"), max_entries=3)
+    for i in range(5):
+        cache.put(f"d{i}", response(f"hóa đơn {i}"))
+
+    assert cache.get("d0") is None and cache.get("d1") is None
+    assert cache.get("d4").full_text_annotation.text == "hóa đơn 4"
+    assert cache.stats["evictions"] == 2
+    assert disk_totals(cache) == (cache._disk_count, cache._disk_bytes)
+    assert cache._disk_count == 3
+    cache.close()
+
+
+def test_put_does_not_scan_table_below_limits(tmp_path):
+    cache = OCRCache(memory_size=0, db_path=str(tmp_path / "cache.db"), max_entries=100)
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+    for i in range(10):
+        cache.put(f"d{i}", response(f"hóa đơn {i}"))
+    # Lưu lại cùng mã băm thay thế phần tử cũ, không đếm trùng
+    cache.put("d0", response("hóa đơn 0 - bản mới"))
+
+    assert not any("COUNT(*)" in statement for statement in statements)
+    assert disk_totals(cache) == (cache._disk_count, cache._disk_bytes)
+    assert cache._disk_count == 10
+    cache.close()
+
+
+def test_counters_are_read_when_reopened(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = OCRCache(memory_size=0, db_path=path)
+    for i in range(4):
+        cache.put(f"d{i}", response(f"hóa đơn {i}"))
+    expected = disk_totals(cache)
+    cache.close()
+
+    reopened = OCRCache(memory_size=0, db_path=path, max_bytes=expected[1] // 2)
+    assert (reopened._disk_count, reopened._disk_bytes) == expected
+    reopened.put("d4", response("hóa đơn 4"))
+    assert reopened._disk_bytes <= expected[1] // 2
+    assert disk_totals(reopened) == (reopened._disk_count, reopened._disk_bytes)
+    reopened.close()
+
+
+def test_expired_entries_leave_counters(tmp_path):
+    cache = OCRCache(memory_size=0, db_path=str(tmp_path / "cache.db"), ttl=60)
+    cache.put("old", response("cũ"))
+    cache._db.execute("UPDATE ocr_cache SET created_at = created_at - 120")
+    cache.put("new", response("mới"))
+
+    assert cache.get("old") is None
+    assert disk_totals(cache) == (cache._disk_count, cache._disk_bytes)
+    assert cache._disk_count == 1
+    cache.close()
@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+import pytest
+
+from ocr_backend import OCRBackend, OCRError
+from ocr_scheduler import CircuitBreaker, CircuitOpenError, ScheduledBackend, TokenBucket
+
+
+class FlakyBackend(OCRBackend):
+    """Backend thử: lỗi `status` cho tới khi `healthy`, trả về "ok" sau `latency` giây"""
+
+    def __init__(self, status="UNAVAILABLE", latency=0.0):
+        self.status = status
+        self.latency = latency
+        self.healthy = False
+        self.calls = 0
+
+    def document_text_detection(self, content, timeout=None):
+        self.calls += 1
+        if not self.healthy:
+            raise OCRError("lỗi thử", self.status)
+        time.sleep(self.latency)
+        return "ok"
+
+    async def document_text_detection_async(self, content, timeout=None):
+        self.calls += 1
+        if not self.healthy:
+            raise OCRError("lỗi thử", self.status)
+        await asyncio.sleep(self.latency)
+        return "ok"
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_after_consecutive_failures_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    open_breaker(breaker)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.allow()
+    assert excinfo.value.retry_after > 0
+
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Chỉ một yêu cầu thử được đi qua khi mạch nửa mở
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def test_breaker_reopens_when_probe_fails():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_breaker_allows_new_probe_when_probe_never_reports():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_breaker_reopens_when_probe_is_abandoned():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    open_breaker(breaker)
+    time.sleep(0.06)
+    breaker.allow()
+    breaker.record_abandoned()
+    assert breaker.state == CircuitBreaker.OPEN
+    # Lượt bị bỏ khi mạch đóng không được tính là lỗi
+    closed = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    closed.record_abandoned()
+    assert closed.state == CircuitBreaker.CLOSED
+
+
+def test_probe_that_misses_deadline_while_rate_limited_does_not_wedge_breaker():
+    backend = FlakyBackend()
+    scheduled = ScheduledBackend(backend, rate=1, burst=1, max_retries=0, hedge_after=0, breaker_failures=1,
+                                 breaker_reset=0.05)
+    with pytest.raises(OCRError):
+        scheduled.document_text_detection(b"img")
+    assert scheduled.breaker.state == CircuitBreaker.OPEN
+
+    # Token bucket đã hết lượt: yêu cầu thử hết thời hạn trước khi được gọi
+    time.sleep(0.06)
+    with pytest.raises(OCRError) as excinfo:
+        scheduled.document_text_detection(b"img", timeout=0.1)
+    assert excinfo.value.status == "DEADLINE_EXCEEDED"
+    assert scheduled.breaker.state == CircuitBreaker.OPEN
+
+    backend.healthy = True
+    scheduled.bucket = TokenBucket(0, 1)
+    time.sleep(0.06)
+    assert scheduled.document_text_detection(b"img") == "ok"
+    assert scheduled.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_probe_does_not_wedge_breaker():
+    backend = FlakyBackend(latency=1.0)
+    scheduled = ScheduledBackend(backend, rate=0, max_retries=0, hedge_after=0, breaker_failures=1, breaker_reset=0.05)
+
+    async def scenario():
+        with pytest.raises(OCRError):
+            await scheduled.document_text_detection_async(b"img")
+        await asyncio.sleep(0.06)
+        backend.healthy = True
+        probe = asyncio.ensure_future(scheduled.document_text_detection_async(b"img"))
+        await asyncio.sleep(0.02)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(scenario())
+    assert scheduled.breaker.state == CircuitBreaker.OPEN
+
+
+def test_retries_transient_errors_until_success():
+    class Recovering(FlakyBackend):
+        def document_text_detection(self, content, timeout=None):
+            self.healthy = self.calls >= 2
+            return super().document_text_detection(content, timeout)
+
+    backend = Recovering()
+    scheduled = ScheduledBackend(backend, rate=0, max_retries=3, backoff_base=0.001, backoff_max=0.001, hedge_after=0)
+    assert scheduled.document_text_detection(b"img") == "ok"
+    assert backend.calls == 3
+
+
+def test_permanent_error_is_not_retried():
+    backend = FlakyBackend(status="INVALID_ARGUMENT")
+    scheduled = ScheduledBackend(backend, rate=0, max_retries=3, backoff_base=0.001, hedge_after=0)
+    with pytest.raises(OCRError):
+        scheduled.document_text_detection(b"img")
+    assert backend.calls == 1
+    assert scheduled.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_token_bucket_reserve():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.02)
+    # Quá thời gian chờ cho phép: không giữ chỗ
+    assert bucket.reserve(1, max_wait=0.01) is None
+    assert TokenBucket(rate=0).reserve(100) == 0
+
+
+def test_token_bucket_charges_full_batch_above_burst():
+    bucket = TokenBucket(rate=10, burst=4)
+    # Batch 16 ảnh: 4 lượt có sẵn, chờ 12 lượt còn thiếu
+    assert bucket.reserve(16) == pytest.approx(1.2, abs=0.02)
+    # Batch tiếp theo chờ sau phần đã giữ chỗ của batch trước
+    assert bucket.reserve(16) == pytest.approx(2.8, abs=0.02)
+    assert bucket.reserve(16, max_wait=1.0) is None
@@ -0,0 +1,44 @@
+import asyncio
+import io
+import time
+
+import pytest
+
+import ocr_backend
+import process_invoice
+from process_invoice import extract_fields
+
+TEXT = "HÓA ĐƠN BÁN HÀNG\nSố: 0001234\nNgày 01 tháng 02 năm 2024\nTổng cộng: 1.250.000 đ\n"
+
+
+def test_extract_fields_from_text():
+    result = extract_fields(TEXT)
+    assert result["invoice_number"] == "0001234"
+    assert result["total_amount"] == "1.250.000"
+    assert "2024" in result["date_info"]
+
+
+def test_extract_fields_without_fields():
+    result = extract_fields("xin cảm ơn quý khách")
+    assert result["invoice_number"].startswith("Không tìm thấy")
+    assert result["total_amount"].startswith("Không tìm thấy")
+
+
+def test_async_timeout_covers_roi_and_full_page_ocr(monkeypatch):
+    pytest.importorskip("google.cloud.vision")
+    Image = pytest.importorskip("PIL.Image")
+
+    image = io.BytesIO()
+    Image.new("RGB", (200, 400), "white").save(image, format="JPEG")
+    # Mỗi lời gọi OCR mất 0.3 giây: bước vùng đầu/cuối (không đủ tin cậy) rồi bước toàn trang vượt thời hạn 0.5 giây
+    previous = ocr_backend.set_backend(ocr_backend.FakeBackend(text=TEXT, latency=0.3))
+    monkeypatch.setattr(process_invoice, "TIERED_ENABLED", True)
+    monkeypatch.setattr(process_invoice, "DEDUP_ENABLED", False)
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(process_invoice.extract_invoice_data_async(image.getvalue(), timeout=0.5))
+        elapsed = time.perf_counter() - start
+    finally:
+        ocr_backend.set_backend(previous)
+    assert result["invoice_number"].startswith("Không thể trích xuất")
+    assert elapsed < 0.55
@@ -0,0 +1,36 @@
+import re
+import unicodedata
+
+from text_normalize import NormalizedMatch, NormalizedText, fold
+
+
+def test_fold():
+    assert fold("Tổng Tiền Thanh Toán") == "tong tien thanh toan"
+    assert fold("ĐƠN GIÁ đồng") == "don gia dong"
+    assert fold("Số HĐ: 0001234") == "so hd: 0001234"
+
+
+def test_fold_keeps_length_of_composed_text():
+    text = "Hóa đơn GTGT - Ngày 12 tháng 03"
+    assert len(fold(text)) == len(text)
+    assert NormalizedText(text).original_pos(5) == 5
+
+
+def test_decomposed_text_maps_back_to_original():
+    text = unicodedata.normalize("NFD", "Tổng cộng: 29.000 đồng")
+    normalized = NormalizedText(text)
+    assert normalized.folded == "tong cong: 29.000 dong"
+
+    match = re.search(r"tong cong:\s*([\d\.]+)", normalized.folded)
+    assert normalized.original_span(*match.span(1)) == "29.000"
+    assert normalized.original_span(0, 4) == unicodedata.normalize("NFD", "Tổng")
+    assert normalized.original_pos(normalized.folded_pos(len(text))) == len(text)
+
+
+def test_normalized_match_group_and_positions():
+    text = unicodedata.normalize("NFD", "Số hóa đơn: HD0012345")
+    normalized = NormalizedText(text)
+    match = NormalizedMatch(re.search(r"so hoa don:\s*(\w+)", normalized.folded), normalized)
+    assert match.group(1) == "HD0012345"
+    assert text[match.start(1):match.end(1)] == "HD0012345"
+    assert match.group(0).startswith(unicodedata.normalize("NFD", "Số"))
@@ -0,0 +1,48 @@
+import json
+import os
+import time
+
+import pytest
+
+from process_invoice import extract_by_template
+from vendor_templates import AhoCorasick, TemplateRegistry, VendorClassifier
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "assets", "vendor_templates.example.json")
+
+HIGHLANDS_TEXT = "HIGHLANDS COFFEE\n123 Đường Lê Lợi\nSố HĐ: HL-000123\nNgày: 05/06/2024\nTổng cộng: 58.000\n"
+
+
+def test_aho_corasick_finds_overlapping_keywords():
+    automaton = AhoCorasick([("he", 1), ("she", 2), ("hers", 3)])
+    assert sorted(automaton.iter_matches("ushers")) == [1, 2, 3]
+    assert list(automaton.iter_matches("xyz")) == []
+
+
+def test_classify_and_extract_by_template():
+    with open(EXAMPLE_CONFIG, encoding="utf-8") as f:
+        classifier = VendorClassifier(json.load(f))
+    template = classifier.classify(HIGHLANDS_TEXT)
+    assert template.name == "Highlands Coffee"
+    assert extract_by_template(template, "invoice_number", HIGHLANDS_TEXT) == "HL-000123"
+    assert extract_by_template(template, "total_amount", HIGHLANDS_TEXT) == "58.000"
+    assert classifier.classify("Cửa hàng lạ\nSố: 0001234\n") is None
+
+
+def test_pattern_without_capture_group_is_rejected():
+    with pytest.raises(ValueError):
+        VendorClassifier({"vendors": [{"name": "X", "invoice_number": ["HD\\d+"]}]})
+
+
+def test_reload_keeps_previous_templates_when_new_config_is_invalid(tmp_path):
+    path = tmp_path / "vendors.json"
+    path.write_text(json.dumps({"vendors": [{"name": "X", "invoice_number": ["HD(\\d+)"]}]}), encoding="utf-8")
+    registry = TemplateRegistry(str(path), reload_seconds=0)
+    assert registry.classify("X\nHD123").name == "X"
+
+    path.write_text(json.dumps({"vendors": [{"name": "Y", "invoice_number": ["HD\\d+"]}]}), encoding="utf-8")
+    later = time.time() + 5
+    os.utime(path, (later, later))
+    template = registry.classify("X\nHD123")
+    assert template.name == "X"
+    assert extract_by_template(template, "invoice_number", "X\nHD123") == "123"
@@ -0,0 +1,82 @@
+import unicodedata
+from bisect import bisect_left
+
+
+def _build_fold_table():
+    """
+    Bảng `str.translate` bỏ dấu và chuyển chữ thường: mỗi chữ cái Latin (kể cả chữ tiếng Việt dựng sẵn như
+    "Ố", "ự") thành đúng một chữ cái ASCII thường, "đ"/"Đ" thành "d", các dấu kết hợp (văn bản dạng NFD) bị xóa.
+    Vì không ký tự nào thành nhiều ký tự, vị trí trong văn bản đã chuẩn hóa chỉ lệch khi có dấu kết hợp.
+    """
+    table = {ord('đ'): 'd', ord('Đ'): 'd', ord('ı'): 'i'}
+    for code in (*range(0x41, 0x5B), *range(0xC0, 0x250), *range(0x1E00, 0x1F00)):
+        char = chr(code)
+        base = ''.join(c for c in unicodedata.normalize('NFD', char) if not unicodedata.combining(c)).casefold()
+        if len(base) == 1 and base != char:
+            table.setdefault(code, base)
+    for code in range(0x300, 0x370):
+        table[code] = None
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold(text):
+    """Bản bỏ dấu, chữ thường của `text` (ví dụ "Tổng Tiền" -> "tong tien")"""
+    return text.translate(_FOLD_TABLE)
+
+
+class NormalizedText:
+    """
+    Văn bản OCR và bản đã chuẩn hóa (`fold`) của nó, tạo một lần cho mỗi hóa đơn.
+
+    Từ khóa và mẫu regex được so trên `folded` (chỉ cần viết một dạng không dấu, chữ thường), còn giá trị
+    trả về được cắt từ `original` theo bảng ánh xạ vị trí, nên vẫn giữ nguyên chữ hoa và dấu.
+    """
+
+    def __init__(self, text):
+        self.original = text
+        self.folded = fold(text)
+        # Vị trí trong văn bản gốc của từng ký tự đã chuẩn hóa (kèm vị trí cuối), None nếu trùng nhau
+        # (trường hợp thường gặp: văn bản dạng NFC, không có dấu kết hợp bị xóa)
+        self._offsets = None
+        if len(self.folded) != len(text):
+            self._offsets = [i for i, char in enumerate(text) if ord(char) not in _FOLD_TABLE
+                             or _FOLD_TABLE[ord(char)] is not None]
+            self._offsets.append(len(text))
+
+    def original_pos(self, pos):
+        """Vị trí trong văn bản gốc tương ứng với vị trí `pos` trong văn bản đã chuẩn hóa"""
+        return pos if self._offsets is None else self._offsets[pos]
+
+    def folded_pos(self, pos):
+        """Vị trí trong văn bản đã chuẩn hóa tương ứng với vị trí `pos` trong văn bản gốc"""
+        return pos if self._offsets is None else bisect_left(self._offsets, pos)
+
+    def original_span(self, start, end):
+        """Đoạn văn bản gốc tương ứng với đoạn [start, end) của văn bản đã chuẩn hóa"""
+        return self.original[self.original_pos(start):self.original_pos(end)]
+
+
+class NormalizedMatch:
+    """
+    Kết quả khớp một regex trên văn bản đã chuẩn hóa, với cùng giao diện `group`/`start`/`end` như `re.Match`
+    nhưng giá trị và vị trí tính theo văn bản gốc.
+    """
+
+    __slots__ = ('match', 'text')
+
+    def __init__(self, match, text):
+        self.match = match
+        self.text = text
+
+    def group(self, index=0):
+        start, end = self.match.span(index)
+        return None if start == -1 else self.text.original_span(start, end)
+
+    def start(self, index=0):
+        return self.text.original_pos(self.match.start(index))
+
+    def end(self, index=0):
+        return self.text.original_pos(self.match.end(index))
@@ -0,0 +1,149 @@
+import io
+import logging
+import os
+import re
+from collections import namedtuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường
+DEFAULT_ENABLED = os.environ.get("OCR_TIERED", "0") == "1"
+DEFAULT_HEADER_RATIO = float(os.environ.get("OCR_TIER_HEADER_RATIO", "0.3"))
+DEFAULT_FOOTER_RATIO = float(os.environ.get("OCR_TIER_FOOTER_RATIO", "0.4"))
+DEFAULT_MAX_DIMENSION = int(os.environ.get("OCR_TIER_MAX_DIMENSION", "1600"))
+DEFAULT_MIN_CONFIDENCE = float(os.environ.get("OCR_TIER_MIN_CONFIDENCE", "0.85"))
+DEFAULT_JPEG_QUALITY = int(os.environ.get("OCR_TIER_JPEG_QUALITY", "85"))
+
+# Khoảng trắng (pixel) giữa phần đầu và phần cuối khi ghép, để hai vùng không bị đọc thành một dòng
+_SEPARATOR_HEIGHT = 32
+
+_NOT_FOUND_PREFIXES = ("Không tìm thấy", "Không thể trích xuất")
+_ALNUM_RE = re.compile(r'[^0-9A-Za-z]')
+
+# Vùng ảnh gửi OCR ở bước đầu:
+# - content: ảnh JPEG ghép phần đầu và phần cuối hóa đơn (đã thu nhỏ)
+# - pixels: số điểm ảnh của vùng, full_pixels: số điểm ảnh của ảnh gốc
+RegionOfInterest = namedtuple('RegionOfInterest', ['content', 'pixels', 'full_pixels'])
+
+TIERED_DOCUMENTS = metrics.Counter(
+    "invoice_tiered_documents_total",
+    "Số ảnh xử lý ở chế độ OCR theo vùng, theo kết quả (roi: đủ tin cậy, escalated: phải OCR toàn trang, skipped)",
+    labels=("outcome",),
+)
+TIERED_PIXELS = metrics.Counter(
+    "invoice_tiered_pixels_total",
+    "Số điểm ảnh ở chế độ OCR theo vùng (sent: đã gửi OCR, full: nếu gửi toàn trang như trước)",
+    labels=("kind",),
+)
+metrics.REGISTRY.extend([TIERED_DOCUMENTS, TIERED_PIXELS])
+
+
+def build_roi(content, header_ratio=DEFAULT_HEADER_RATIO, footer_ratio=DEFAULT_FOOTER_RATIO,
+              max_dimension=DEFAULT_MAX_DIMENSION, quality=DEFAULT_JPEG_QUALITY):
+    """
+    Ghép phần đầu (số hóa đơn, ngày) và phần cuối (tổng tiền) của ảnh thành một ảnh xám thu nhỏ,
+    để bước OCR đầu tiên chỉ cần một lời gọi với ít điểm ảnh hơn nhiều so với toàn trang.
+    Nếu `header_ratio + footer_ratio >= 1` thì chỉ thu nhỏ toàn bộ ảnh.
+
+    Returns:
+        RegionOfInterest: None nếu không có Pillow hoặc không đọc được ảnh.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Chưa cài Pillow, bỏ qua chế độ OCR theo vùng")
+        return None
+
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            full_pixels = image.width * image.height
+            image.draft("L", (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image).convert("L")
+            width, height = image.size
+
+            header_height = int(height * header_ratio)
+            footer_height = int(height * footer_ratio)
+            if header_height + footer_height >= height:
+                roi = image
+            else:
+                roi = Image.new("L", (width, header_height + _SEPARATOR_HEIGHT + footer_height), 255)
+                roi.paste(image.crop((0, 0, width, header_height)), (0, 0))
+                roi.paste(image.crop((0, height - footer_height, width, height)),
+                          (0, header_height + _SEPARATOR_HEIGHT))
+            roi.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            output = io.BytesIO()
+            roi.save(output, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Không thể tạo vùng OCR: {e}")
+        return None
+
+    return RegionOfInterest(output.getvalue(), roi.width * roi.height, full_pixels)
+
+
+def value_confidence(annotation, value):
+    """
+    Độ tin cậy của Vision cho một giá trị đã trích xuất: độ tin cậy thấp nhất trong các từ tạo nên giá trị
+    (so theo chữ và số, bỏ dấu phân cách). Trả về None nếu không tìm thấy từ nào.
+    """
+    target = _ALNUM_RE.sub('', value).upper()
+    if not target:
+        return None
+    # Bỏ qua các từ quá ngắn (ví dụ số lượng "1") để chúng không làm sai độ tin cậy của giá trị dài
+    min_length = min(3, len(target))
+
+    confidence = None
+    for page in annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    text = _ALNUM_RE.sub('', ''.join(symbol.text for symbol in word.symbols)).upper()
+                    if len(text) >= min_length and text in target:
+                        confidence = word.confidence if confidence is None else min(confidence, word.confidence)
+    return confidence
+
+
+def is_confident(annotation, result, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """Kết quả từ vùng OCR có đủ số hóa đơn và tổng tiền, với độ tin cậy từng giá trị không dưới ngưỡng"""
+    for field in ('invoice_number', 'total_amount'):
+        value = result[field]
+        if value.startswith(_NOT_FOUND_PREFIXES):
+            return False
+        confidence = value_confidence(annotation, value)
+        if confidence is None or confidence < min_confidence:
+            return False
+    return True
+
+
+def record_outcome(roi, escalated):
+    """Ghi nhận kết quả của một ảnh ở chế độ theo vùng (`roi` None nghĩa là không tạo được vùng OCR)"""
+    if roi is None:
+        TIERED_DOCUMENTS.inc("skipped")
+        return
+    TIERED_DOCUMENTS.inc("escalated" if escalated else "roi")
+    TIERED_PIXELS.inc("sent", amount=roi.pixels + (roi.full_pixels if escalated else 0))
+    TIERED_PIXELS.inc("full", amount=roi.full_pixels)
+
+
+def tiered_summary():
+    """
+    Thống kê tiết kiệm của chế độ OCR theo vùng từ khi tiến trình chạy.
+
+    Returns:
+        dict: Số ảnh theo kết quả, số lời gọi OCR toàn trang tránh được, số lời gọi phát sinh thêm
+        do phải OCR lại toàn trang, và số điểm ảnh tiết kiệm được (âm nếu phải OCR lại quá nhiều).
+    """
+    accepted = TIERED_DOCUMENTS.value("roi")
+    escalated = TIERED_DOCUMENTS.value("escalated")
+    return {
+        "documents": accepted + escalated + TIERED_DOCUMENTS.value("skipped"),
+        "roi_accepted": accepted,
+        "escalated": escalated,
+        "skipped": TIERED_DOCUMENTS.value("skipped"),
+        "full_calls_avoided": accepted,
+        "extra_calls": escalated,
+        "pixels_sent": TIERED_PIXELS.value("sent"),
+        "pixels_saved": TIERED_PIXELS.value("full") - TIERED_PIXELS.value("sent"),
+    }
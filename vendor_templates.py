@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+import metrics
+from text_normalize import fold
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình mặc định, có thể ghi đè bằng biến môi trường (không đặt VENDOR_TEMPLATES thì không dùng mẫu riêng)
+DEFAULT_CONFIG_PATH = os.environ.get("VENDOR_TEMPLATES")
+DEFAULT_HEADER_LINES = int(os.environ.get("VENDOR_HEADER_LINES", "8"))
+DEFAULT_RELOAD_SECONDS = float(os.environ.get("VENDOR_TEMPLATES_RELOAD_SECONDS", "5"))
+
+# Các trường có thể khai báo mẫu riêng cho từng nhà cung cấp
+TEMPLATE_FIELDS = ("invoice_number", "total_amount", "date_info")
+
+# Mã số thuế khớp được coi là bằng chứng mạnh hơn tên (tên có thể trùng một phần giữa các chuỗi cửa hàng)
+_TAX_CODE_WEIGHT = 3
+
+_SPACE_RE = re.compile(r'\s+')
+
+# Mẫu đã biên dịch của một nhà cung cấp: {trường: [regex có một nhóm bắt giá trị]}
+VendorTemplate = namedtuple('VendorTemplate', ['name', 'patterns'])
+
+VENDOR_MATCHES = metrics.Counter(
+    "invoice_vendor_matches_total", "Số hóa đơn theo nhà cung cấp nhận diện được (unknown: dùng luồng chung)",
+    labels=("vendor",),
+)
+metrics.REGISTRY.append(VENDOR_MATCHES)
+
+
+def normalize(text):
+    """Bỏ dấu, chữ thường, gộp khoảng trắng: tên trong cấu hình và văn bản OCR được so trên cùng dạng này"""
+    return _SPACE_RE.sub(' ', fold(text))
+
+
+class AhoCorasick:
+    """
+    Automaton Aho–Corasick: tìm mọi từ khóa trong văn bản bằng một lượt duyệt,
+    thời gian không phụ thuộc số từ khóa (hàng chục chuỗi cửa hàng, hàng trăm tên và mã số thuế).
+    """
+
+    def __init__(self, keywords):
+        """`keywords` là các cặp (từ khóa đã chuẩn hóa, giá trị)"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword, value in keywords:
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(value)
+
+        # Tính liên kết thất bại theo chiều rộng; kết quả của trạng thái thất bại được gộp sẵn
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text):
+        """Các giá trị của mọi từ khóa xuất hiện trong `text` (theo thứ tự vị trí kết thúc)"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                yield from output[state]
+
+
+def _compile_pattern(vendor, field, pattern):
+    """Biên dịch regex của mẫu; báo `ValueError` nếu không có nhóm 1 chứa giá trị (cấu hình không hợp lệ)"""
+    compiled = re.compile(pattern, re.IGNORECASE)
+    if compiled.groups < 1:
+        raise ValueError(f"Mẫu {field} của {vendor} không có nhóm bắt giá trị: {pattern!r}")
+    return compiled
+
+
+class VendorClassifier:
+    """
+    Nhận diện nhà cung cấp từ vài dòng đầu hóa đơn (tên cửa hàng, mã số thuế) và trả về mẫu trích xuất
+    đã biên dịch của nhà cung cấp đó.
+    """
+
+    def __init__(self, config, header_lines=DEFAULT_HEADER_LINES):
+        self.header_lines = header_lines
+        self.templates = {}
+        keywords = []
+        for vendor in config.get("vendors", []):
+            name = vendor["name"]
+            self.templates[name] = VendorTemplate(name, {
+                field: [_compile_pattern(name, field, pattern) for pattern in vendor.get(field, [])]
+                for field in TEMPLATE_FIELDS
+            })
+            keywords.extend((normalize(keyword), (name, 1)) for keyword in vendor.get("keywords", [name]))
+            keywords.extend((normalize(code), (name, _TAX_CODE_WEIGHT)) for code in vendor.get("tax_codes", []))
+        self._automaton = AhoCorasick(keywords)
+
+    def classify(self, full_text):
+        """Mẫu của nhà cung cấp khớp nhiều nhất trong các dòng đầu, None nếu không nhận ra"""
+        header = normalize('\n'.join(full_text.split('\n', self.header_lines)[:self.header_lines]))
+        scores = {}
+        for name, weight in self._automaton.iter_matches(header):
+            scores[name] = scores.get(name, 0) + weight
+        if not scores:
+            VENDOR_MATCHES.inc("unknown")
+            return None
+        name = max(scores, key=scores.get)
+        VENDOR_MATCHES.inc(name)
+        return self.templates[name]
+
+
+class TemplateRegistry:
+    """
+    Bộ nhận diện nạp từ file cấu hình JSON, tự nạp lại khi file thay đổi (kiểm tra thời điểm sửa file
+    tối đa mỗi `reload_seconds` giây). Nếu file mới lỗi, tiếp tục dùng cấu hình cũ.
+    """
+
+    def __init__(self, path=DEFAULT_CONFIG_PATH, reload_seconds=DEFAULT_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._classifier = None
+        self._mtime = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self._classifier is not None:
+                logger.warning(f"Không đọc được cấu hình mẫu nhà cung cấp {self.path}: {e}")
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                classifier = VendorClassifier(json.load(f))
+        except (OSError, ValueError, KeyError, re.error) as e:
+            logger.warning(f"Cấu hình mẫu nhà cung cấp {self.path} không hợp lệ, giữ cấu hình cũ: {e}")
+            self._mtime = mtime
+            return
+        self._classifier, self._mtime = classifier, mtime
+        logger.info(f"Đã nạp {len(classifier.templates)} mẫu nhà cung cấp từ {self.path}")
+
+    def get_classifier(self):
+        """Bộ nhận diện hiện tại (nạp lại nếu file cấu hình đã thay đổi), None nếu không có cấu hình"""
+        if not self.path:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_seconds:
+            with self._lock:
+                if now - self._checked_at >= self.reload_seconds:
+                    self._load()
+                    self._checked_at = now
+        return self._classifier
+
+    def classify(self, full_text):
+        classifier = self.get_classifier()
+        return classifier.classify(full_text) if classifier is not None else None
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    """Lấy bộ mẫu nhà cung cấp dùng chung cho toàn tiến trình"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry()
+    return _registry
+
+
+def set_template_registry(registry):
+    """Thay bộ mẫu nhà cung cấp dùng chung, trả về bộ cũ"""
+    global _registry
+    with _registry_lock:
+        previous, _registry = _registry, registry
+    return previous